@@ -0,0 +1,165 @@
+# analytics_reader.py
+# 診斷 / 分析腳本共用的讀取介面：只讀需要的欄位與 order_date 區間，不再每支腳本各自 pd.read_csv 整份檔案
+#   read_orders(path, columns, start_date, end_date)   檔案不存在時丟出 FileNotFoundError
+#     - .parquet：只讀指定欄位，order_date 條件交給 pyarrow 依 row group 統計值略過不相關的 row group
+#     - CSV 主檔：展開一般 / B2B 平台分區；有統計目錄（stats_catalog.py）時先略過日期範圍不重疊的分區，
+#       其餘以 usecols 只解析需要的欄位，有日期條件時分段讀取、逐段篩選，記憶體只保留符合的列
+#   read_table(table_code, columns, start_date, end_date)
+#     - 依月份分區的 B / C 表（b_table_store.py）：只讀日期區間涵蓋的月份分區
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from b_table_store import read_partitions
+from platform_routing import PLATFORM_CLASSES, platform_partition_paths
+from stats_catalog import load_stats_catalog, stats_catalog_path
+
+DATE_COLUMN = 'order_date'
+DEFAULT_CHUNKSIZE = 200_000
+
+
+def to_date(value):
+    """'YYYY-MM-DD' / datetime / None → datetime.date（None 表示不限）"""
+    return None if value is None else pd.Timestamp(value).date()
+
+
+def date_mask(values, start_date=None, end_date=None):
+    """order_date 落在 [start_date, end_date]（含兩端）的列；無法解析的日期一律排除"""
+    dates = pd.to_datetime(values, errors='coerce').dt.normalize()
+    mask = dates.notna()
+    if start_date is not None:
+        mask &= dates >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= dates <= pd.Timestamp(end_date)
+    return mask
+
+
+def _projection(columns, filtering):
+    """實際要讀取的欄位：有日期條件時另外讀取 order_date（回傳前再去掉）"""
+    if columns is None:
+        return None
+    return list(dict.fromkeys([*columns, DATE_COLUMN] if filtering else columns))
+
+
+def _finish(df, columns):
+    return df if columns is None else df[list(columns)]
+
+
+def read_parquet(path, columns=None, start_date=None, end_date=None):
+    """讀取 Parquet：欄位投影 + order_date 條件下推（以 row group 的最小 / 最大值略過整個 row group）"""
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    filtering = start_date is not None or end_date is not None
+    filters = None
+    if filtering:
+        # bq_schema.write_parquet 的 order_date 為 DATE；其他來源若存成文字則以 'YYYY-MM-DD' 比較
+        field = pq.read_schema(path).field(DATE_COLUMN)
+        as_value = (lambda d: d) if 'date' in str(field.type) else (lambda d: d.strftime('%Y-%m-%d'))
+        filters = [(DATE_COLUMN, op, as_value(d)) for op, d in (('>=', start_date), ('<=', end_date)) if d is not None]
+    table = pq.read_table(path, columns=_projection(columns, filtering), filters=filters)
+    return _finish(table.to_pandas(), columns)
+
+
+def catalog_date_ranges(master_path):
+    """由統計目錄取得各平台分區的 order_date 範圍 {分區檔名: (最小, 最大)}。
+
+    目錄比分區檔舊（分區在目錄之後被改寫過）時不採用，回傳空 dict。"""
+    path = stats_catalog_path(master_path)
+    catalog = load_stats_catalog(path)
+    if catalog is None:
+        return {}
+    catalog_mtime = os.path.getmtime(path)
+    ranges = {}
+    for partition in catalog["partitions"].values():
+        partition_path = os.path.join(os.path.dirname(master_path), partition["file"])
+        if not os.path.exists(partition_path) or os.path.getmtime(partition_path) > catalog_mtime:
+            continue
+        mins = [shop["min_order_date"] for shop in partition["shops"] if shop.get("min_order_date")]
+        maxs = [shop["max_order_date"] for shop in partition["shops"] if shop.get("max_order_date")]
+        ranges[partition["file"]] = (to_date(min(mins)), to_date(max(maxs))) if mins else (None, None)
+    return ranges
+
+
+def _overlaps(date_range, start_date, end_date):
+    if date_range is None:
+        # 統計目錄沒有這個分區（或已過期），無法判斷，照常讀取
+        return True
+    low, high = date_range
+    if low is None:
+        # 分區內沒有任何可解析的 order_date，日期條件下不會有符合的列
+        return False
+    return (end_date is None or low <= end_date) and (start_date is None or high >= start_date)
+
+
+def csv_sources(path, start_date=None, end_date=None, b2b_suffix='_B2B'):
+    """要讀取的 CSV：主檔展開為存在的平台分區，有日期條件時略過統計目錄顯示範圍不重疊的分區"""
+    if b2b_suffix is None:
+        return [path] if os.path.exists(path) else []
+    paths = platform_partition_paths(path, b2b_suffix=b2b_suffix)
+    ranges = catalog_date_ranges(path) if start_date is not None or end_date is not None else {}
+    return [
+        paths[platform] for platform in PLATFORM_CLASSES
+        if os.path.exists(paths[platform])
+        and _overlaps(ranges.get(os.path.basename(paths[platform])), start_date, end_date)
+    ]
+
+
+def read_csv_filtered(path, columns=None, start_date=None, end_date=None, chunksize=DEFAULT_CHUNKSIZE, **read_csv_kwargs):
+    """以 usecols 只解析需要的欄位；有日期條件時分段讀取並逐段篩選"""
+    filtering = start_date is not None or end_date is not None
+    usecols = _projection(columns, filtering)
+    if not filtering:
+        return pd.read_csv(path, usecols=usecols, **read_csv_kwargs)
+    chunks = [
+        chunk[date_mask(chunk[DATE_COLUMN], start_date, end_date)]
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize, **read_csv_kwargs)
+    ]
+    if not chunks:
+        # 只有表頭的檔案不會產生任何分段
+        return pd.read_csv(path, usecols=columns, nrows=0, **read_csv_kwargs)
+    return _finish(pd.concat(chunks, ignore_index=True), columns)
+
+
+def read_orders(path, columns=None, start_date=None, end_date=None, b2b_suffix='_B2B',
+                chunksize=DEFAULT_CHUNKSIZE, **read_csv_kwargs):
+    """讀取主檔 / 輸出檔中需要的欄位與 order_date 區間（含兩端）。
+
+    columns=None 表示全部欄位；start_date / end_date 為 None 表示不限。
+    CSV 預設全字串讀取（dtype=str，可由 read_csv_kwargs 覆寫）；b2b_suffix=None 時不展開平台分區。
+    檔案都不存在時丟出 FileNotFoundError（與直接 pd.read_csv 相同）。"""
+    if path.endswith('.parquet'):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到檔案: {path}")
+        return read_parquet(path, columns, start_date, end_date)
+
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    read_csv_kwargs.setdefault('dtype', str)
+    sources = csv_sources(path, start_date, end_date, b2b_suffix)
+    if not sources:
+        # 分區都被日期條件略過時只讀表頭，回傳保留欄位的空表
+        existing = csv_sources(path, b2b_suffix=b2b_suffix)
+        if not existing:
+            raise FileNotFoundError(f"找不到檔案: {path}")
+        return pd.read_csv(existing[0], usecols=columns, nrows=0, **read_csv_kwargs)
+    frames = [
+        read_csv_filtered(source, columns, start_date, end_date, chunksize, **read_csv_kwargs)
+        for source in sources
+    ]
+    # 沒有資料的分區（例如只有表頭的 B2B 分區）不參與合併，避免推斷出的欄位型態被改成 object
+    return pd.concat([frame for frame in frames if not frame.empty] or frames[:1], ignore_index=True)
+
+
+def read_table(table_code, columns=None, start_date=None, end_date=None, **read_csv_kwargs):
+    """讀取依月份分區的 B / C 表：只讀日期區間涵蓋的月份分區，再篩選到日。沒有分區時回傳 None"""
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    filtering = start_date is not None or end_date is not None
+    read_csv_kwargs.setdefault('dtype', str)
+    df = read_partitions(
+        table_code,
+        start_date.strftime('%Y-%m') if start_date else None,
+        end_date.strftime('%Y-%m') if end_date else None,
+        usecols=_projection(columns, filtering), **read_csv_kwargs
+    )
+    if df is None or not filtering:
+        return df
+    return _finish(df[date_mask(df[DATE_COLUMN], start_date, end_date)].reset_index(drop=True), columns)
@@ -1,9 +1,19 @@
-import pandas as pd
+from analytics_reader import read_orders
+from platform_routing import platform_partition_paths, rebuild_stats_catalog
+from stats_catalog import load_stats_catalog, stats_catalog_path, column_null_counts
+
+# 欄位型態與隨機抽樣只看前幾列，筆數與空值統計取自主檔的統計目錄，不必讀取整份主檔
+SAMPLE_ROWS = 10000
 
 def analyze_csv(input_csv, output_txt):
-    df = pd.read_csv(input_csv)
+    df = read_orders(input_csv, nrows=SAMPLE_ROWS, dtype=None)
+    catalog = load_stats_catalog(stats_catalog_path(input_csv))
+    if catalog is None:
+        catalog = rebuild_stats_catalog(platform_partition_paths(input_csv))
+    total_rows = sum(partition["rows"] for partition in catalog["partitions"].values())
 
     with open(output_txt, 'w', encoding='utf-8') as f:
+        f.write(f"總筆數: {total_rows}\n\n")
         f.write("欄位名稱:\n")
         for col in df.columns:
             f.write(f"- {col}\n")
@@ -11,15 +21,15 @@ def analyze_csv(input_csv, output_txt):
         f.write("\n前5筆資料範例:\n")
         f.write(df.head().to_string())
 
-        f.write("\n\n隨機抽5筆資料範例:\n")
+        f.write(f"\n\n隨機抽5筆資料範例（取自各分區前 {SAMPLE_ROWS} 筆）:\n")
         sample_df = df.sample(n=5) if len(df) >= 5 else df
         f.write(sample_df.to_string())
 
-        f.write("\n\n欄位資料型態:\n")
+        f.write(f"\n\n欄位資料型態（依各分區前 {SAMPLE_ROWS} 筆推斷）:\n")
         f.write(df.dtypes.to_string())
 
-        f.write("\n\n空值統計:\n")
-        f.write(df.isnull().sum().to_string())
+        f.write("\n\n空值統計（NaN 或空字串，全部資料）:\n")
+        f.write(column_null_counts(catalog, df.columns).to_string())
 
 if __name__ == "__main__":
     input_csv = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned.csv"
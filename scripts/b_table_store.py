@@ -0,0 +1,124 @@
+# b_table_store.py
+# B01–B04（與星狀結構的事實表、C 開頭的彙總表）依 order_date 月份分區儲存，讓每次 ETL 只改寫受影響的分區
+#   <B_TABLE_PARTITION_DIR>/<表名>/order_month=YYYY-MM.csv
+#   order_date 無法解析的訂單放在 order_month=unknown.csv
+import glob
+import os
+import shutil
+
+import pandas as pd
+
+from config import B_TABLE_PARTITION_DIR, B_TABLE_FILES, STAR_SCHEMA_FACT_FILES, ROLLUP_TABLE_FILES
+
+UNKNOWN_PARTITION = 'unknown'
+# 以月份分區儲存的表：表代號 → 檔名
+PARTITIONED_TABLE_FILES = {**B_TABLE_FILES, **STAR_SCHEMA_FACT_FILES, **ROLLUP_TABLE_FILES}
+
+
+def partition_keys(order_dates):
+    """由 'YYYY-MM-DD' 文字日期取得月份分區代號"""
+    keys = pd.Series(order_dates, dtype=object).fillna('').astype(str).str[:7]
+    return keys.where(keys.str.fullmatch(r'\d{4}-\d{2}'), UNKNOWN_PARTITION)
+
+
+def table_dir(table_code):
+    return os.path.join(B_TABLE_PARTITION_DIR, os.path.splitext(PARTITIONED_TABLE_FILES[table_code])[0])
+
+
+def partition_path(table_code, key):
+    return os.path.join(table_dir(table_code), f'order_month={key}.csv')
+
+
+def list_partitions(table_code):
+    return sorted(glob.glob(os.path.join(table_dir(table_code), 'order_month=*.csv')))
+
+
+def partition_key_of(path):
+    return os.path.splitext(os.path.basename(path))[0].split('=', 1)[1]
+
+
+def read_partitions(table_code, start_key=None, end_key=None, **read_csv_kwargs):
+    """讀取分區並合併；指定 start_key / end_key（'YYYY-MM'）時只讀取範圍內的月份（不含 unknown）"""
+    paths = list_partitions(table_code)
+    if start_key or end_key:
+        paths = [
+            path for path in paths
+            if partition_key_of(path) != UNKNOWN_PARTITION
+            and (start_key is None or partition_key_of(path) >= start_key)
+            and (end_key is None or partition_key_of(path) <= end_key)
+        ]
+    frames = [pd.read_csv(path, **read_csv_kwargs) for path in paths]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def has_partitions(table_code):
+    return os.path.isdir(table_dir(table_code))
+
+
+def reset_partitions():
+    """刪除所有分區，下次執行時改為全量重建（增量更新中途失敗時使用，避免分區與主檔不一致）"""
+    if os.path.isdir(B_TABLE_PARTITION_DIR):
+        shutil.rmtree(B_TABLE_PARTITION_DIR)
+
+
+def _write_partition(path, part):
+    if part.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    part.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def write_all_partitions(table_code, df):
+    """全量重建：依月份拆分整張表，並刪除已不存在的舊分區"""
+    os.makedirs(table_dir(table_code), exist_ok=True)
+    keys = partition_keys(df['order_date']).to_numpy()
+    written = set()
+    for key, part in df.groupby(keys, sort=True):
+        path = partition_path(table_code, key)
+        _write_partition(path, part)
+        written.add(path)
+    for path in list_partitions(table_code):
+        if path not in written:
+            os.remove(path)
+    return len(written)
+
+
+def patch_partitions(table_code, recomputed, affected_keys, touched_keys, key_column='order_sn', sort_by=None):
+    """增量更新：只改寫 touched_keys 與重算資料所在的分區。
+
+    每個分區先刪除 key_column 屬於 affected_keys 的舊列，再附加由主檔重算後的新列。
+    B 表以 order_sn 為重算單位，依日期彙總的表則以 order_date 為單位。
+    sort_by 指定時分區內依該欄位重新排序（例如 B01 原本即依 order_sn 排序）。回傳改寫的分區數。"""
+    os.makedirs(table_dir(table_code), exist_ok=True)
+    keys = partition_keys(recomputed['order_date']).to_numpy()
+    patched = 0
+    for key in sorted(set(touched_keys) | set(keys)):
+        path = partition_path(table_code, key)
+        if os.path.exists(path):
+            existing = pd.read_csv(path, dtype=str, keep_default_na=False)
+            existing = existing[~existing[key_column].isin(affected_keys)]
+        else:
+            existing = recomputed.iloc[0:0]
+        frames = [frame for frame in (existing, recomputed[keys == key]) if not frame.empty]
+        part = pd.concat(frames, ignore_index=True) if frames else existing
+        if sort_by:
+            part = part.sort_values(sort_by, kind='stable')
+        _write_partition(path, part)
+        patched += 1
+    return patched
+
+
+def assemble_flat_file(table_code, output_path, columns):
+    """把各分區以位元組直接串接成單一 CSV（略過後續分區的表頭），不需重新解析"""
+    partitions = list_partitions(table_code)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if not partitions:
+        pd.DataFrame(columns=columns).to_csv(output_path, index=False, encoding='utf-8-sig')
+        return
+    with open(output_path, 'wb') as out:
+        for index, path in enumerate(partitions):
+            with open(path, 'rb') as part:
+                if index > 0:
+                    part.readline()
+                shutil.copyfileobj(part, out)
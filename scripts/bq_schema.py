@@ -0,0 +1,121 @@
+# bq_schema.py
+# 由 config.BQ_SCHEMA 衍生各輸出表的 BigQuery schema，並把全字串 CSV 轉成對應型別
+#   - 與主檔同名的欄位直接沿用 BQ_SCHEMA 的型別與說明
+#   - B01 串接 / 加總欄位與 C 開頭衍生表的欄位定義在 DERIVED_FIELDS
+#   - 其餘未定義的欄位一律視為 STRING
+# 供 nested_export.py（巢狀 JSON）與 upload_to_bq.py（Parquet 上傳）共用
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud.bigquery import SchemaField
+
+from config import BQ_SCHEMA
+from voucher_cube import VOUCHER_BIN_COLUMNS
+
+DERIVED_FIELDS = {field.name: field for field in [
+    # B01 訂單聚合表
+    SchemaField("product_name_list", "STRING", description="商品名稱（; 串接）"),
+    SchemaField("product_sku_main_list", "STRING", description="主商品貨號（; 串接）"),
+    # 加總沿用原本的文字格式，含空值的訂單會輸出 '3.0'，以 FLOAT64 載入（CSV 串流上傳不做轉型）
+    SchemaField("total_quantity", "FLOAT64", description="總數量"),
+    SchemaField("total_return_quantity", "FLOAT64", description="總退貨數量"),
+    # C01 每日 商店 × SKU 銷售彙總
+    SchemaField("order_count", "INT64", description="訂單數"),
+    SchemaField("cancelled_order_count", "INT64", description="不成立訂單數"),
+    SchemaField("units", "INT64", description="銷售數量"),
+    SchemaField("return_units", "INT64", description="退貨數量"),
+    SchemaField("gross_sales", "FLOAT64", description="銷售總額"),
+    SchemaField("net_sales", "FLOAT64", description="銷售淨額"),
+    SchemaField("fees", "FLOAT64", description="分攤手續費"),
+    # C02 優惠券彙總
+    SchemaField("voucher_type", "STRING", description="優惠券欄位"),
+    SchemaField("used_count", "INT64", description="有使用的訂單數"),
+    SchemaField("zero_count", "INT64", description="未使用的訂單數"),
+    SchemaField("null_count", "INT64", description="空值或異常的訂單數"),
+    SchemaField("used_amount", "FLOAT64", description="折扣總金額"),
+    SchemaField("used_amount_min", "FLOAT64", description="最小折扣金額"),
+    SchemaField("used_amount_max", "FLOAT64", description="最大折扣金額"),
+    *[SchemaField(col, "INT64", description="折扣金額分佈") for col in VOUCHER_BIN_COLUMNS],
+    # C03 買家彙總
+    SchemaField("first_order_date", "DATE", description="首購日期"),
+    SchemaField("last_order_date", "DATE", description="最近訂單日期"),
+    SchemaField("return_count", "INT64", description="有退貨的訂單數"),
+    SchemaField("lifetime_spend", "FLOAT64", description="累計消費金額"),
+    # C04 / C05 出貨 SLA
+    SchemaField("handling_hours", "FLOAT64", description="付款到出貨時數"),
+    SchemaField("hours_late", "FLOAT64", description="逾期時數（負值為提前）"),
+    SchemaField("is_shipped", "INT64", description="是否已出貨"),
+    SchemaField("is_late", "INT64", description="是否逾期出貨"),
+    SchemaField("sla_status", "STRING", description="出貨時效狀態"),
+    SchemaField("cancelled_orders", "INT64", description="不成立訂單數"),
+    SchemaField("shipped_orders", "INT64", description="已出貨訂單數"),
+    SchemaField("late_orders", "INT64", description="逾期出貨訂單數"),
+    SchemaField("on_time_orders", "INT64", description="準時出貨訂單數"),
+    SchemaField("on_time_rate", "FLOAT64", description="準時出貨率"),
+    SchemaField("handling_hours_p50", "FLOAT64", description="備貨時數中位數"),
+    SchemaField("handling_hours_p95", "FLOAT64", description="備貨時數 p95"),
+    SchemaField("avg_hours_late", "FLOAT64", description="平均逾期時數"),
+]}
+KNOWN_FIELDS = {**DERIVED_FIELDS, **{field.name: field for field in BQ_SCHEMA}}
+
+ARROW_TYPES = {
+    "STRING": pa.string(),
+    "FLOAT64": pa.float64(),
+    "INT64": pa.int64(),
+    "DATE": pa.date32(),
+    # BigQuery 的 TIMESTAMP 為 UTC 時間點；不帶時區的 Parquet timestamp 會被當成 DATETIME
+    "TIMESTAMP": pa.timestamp('us', tz='UTC'),
+}
+
+
+def schema_for_columns(columns):
+    """依欄位順序回傳 schema；BQ_SCHEMA / DERIVED_FIELDS 都沒有的欄位視為 STRING"""
+    return [KNOWN_FIELDS.get(col, SchemaField(col, "STRING")) for col in columns]
+
+
+def typed_columns(text_df, fields, parse_dates=False):
+    """全字串欄位 → 依 schema 型別轉換後的欄位（空字串與無法轉換的值為 null）。
+
+    parse_dates=False 時 DATE / TIMESTAMP 保留主檔的 'YYYY-MM-DD' / 'YYYY-MM-DD HH:MM:SS' 文字（JSON 載入可直接解析）。"""
+    typed = pd.DataFrame(index=text_df.index)
+    for field in fields:
+        values = text_df[field.name].replace('', None) if field.name in text_df else pd.Series(None, index=text_df.index)
+        if field.field_type == 'FLOAT64':
+            typed[field.name] = pd.to_numeric(values, errors='coerce')
+        elif field.field_type == 'INT64':
+            numbers = pd.to_numeric(values, errors='coerce')
+            typed[field.name] = numbers.where(numbers % 1 == 0).astype('Int64')
+        elif parse_dates and field.field_type == 'DATE':
+            typed[field.name] = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce').dt.date
+        elif parse_dates and field.field_type == 'TIMESTAMP':
+            # 主檔時間不含時區，與 CSV 載入相同視為 UTC
+            typed[field.name] = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+        else:
+            typed[field.name] = values.astype(object)
+    return typed
+
+
+def arrow_schema(fields):
+    return pa.schema([pa.field(field.name, ARROW_TYPES.get(field.field_type, pa.string())) for field in fields])
+
+
+def write_parquet(csv_path, parquet_path=None, compression='zstd', order_dates=None):
+    """全字串讀取輸出 CSV，依 schema 轉型後寫成壓縮 Parquet。回傳 (parquet 路徑, 筆數, schema)。
+
+    order_dates 指定時只輸出 order_date 屬於其中的列（增量上傳只送出受影響的日分區）。
+
+    不讓 pandas 推論型別：schema 固定，BigQuery 端不會因為某次資料剛好全是整數 / 空值而改變欄位型別。"""
+    parquet_path = parquet_path or f'{os.path.splitext(csv_path)[0]}.parquet'
+    text_df = pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    if order_dates is not None:
+        text_df = text_df[text_df['order_date'].isin(order_dates)]
+    fields = schema_for_columns(text_df.columns)
+    typed = typed_columns(text_df, fields, parse_dates=True)
+    table = pa.Table.from_pandas(typed, schema=arrow_schema(fields), preserve_index=False)
+
+    tmp_path = f'{parquet_path}.tmp'
+    pq.write_table(table, tmp_path, compression=compression)
+    os.replace(tmp_path, parquet_path)
+    return parquet_path, len(typed), fields
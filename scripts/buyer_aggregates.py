@@ -0,0 +1,194 @@
+# buyer_aggregates.py
+# C03 買家彙總表（每個 shop_account × buyer_username 一列）
+#   first_order_date, last_order_date, order_count, lifetime_spend, return_count
+#   供 RFM 與 cohort 分析直接讀取，不必再由完整主檔重算。
+#
+# 增量維護：每次合併以 MergeDelta 套用「撤回被覆蓋的舊版本 + 加入新版本」的差量，
+#   次數與金額直接加減；只有被撤回的訂單剛好是某買家的首購 / 最近一次訂單時，
+#   才由記憶體中的主檔重新取得該買家的首購 / 最近訂單日期。
+# 單獨執行：讀取 BigQuery 版主檔後全量重建
+import os
+
+import pandas as pd
+
+from config import BIGQUERY_CSV_PATH, B_TABLE_OUTPUT_DIR, BUYER_AGGREGATE_FILE, CANCELLED_ORDER_STATUS
+from clean_for_bigquery import master_to_text
+
+BUYER_KEY = ['shop_account', 'buyer_username']
+BUYER_COUNT_COLS = ['order_count', 'return_count']
+BUYER_AGGREGATE_COLUMNS = BUYER_KEY + ['first_order_date', 'last_order_date'] + BUYER_COUNT_COLS + ['lifetime_spend']
+
+
+def buyer_aggregate_path():
+    return os.path.join(B_TABLE_OUTPUT_DIR, BUYER_AGGREGATE_FILE)
+
+
+def empty_buyer_aggregates():
+    table = pd.DataFrame(columns=BUYER_AGGREGATE_COLUMNS)
+    return table.astype({
+        'first_order_date': 'datetime64[ns]', 'last_order_date': 'datetime64[ns]',
+        **{col: 'int64' for col in BUYER_COUNT_COLS}, 'lifetime_spend': 'float64',
+    })
+
+
+def order_level(text_df):
+    """全字串主檔 → 每筆訂單一列（不含不成立的訂單）"""
+    if text_df.empty:
+        return pd.DataFrame(columns=BUYER_KEY + ['order_sn', 'order_date', 'spend', 'has_return'])
+    grouped = text_df.groupby('order_sn', sort=False)
+    orders = grouped[BUYER_KEY + ['order_date', 'order_status', 'total_amount_paid_by_buyer']].first()
+    return_quantity = pd.to_numeric(text_df['return_quantity'], errors='coerce').fillna(0)
+    orders['has_return'] = return_quantity.groupby(text_df['order_sn'], sort=False).sum().reindex(orders.index) > 0
+    orders['spend'] = pd.to_numeric(orders['total_amount_paid_by_buyer'], errors='coerce').fillna(0)
+    orders['order_date'] = pd.to_datetime(orders['order_date'], format='%Y-%m-%d', errors='coerce')
+    orders = orders[orders['order_status'] != CANCELLED_ORDER_STATUS]
+    return orders.reset_index()[BUYER_KEY + ['order_sn', 'order_date', 'spend', 'has_return']]
+
+
+def signed_contributions(orders, sign):
+    """每筆訂單對買家彙總的貢獻；sign=-1 代表撤回"""
+    contributions = orders[BUYER_KEY].copy()
+    contributions['order_count'] = sign
+    contributions['return_count'] = sign * orders['has_return'].astype(bool).astype('int64')
+    contributions['lifetime_spend'] = sign * orders['spend'].astype('float64')
+    return contributions.astype({'order_count': 'int64', 'return_count': 'int64'})
+
+
+def buyer_index(df):
+    return pd.MultiIndex.from_frame(df[BUYER_KEY])
+
+
+def order_date_range(orders):
+    return orders.groupby(BUYER_KEY)['order_date'].agg(['min', 'max'])
+
+
+def aggregate_orders(orders):
+    """訂單層級資料 → 買家彙總（以 shop_account × buyer_username 為索引）"""
+    contributions = signed_contributions(orders, 1)
+    contributions['first_order_date'] = orders['order_date']
+    contributions['last_order_date'] = orders['order_date']
+    return contributions.groupby(BUYER_KEY).agg({
+        'order_count': 'sum', 'return_count': 'sum', 'lifetime_spend': 'sum',
+        'first_order_date': 'min', 'last_order_date': 'max',
+    })
+
+
+def stale_buyers(current, added, removed, added_text, master_text):
+    """差量無法正確套用、需由主檔重算的買家：
+    - 撤回的訂單落在首購 / 最近訂單日期上（min / max 無法直接扣除）
+    - 新增的訂單在主檔中另有同 order_sn 的舊紀錄（日期範圍外的同鍵舊紀錄會與新版本並存）"""
+    stale = pd.MultiIndex.from_tuples([], names=BUYER_KEY)
+
+    removed_range = order_date_range(removed)
+    if len(removed_range):
+        boundary = current.reindex(removed_range.index)
+        stale = stale.union(removed_range.index[
+            (removed_range['min'] <= boundary['first_order_date']).to_numpy()
+            | (removed_range['max'] >= boundary['last_order_date']).to_numpy()
+        ])
+
+    if len(added):
+        new_rows = added_text['order_sn'].value_counts()
+        master_rows = master_text.loc[master_text['order_sn'].isin(new_rows.index), 'order_sn'].value_counts()
+        duplicated = master_rows.index[master_rows > new_rows.reindex(master_rows.index, fill_value=0)]
+        stale = stale.union(buyer_index(added[added['order_sn'].isin(duplicated)]).unique())
+    return stale
+
+
+def finalize_buyer_aggregates(updated):
+    updated = updated[updated['order_count'] > 0].copy()
+    for col in BUYER_COUNT_COLS:
+        updated[col] = updated[col].round().astype('int64')
+    updated['lifetime_spend'] = updated['lifetime_spend'].round(2)
+    updated = updated.reset_index().sort_values(BUYER_KEY, kind='stable')
+    return updated[BUYER_AGGREGATE_COLUMNS].reset_index(drop=True)
+
+
+def apply_buyer_delta(table, added_text, removed_text, master_text):
+    """把新增 / 撤回的訂單套用到買家彙總表，回傳新的彙總表。
+
+    table 的日期欄位為 datetime64；master_text 只用於重算少數無法以差量更新的買家（見 stale_buyers）。"""
+    added = order_level(added_text)
+    removed = order_level(removed_text)
+
+    delta = pd.concat([signed_contributions(added, 1), signed_contributions(removed, -1)], ignore_index=True)
+    delta = delta.groupby(BUYER_KEY).sum()
+
+    current = table.set_index(BUYER_KEY)
+    measures = BUYER_COUNT_COLS + ['lifetime_spend']
+    updated = current[measures].add(delta[measures], fill_value=0)
+
+    # 首購 / 最近訂單日期：新增的訂單直接取 min / max
+    added_range = order_date_range(added).reindex(updated.index)
+    updated['first_order_date'] = pd.concat(
+        [current['first_order_date'].reindex(updated.index), added_range['min']], axis=1).min(axis=1)
+    updated['last_order_date'] = pd.concat(
+        [current['last_order_date'].reindex(updated.index), added_range['max']], axis=1).max(axis=1)
+
+    stale = stale_buyers(current, added, removed, added_text, master_text)
+    if len(stale):
+        master_rows = master_text[buyer_index(master_text).isin(stale)]
+        updated = pd.concat([updated.drop(index=stale, errors='ignore'), aggregate_orders(order_level(master_rows))])
+
+    return finalize_buyer_aggregates(updated)
+
+
+def build_buyer_aggregates(text_df):
+    """由完整主檔全量建立買家彙總表"""
+    return finalize_buyer_aggregates(aggregate_orders(order_level(text_df)))
+
+
+def load_buyer_aggregates():
+    table = pd.read_csv(buyer_aggregate_path(), dtype={col: str for col in BUYER_KEY}, keep_default_na=False,
+                        na_values={'first_order_date': [''], 'last_order_date': ['']})
+    for col in ['first_order_date', 'last_order_date']:
+        table[col] = pd.to_datetime(table[col], format='%Y-%m-%d', errors='coerce')
+    return table
+
+
+def save_buyer_aggregates(table):
+    """先寫暫存檔再取代；日期輸出為 YYYY-MM-DD"""
+    path = buyer_aggregate_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    table.to_csv(tmp_path, index=False, encoding='utf-8-sig', date_format='%Y-%m-%d')
+    os.replace(tmp_path, path)
+
+
+def reset_buyer_aggregates():
+    """刪除買家彙總表，下次執行時全量重建（增量套用中途失敗時使用）"""
+    if os.path.exists(buyer_aggregate_path()):
+        os.remove(buyer_aggregate_path())
+
+
+def update_buyer_aggregates(text_df, delta=None):
+    """ETL 主流程呼叫：有 delta 且彙總表已存在時套用差量，否則全量重建。回傳 (彙總表, 是否為增量)。"""
+    incremental = delta is not None and not delta.is_full_rebuild and os.path.exists(buyer_aggregate_path())
+    try:
+        if incremental:
+            table = apply_buyer_delta(
+                load_buyer_aggregates(),
+                master_to_text(delta.new_records),
+                master_to_text(delta.replaced_records),
+                text_df,
+            )
+        else:
+            table = build_buyer_aggregates(text_df)
+        save_buyer_aggregates(table)
+    except Exception:
+        reset_buyer_aggregates()
+        raise
+    return table, incremental
+
+
+def main():
+    # 讀取資料
+    df = pd.read_csv(BIGQUERY_CSV_PATH, dtype=str, keep_default_na=False)
+
+    table = build_buyer_aggregates(df)
+    save_buyer_aggregates(table)
+    print(f'完成：{buyer_aggregate_path()} ({len(table)} 位買家，原始 {len(df)} 筆)')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,101 @@
 import pandas as pd
 import os
-
-def analyze_gaps_for_single_store(df_store_data, store_identifier, date_column_name, max_gap_days=3):
-    df_store_data_copy = df_store_data.copy()
-    df_store_data_copy['parsed_date'] = pd.to_datetime(df_store_data_copy[date_column_name], errors='coerce')
-    df_valid_dates = df_store_data_copy.dropna(subset=['parsed_date'])
-
-    if df_valid_dates.empty:
-        return False
-
-    unique_sorted_dates = df_valid_dates['parsed_date'].dt.normalize().sort_values().unique()
-
-    if len(unique_sorted_dates) < 2:
-        return False
-
-    store_has_gaps = False
-    first_gap_for_store = True
-    previous_date = pd.Timestamp(unique_sorted_dates[0])
-
-    for i in range(1, len(unique_sorted_dates)):
-        current_date = pd.Timestamp(unique_sorted_dates[i])
-        delta = current_date - previous_date
-
-        if delta.days > max_gap_days:
-            if first_gap_for_store:
-                print(f"\n--- 分析結果：店家 {store_identifier} ---")
-                first_gap_for_store = False
-
-            store_has_gaps = True
+from config import OUTPUT_CSV_PATH, ORDER_DATE_GAP_REPORT_PATH, ORDER_DATE_COVERAGE_PATH
+from platform_routing import platform_partition_paths, read_platform_partitions
+
+STORE_COLUMN = "shop_name"
+DATE_COLUMN = "order_date"
+
+def load_daily_counts(file_path):
+    """只讀取 shop_name 與 order_date 兩欄（含 B2B 分區），回傳每個 (店家, 日期) 的訂單列數"""
+    df = read_platform_partitions(platform_partition_paths(file_path), usecols=[STORE_COLUMN, DATE_COLUMN], dtype=str)
+    if df is None:
+        raise FileNotFoundError(file_path)
+    counts = df.groupby([STORE_COLUMN, DATE_COLUMN]).size().rename('rows').reset_index()
+    # 日期只解析不重複的 (店家, 日期) 組合
+    counts['date'] = pd.to_datetime(counts[DATE_COLUMN], errors='coerce').dt.normalize()
+    counts = counts.dropna(subset=['date'])
+    return counts.groupby([STORE_COLUMN, 'date'], as_index=False)['rows'].sum()
+
+def find_date_gaps(daily_counts, max_gap_days=3):
+    """同一店家相鄰兩個有訂單的日期相差超過 max_gap_days 天即為缺口，回傳每個缺口一列"""
+    daily = daily_counts.sort_values([STORE_COLUMN, 'date'])
+    previous = daily.groupby(STORE_COLUMN)['date'].shift()
+    delta_days = (daily['date'] - previous).dt.days
+    is_gap = delta_days > max_gap_days
+    gaps = pd.DataFrame({
+        STORE_COLUMN: daily.loc[is_gap, STORE_COLUMN],
+        'previous_order_date': previous[is_gap],
+        'next_order_date': daily.loc[is_gap, 'date'],
+        'gap_start': previous[is_gap] + pd.Timedelta(days=1),
+        'gap_end': daily.loc[is_gap, 'date'] - pd.Timedelta(days=1),
+        'missing_days': (delta_days[is_gap] - 1).astype(int),
+    })
+    return gaps.reset_index(drop=True)
+
+def coverage_matrix(daily_counts):
+    """商店 × 日期（第一天到最後一天的完整日曆）的訂單列數，0 表示當天沒有訂單"""
+    matrix = daily_counts.pivot(index=STORE_COLUMN, columns='date', values='rows')
+    calendar = pd.date_range(daily_counts['date'].min(), daily_counts['date'].max(), freq='D')
+    matrix = matrix.reindex(columns=calendar, fill_value=0).fillna(0).astype(int)
+    matrix.columns = calendar.strftime('%Y-%m-%d')
+    return matrix
+
+def write_reports(gaps, matrix, gap_path=ORDER_DATE_GAP_REPORT_PATH, coverage_path=ORDER_DATE_COVERAGE_PATH):
+    os.makedirs(os.path.dirname(gap_path), exist_ok=True)
+    os.makedirs(os.path.dirname(coverage_path), exist_ok=True)
+    date_columns = ['previous_order_date', 'next_order_date', 'gap_start', 'gap_end']
+    gaps.assign(**{col: gaps[col].dt.strftime('%Y-%m-%d') for col in date_columns}).to_csv(gap_path, index=False, encoding='utf-8-sig')
+    matrix.to_csv(coverage_path, encoding='utf-8-sig')
+
+def print_gaps(gaps):
+    for store_id, store_gaps in gaps.groupby(STORE_COLUMN, sort=True):
+        print(f"\n--- 分析結果：店家 {store_id} ---")
+        for gap in store_gaps.itertuples(index=False):
             print(f"  發現訂單日期之間存在較大間隔：")
-            print(f"    前一訂單日期: {previous_date.strftime('%Y-%m-%d')}")
-            print(f"    本次訂單日期: {current_date.strftime('%Y-%m-%d')}")
-            print(f"    中間連續 {delta.days - 1} 天沒有訂單")
+            print(f"    前一訂單日期: {gap.previous_order_date.strftime('%Y-%m-%d')}")
+            print(f"    本次訂單日期: {gap.next_order_date.strftime('%Y-%m-%d')}")
+            print(f"    中間連續 {gap.missing_days} 天沒有訂單")
             print("  ------------------------------------")
 
-        previous_date = current_date
-
-    return store_has_gaps
-
 def main_analysis_by_store(file_path, max_gap_days=3):
     try:
-        df = pd.read_csv(file_path)
-        store_column_name = "shop_name"
-        date_column_name = "order_date"
-
-        if store_column_name not in df.columns:
-            print(f"錯誤：在檔案中找不到欄位 'shop_name'。實際欄位有: {df.columns.tolist()}")
-            return
-
-        if date_column_name not in df.columns:
-            print(f"錯誤：在檔案中找不到欄位 'order_date'。實際欄位有: {df.columns.tolist()}")
-            return
-
-        unique_stores = df[store_column_name].unique()
+        daily_counts = load_daily_counts(file_path)
+        unique_stores = daily_counts[STORE_COLUMN].unique()
 
         if len(unique_stores) == 0:
             print(f"找不到任何店家代碼。")
-            return
+            return None
 
         print(f"在 'shop_name' 欄位中找到 {len(unique_stores)} 個獨立店家。")
         print(f"分析標準：尋找連續超過 {max_gap_days} 天沒有訂單的情況...\n")
 
-        overall_any_gap_found = False
-
-        for store_id in sorted(list(unique_stores)):
-            df_current_store = df[df[store_column_name] == store_id]
-
-            if analyze_gaps_for_single_store(df_current_store, store_id, date_column_name, max_gap_days):
-                overall_any_gap_found = True
+        gaps = find_date_gaps(daily_counts, max_gap_days)
+        matrix = coverage_matrix(daily_counts)
+        print_gaps(gaps)
+        write_reports(gaps, matrix)
 
-        if not overall_any_gap_found:
+        if gaps.empty:
             print(f"\n檢查完畢。所有店家訂單日期間隔均未超過 {max_gap_days} 天。")
         else:
-            print(f"\n所有店家分析完畢。")
+            print(f"\n所有店家分析完畢，共 {len(gaps)} 個缺口（{gaps[STORE_COLUMN].nunique()} 個店家）。")
+        print(f"缺口清單: {ORDER_DATE_GAP_REPORT_PATH}")
+        print(f"每日訂單矩陣: {ORDER_DATE_COVERAGE_PATH}")
+        return gaps
 
     except FileNotFoundError:
         print(f"錯誤：找不到檔案 '{file_path}'。請確認路徑和檔案名稱是否正確。")
     except pd.errors.EmptyDataError:
         print(f"錯誤：檔案 '{file_path}' 是空的，或者不是有效的CSV格式。")
+    except ValueError as e:
+        # usecols 找不到欄位
+        print(f"錯誤：在檔案中找不到欄位 'shop_name' 或 'order_date'（{e}）")
     except Exception as e:
         print(f"處理過程中發生未預期的錯誤：{e}")
         print("請檢查CSV檔案格式是否正確，以及指定的欄位是否包含預期資料。")
 
 if __name__ == "__main__":
-    csv_file_path = os.path.join("output", "A01_master_orders_cleaned.csv")
+    csv_file_path = OUTPUT_CSV_PATH
     gap_threshold = 3
 
     print(f"準備分析檔案: {csv_file_path}")
@@ -1,10 +1,13 @@
 import pandas as pd
+from analytics_reader import read_orders
 
 input_csv = r"C:\Users\user\Documents\shopee_orders_etl\output\GTD_master_orders_cleaned.csv"
 output_csv = r"C:\Users\user\Documents\shopee_orders_etl\output\GTD_master_orders_order_date_invalid.csv"
+# Google Sheet ETL 的 B2B 分區後綴（etl_g_sheet/etl_google_sheet_to_database.py）
+b2b_suffix = "_B2B_special"
 
-# 讀取資料
-df = pd.read_csv(input_csv, dtype=str)
+# 只讀取訂單編號與 order_date 兩欄（含 B2B 分區）
+df = read_orders(input_csv, columns=['order_sn', 'order_date'], b2b_suffix=b2b_suffix)
 
 # 嘗試轉換 order_date，errors='coerce' 會將無法轉換的設成 NaT
 df['order_date_converted'] = pd.to_datetime(df['order_date'], errors='coerce')
@@ -2,20 +2,43 @@ import pandas as pd
 import numpy as np
 import os
 
+from csv_na_tokens import CSV_NA_TOKENS
+from platform_routing import PLATFORM_NORMAL, platform_partition_paths, read_platform_partitions
+
 # 1. 路徑設定
 input_csv = r'C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned.csv'
 output_csv = r'C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned_for_bigquery.csv'
 
-# 2. 讀取資料
-df = pd.read_csv(input_csv, dtype=str)  # 全部欄位用字串讀，保留原始格式
+def normalize_for_bigquery(df):
+    """把常見的 nan, NaN, None, <空字串> 等轉為空字串"""
+    # 或者，如果你要 BigQuery 欄位呈現 NULL，可以改用 df.where(pd.notnull(df), None)
+    return df.replace(['nan', 'NaN', 'None', np.nan], '')
+
+
+def master_to_text(df):
+    """將記憶體中的主檔轉成全字串欄位，結果等同 to_csv 後再以 read_csv(dtype=str) 讀回並清理空值，
+    讓 ETL 主流程可直接在記憶體中產生 BigQuery 版本與 B 表，不必重讀 CSV。"""
+    text = pd.DataFrame(index=df.index)
+    for col in df.columns:
+        series = df[col]
+        values = series.astype(str)
+        values[series.isna()] = ''
+        text[col] = values.where(~values.isin(CSV_NA_TOKENS), '')
+    return text.reset_index(drop=True)
+
+
+def main():
+    # 2. 讀取資料
+    df = read_platform_partitions(platform_partition_paths(input_csv), platforms=[PLATFORM_NORMAL], dtype=str)  # 只讀一般平台分區，全部欄位用字串讀，保留原始格式
+
+    # 3. 清理空值
+    df = normalize_for_bigquery(df)
 
-# 3. 把常見的 nan, NaN, None, <空字串> 等轉為空字串
-df = df.replace(['nan', 'NaN', 'None', np.nan], '')
+    # 4. 輸出乾淨檔案
+    df.to_csv(output_csv, index=False, encoding='utf-8-sig')
 
-# 4. 或者，如果你要 BigQuery 欄位呈現 NULL，可以用下列方式
-# df = df.where(pd.notnull(df), None)
+    print(f"清理完成！檔案已儲存至：{output_csv}")
 
-# 5. 輸出乾淨檔案
-df.to_csv(output_csv, index=False, encoding='utf-8-sig')
 
-print(f"清理完成！檔案已儲存至：{output_csv}")
+if __name__ == "__main__":
+    main()
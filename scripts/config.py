@@ -15,6 +15,76 @@ ARCHIVE_DIR     = r"C:\Users\user\Documents\shopee_orders_etl\archive"
 OUTPUT_CSV_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned.csv"
 ORPHAN_CSV_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_orphaned_orders.csv"
 
+# 歸檔檔名時間戳格式（同一次執行共用同一個時間戳，replay 依此還原批次）
+ARCHIVE_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+# 從 archive/ 重建主檔 (replay_from_archive.py)
+# 預設輸出到獨立檔案，確認無誤後再以 --in-place 覆寫正式主檔
+REPLAY_OUTPUT_CSV_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_replayed.csv"
+REPLAY_ORPHAN_CSV_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_orphaned_orders_replayed.csv"
+PARSE_CACHE_DIR        = r"C:\Users\user\Documents\shopee_orders_etl\output\parse_cache"
+# 舊版歸檔每個檔案各自取時間戳：replay_from_archive.py --legacy-gap 時，與批次第一個檔案相差此秒數內的檔案視為同一次執行
+REPLAY_RUN_GAP_SECONDS = 5
+
+# BigQuery 版主檔與 B01–B04 輸出 (split_orders_to_b_tables.py)
+BIGQUERY_CSV_PATH  = r"C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned_for_bigquery.csv"
+B_TABLE_OUTPUT_DIR = r"C:\Users\user\Documents\shopee_orders_etl\output"
+B_TABLE_FILES = {
+    "B01": "B01_orders_concat.csv",
+    "B02": "B02_order_details.csv",
+    "B03": "B03_order_simple_details.csv",
+    "B04": "B04_order_shipping_info.csv",
+}
+# B01–B04 依 order_date 月份分區的儲存位置；每次 ETL 只改寫受影響訂單所在的分區
+B_TABLE_PARTITION_DIR = r"C:\Users\user\Documents\shopee_orders_etl\output\b_tables"
+# 增量更新後是否由分區重新串接出 B01–B04 單一 CSV（供 upload_to_bq.py 上傳）
+B_TABLE_WRITE_FLAT_FILES = True
+
+# 星狀結構輸出 (star_schema.py)：維度表 + 以 int32 代理鍵關聯的精簡事實表，與 B01–B04 並存
+STAR_SCHEMA_ENABLED    = False
+STAR_SCHEMA_OUTPUT_DIR = r"C:\Users\user\Documents\shopee_orders_etl\output\star_schema"
+STAR_SCHEMA_DIMENSION_FILES = {
+    "dim_shop":     "dim_shop.csv",
+    "dim_product":  "dim_product.csv",
+    "dim_location": "dim_location.csv",
+}
+# 事實表與 B01–B04 相同，依 order_date 月份分區存於 B_TABLE_PARTITION_DIR
+STAR_SCHEMA_FACT_FILES = {
+    "fact_order_items":    "fact_order_items.csv",
+    "fact_order_shipping": "fact_order_shipping.csv",
+}
+
+# C 開頭衍生表（sales_rollup.ROLLUP_TABLES）：依 order_date 或 order_sn 增量重算，與 B01–B04 相同輸出至 B_TABLE_OUTPUT_DIR 並以月份分區
+ROLLUP_TABLE_FILES = {
+    "C01": "C01_daily_shop_sku_sales.csv",
+    "C02": "C02_voucher_cube.csv",
+    "C04": "C04_order_shipping_sla.csv",
+    "C05": "C05_daily_shipping_sla.csv",
+}
+# 不計入銷售彙總的訂單狀態
+CANCELLED_ORDER_STATUS = "不成立"
+# 買家彙總表 (buyer_aggregates.py)：以合併差量增量維護，輸出至 B_TABLE_OUTPUT_DIR
+BUYER_AGGREGATE_FILE = "C03_buyer_aggregates.csv"
+
+# 訂單層級巢狀輸出 (nested_export.py)：每筆訂單一列，商品明細為 REPEATED items，newline-delimited JSON
+NESTED_EXPORT_ENABLED = False
+NESTED_EXPORT_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A02_orders_nested.ndjson"
+NESTED_SCHEMA_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\A02_orders_nested_schema.json"
+NESTED_TABLE_ID    = "A02_orders_nested"
+
+# 近 30 天滾動視窗輸出 (rolling_window.py)：last30days_*（BigQuery 版主檔與 B01–B04）供 PostgreSQL / BigQuery 排程使用
+# 以 order_date 日分區維護，ETL 每次只改寫異動與新進入視窗的日期並移除滑出視窗的日期；filter_recent_30days_orders.py 可全量重建
+ROLLING_WINDOW_ENABLED    = True
+ROLLING_WINDOW_DAYS       = 30
+ROLLING_WINDOW_OUTPUT_DIR = r"C:\Users\user\Documents\shopee_orders_etl\output\filtered_last_30_days"
+
+# 增量上傳 (upload_to_bq.py)：ETL 每次記錄異動的 order_date，上傳時只取代 BigQuery 中對應的日分區
+UPLOAD_PARTITION_MANIFEST_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\upload_partition_manifest.json"
+# 各表最後一次成功上傳的檔案 sha256 / 筆數 / schema 指紋 / job id；內容未變更的檔案不再上傳
+UPLOAD_CONTENT_MANIFEST_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\upload_content_manifest.json"
+# upload_to_bq.py --dry-run：寫入本機模擬的 BigQuery（每張表一個 Parquet 檔），不需憑證與網路
+LOCAL_SINK_DIR = r"C:\Users\user\Documents\shopee_orders_etl\output\local_bigquery"
+
 # Excel 原始欄位名稱 → DataFrame 欄位對應（根據實際 Excel 欄位修正）
 COLUMN_MAPPING = {
     "訂單編號":                              "order_sn",
@@ -205,4 +275,9 @@ BQ_SCHEMA = [
     SchemaField("order_completion_timestamp", "TIMESTAMP", description="訂單完成時間"),
     SchemaField("buyer_note", "STRING", description="買家備註"),
     SchemaField("seller_note", "STRING", description="賣家備註"),
-]
\ No newline at end of file
+]
+# 診斷報表 (check_csv_content.py)：主檔 × 孤兒檔訂單比對的完整結果，另存同名 .parquet
+ORPHAN_RECONCILIATION_REPORT_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\reports\orphan_reconciliation.csv"
+# 訂單日期缺口檢查 (check_order_date_gaps.py)：每個缺口一列，以及 商店 × 日期 的訂單列數矩陣
+ORDER_DATE_GAP_REPORT_PATH = r"C:\Users\user\Documents\shopee_orders_etl\output\reports\order_date_gaps.csv"
+ORDER_DATE_COVERAGE_PATH   = r"C:\Users\user\Documents\shopee_orders_etl\output\reports\order_date_coverage.csv"
@@ -0,0 +1,7 @@
+# csv_na_tokens.py
+# pd.read_csv 預設視為空值的字串：主檔以 dtype=str 讀回時這些值會變成 NaN
+# clean_for_bigquery.py（清成空字串）與 stats_catalog.py（計入空值）共用；不匯入其他模組，避免循環匯入
+CSV_NA_TOKENS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
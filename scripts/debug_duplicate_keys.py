@@ -10,6 +10,7 @@ try:
 except ImportError:
     print("❌ 錯誤：無法從 config.py 導入設定。")
     exit()
+from platform_routing import platform_partition_paths, read_platform_partitions
 
 def clean_column_names(df):
     """清理欄位名稱"""
@@ -42,12 +43,12 @@ def debug_key_generation():
     print("🔍 除錯複合主鍵生成問題")
     print("=" * 60)
     
-    # 1. 讀取現有主檔
-    if not os.path.exists(OUTPUT_CSV_PATH):
+    # 1. 讀取現有主檔（一般 + B2B 平台分區）
+    df_old = read_platform_partitions(platform_partition_paths(OUTPUT_CSV_PATH), keep_default_na=False, dtype=str)
+    if df_old is None:
         print("❌ 主檔不存在")
         return
     
-    df_old = pd.read_csv(OUTPUT_CSV_PATH, keep_default_na=False, dtype=str)
     print(f"📄 主檔載入: {len(df_old)} 筆資料")
     
     # 2. 讀取新的 Excel 檔案
@@ -7,6 +7,9 @@ INPUT_DIR = os.path.join(BASE_DIR, "input")
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 OUTPUT_CSV_PATH = os.path.join(OUTPUT_DIR, "GTD_master_orders_cleaned.csv")
 
+# shop_name 與對照檔不完全相同時，以包含的店名 / 關鍵字模糊比對；短於此長度的別名不參與比對（避免誤判），設為 0 關閉模糊比對
+FUZZY_SHOP_MATCH_MIN_LENGTH = 2
+
 COLUMN_MAPPING = {
     "店鋪名稱": "shop_name",
     # "店鋪帳號": "shop_account",  # 店鋪帳號目前ETL會補空字串，不來自原始檔
@@ -1,10 +1,17 @@
+import argparse
+import glob
 import os
 import sys
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from config import INPUT_DIR, OUTPUT_DIR, COLUMN_MAPPING, FINAL_COLUMN_ORDER, OUTPUT_CSV_PATH, SHOP_ACCOUNT_MAP_PATH
-
-SPECIAL_PLATFORMS = ['MOMO購物中心', 'PC購物中心', 'Yahoo購物中心', '東森購物']
+from itertools import repeat
+from config import INPUT_DIR, OUTPUT_DIR, COLUMN_MAPPING, FINAL_COLUMN_ORDER, OUTPUT_CSV_PATH, SHOP_ACCOUNT_MAP_PATH, FUZZY_SHOP_MATCH_MIN_LENGTH
+from shop_name_matcher import ShopNameMatcher
+# 平台分類與主檔 ETL 共用 scripts/platform_routing.py（放在 sys.path 最後，config 仍優先使用本資料夾的設定）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from platform_routing import PLATFORM_B2B, PLATFORM_NORMAL, platform_partition_paths, route_by_platform, write_platform_partitions
 
 def clean_column_names(df):
     cleaned_columns = {}
@@ -19,49 +26,70 @@ def clean_column_names(df):
             df.drop(columns=[drop_col], inplace=True)
     return df
 
-def load_shop_account_map_strict():
-    if not os.path.exists(SHOP_ACCOUNT_MAP_PATH):
-        print(f"警告：找不到店鋪帳號對照檔 {SHOP_ACCOUNT_MAP_PATH}，shop_account 將補空字串")
-        return {}, {}
-    df_map = pd.read_csv(SHOP_ACCOUNT_MAP_PATH, dtype=str)
-    strict_map = {}
-    reverse_map = {}
-    for _, row in df_map.iterrows():
-        shop_name = row['shop_name']
-        account = row['shop_account']
-        keywords = []
-        if 'keywords' in df_map.columns and pd.notna(row.get('keywords')):
-            keywords = [k.strip() for k in row['keywords'].split(',')]
-        else:
-            keywords = []
-        strict_map[shop_name] = account
-        reverse_map[shop_name] = shop_name
-        for kw in keywords:
-            strict_map[kw] = account
-            reverse_map[kw] = shop_name
-    return strict_map, reverse_map
-
-def fill_shop_account_and_name(df, strict_map, reverse_map):
+_shop_lookup_cache = {}
+
+def empty_shop_lookup():
+    return pd.DataFrame(columns=['shop_account', 'real_name'], dtype=object)
+
+def load_shop_account_map_strict(path=SHOP_ACCOUNT_MAP_PATH):
+    """店名與 keywords 中的別名展開成查詢表（index 為別名，欄位 shop_account、real_name）。
+    同一別名出現多次時以檔案中較後面的為準；依檔案 mtime 快取，對照檔沒變動時不重新解析。"""
+    if not os.path.exists(path):
+        print(f"警告：找不到店鋪帳號對照檔 {path}，shop_account 將補空字串")
+        return empty_shop_lookup()
+    mtime = os.stat(path).st_mtime_ns
+    cached = _shop_lookup_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    df_map = pd.read_csv(path, dtype=str)
+    if 'keywords' in df_map.columns:
+        keywords = df_map['keywords'].str.split(',').explode().str.strip()
+    else:
+        keywords = pd.Series(dtype=object)
+    # 同一列先放店名再放 keywords，穩定排序後保留最後一次出現的別名
+    aliases = pd.concat([df_map['shop_name'], keywords]).sort_index(kind='stable').dropna()
+    lookup = pd.DataFrame({
+        'shop_account': df_map['shop_account'].loc[aliases.index].to_numpy(),
+        'real_name': df_map['shop_name'].loc[aliases.index].to_numpy(),
+    }, index=aliases.to_numpy())
+    lookup = lookup[~lookup.index.duplicated(keep='last')]
+
+    _shop_lookup_cache[path] = (mtime, lookup)
+    return lookup
+
+def load_shop_name_matcher(shop_lookup):
+    if not FUZZY_SHOP_MATCH_MIN_LENGTH:
+        return None
+    return ShopNameMatcher(shop_lookup, min_alias_length=FUZZY_SHOP_MATCH_MIN_LENGTH)
+
+def fuzzy_match_shop_names(names, shop_matcher):
+    """完全比對不到的店名，每個不重複值以別名模糊比對一次；回傳 (shop_account, real_name)，比對不到或不明確為空字串"""
+    resolved, ambiguous = shop_matcher.resolve(names.dropna().unique())
+    for name, candidates in ambiguous.items():
+        print(f"警告：店名「{name}」同時符合 {', '.join(candidates)}，shop_account 維持空白")
+    if resolved:
+        print(f"模糊比對補上 {len(resolved)} 個店名：" + '、'.join(f"{name}→{real_name}" for name, (_, real_name) in resolved.items()))
+    account = names.map({name: shop[0] for name, shop in resolved.items()}).fillna('')
+    real_name = names.map({name: shop[1] for name, shop in resolved.items()}).fillna('')
+    return account, real_name
+
+def fill_shop_account_and_name(df, shop_lookup, shop_matcher=None):
     if 'shop_account' not in df.columns:
         df['shop_account'] = ''
-
-    def find_account_and_name(shop_name):
-        if pd.isna(shop_name):
-            return '', ''
-        account = strict_map.get(shop_name, '')
-        real_name = reverse_map.get(shop_name, '')
-        return account, real_name
-
-    results = df.apply(
-        lambda row: find_account_and_name(row['shop_name']) if not row.get('shop_account') else (row['shop_account'], row['shop_name']),
-        axis=1,
-        result_type='expand'
-    )
-    df['shop_account'] = results[0]
-    df['shop_name'] = results[1].where(results[1] != '', df['shop_name'])
+    # 已有 shop_account 的列保留原值，只查詢空白的列
+    needs_lookup = ~df['shop_account'].astype(bool)
+    names = df.loc[needs_lookup, 'shop_name']
+    matched = names.isin(shop_lookup.index)
+    account = names.map(shop_lookup['shop_account']).where(matched, '')
+    real_name = names.map(shop_lookup['real_name']).where(matched, '')
+    if shop_matcher is not None and not matched.all():
+        account[~matched], real_name[~matched] = fuzzy_match_shop_names(names[~matched], shop_matcher)
+    df.loc[needs_lookup, 'shop_account'] = account
+    df.loc[needs_lookup, 'shop_name'] = real_name.where(real_name != '', names)
     return df
 
-def load_and_clean_new_csv(file_path, strict_map, reverse_map):
+def load_and_clean_new_csv(file_path, shop_lookup, shop_matcher=None):
     print(f"讀取檔案: {file_path}")
     df = pd.read_csv(file_path, dtype=str)
     print("原始欄位名稱：", df.columns.tolist())
@@ -73,7 +101,7 @@ def load_and_clean_new_csv(file_path, strict_map, reverse_map):
     if 'order_sn' not in df.columns:
         raise KeyError("欄位 'order_sn' 不存在，請確認欄位映射與欄位名稱")
     df = df[df['order_sn'].notna()]
-    df = fill_shop_account_and_name(df, strict_map, reverse_map)
+    df = fill_shop_account_and_name(df, shop_lookup, shop_matcher)
     df['processing_date'] = datetime.now().strftime('%Y-%m-%d')
     date_cols = [
         'order_creation_timestamp', 'buyer_payment_timestamp',
@@ -91,78 +119,85 @@ def load_and_clean_new_csv(file_path, strict_map, reverse_map):
             df[col] = pd.to_numeric(df[col], errors='coerce')
     return df
 
-def main():
-    if len(sys.argv) > 1:
-        input_filename = sys.argv[1]
+DEFAULT_INPUT_FILENAME = "八里電商業績統計 - 6月銷售明細表(原始資料).csv"
+
+def resolve_input_files(args):
+    """檔名、路徑或萬用字元（相對路徑以 INPUT_DIR 為準）依參數順序展開；萬用字元依檔名排序，重複的檔案只處理一次"""
+    files = []
+    for arg in args:
+        pattern = arg if os.path.isabs(arg) else os.path.join(INPUT_DIR, arg)
+        for path in (sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]):
+            if path not in files:
+                files.append(path)
+    return files
+
+def composite_key(df):
+    timestamps = df['order_creation_timestamp']
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        # 與主檔寫出後讀回的文字相同：NaT 寫出為空白，讀回後為 ''（astype(str) 會變成 'NaT'）
+        timestamps = timestamps.astype(str).where(timestamps.notna(), '')
+    return (
+        df['order_sn'].fillna('') + '|||' +
+        df['buyer_username'].fillna('') + '|||' +
+        timestamps.fillna('')
+    )
+
+def combine_new_files(frames):
+    """多個檔案的資料合併；同一 composite key 出現在多個檔案時只保留最後一個檔案的資料（與逐檔依序執行的結果相同）"""
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    file_index = np.repeat(np.arange(len(frames)), [len(frame) for frame in frames])
+    latest = pd.Series(file_index).groupby(composite_key(df).to_numpy()).transform('max').to_numpy()
+    return df[file_index == latest].reset_index(drop=True)
+
+def merge_into_master(df_new, master_path, label, platform):
+    """平台分區中與新資料 composite key 相同的訂單整筆取代，回傳依 FINAL_COLUMN_ORDER 排列的合併結果"""
+    if os.path.exists(master_path):
+        df_old = route_by_platform(pd.read_csv(master_path, dtype=str))[platform]
+        old_keys = composite_key(df_old)
+        keys_to_keep = set(old_keys) - set(composite_key(df_new))
+        df_merged = pd.concat([df_old[old_keys.isin(keys_to_keep)], df_new], ignore_index=True)
     else:
-        input_filename = "八里電商業績統計 - 6月銷售明細表(原始資料).csv"
-    input_csv_path = os.path.join(INPUT_DIR, input_filename)
-    if not os.path.exists(input_csv_path):
-        print(f"錯誤：找不到輸入檔案 {input_csv_path}")
+        print(f"無現有{label}主檔，直接使用新資料（{label}）")
+        df_merged = df_new
+    return df_merged.reindex(columns=FINAL_COLUMN_ORDER, fill_value='')
+
+def main():
+    parser = argparse.ArgumentParser(description="Google Sheet 銷售明細匯入主檔")
+    parser.add_argument('files', nargs='*', default=[DEFAULT_INPUT_FILENAME],
+                        help="輸入檔名、路徑或萬用字元（例如 '*銷售明細表*.csv'），可指定多個；同一訂單以較後面的檔案為準")
+    parser.add_argument('--workers', type=int, default=None, help="平行解析的行程數（預設為 CPU 核心數）")
+    args = parser.parse_args()
+
+    input_csv_paths = resolve_input_files(args.files)
+    missing = [path for path in input_csv_paths if not os.path.exists(path)]
+    if missing or not input_csv_paths:
+        for path in missing or args.files:
+            print(f"錯誤：找不到輸入檔案 {path}")
         return
 
-    strict_map, reverse_map = load_shop_account_map_strict()
-    df_new = load_and_clean_new_csv(input_csv_path, strict_map, reverse_map)
-
-    df_special = df_new[df_new['shop_name'].isin(SPECIAL_PLATFORMS)].copy()
-    df_normal = df_new[~df_new['shop_name'].isin(SPECIAL_PLATFORMS)].copy()
-
-    # 一般平台合併
-    if os.path.exists(OUTPUT_CSV_PATH):
-        df_old = pd.read_csv(OUTPUT_CSV_PATH, dtype=str)
-        df_old_normal = df_old[~df_old['shop_name'].isin(SPECIAL_PLATFORMS)].copy()
-        df_old_normal['composite_key'] = (
-            df_old_normal['order_sn'].fillna('') + '|||' +
-            df_old_normal['buyer_username'].fillna('') + '|||' +
-            df_old_normal['order_creation_timestamp'].fillna('')
-        )
-        df_normal['composite_key'] = (
-            df_normal['order_sn'].fillna('') + '|||' +
-            df_normal['buyer_username'].fillna('') + '|||' +
-            df_normal['order_creation_timestamp'].astype(str).fillna('')
-        )
-        keys_to_keep = set(df_old_normal['composite_key']) - set(df_normal['composite_key'])
-        df_old_filtered = df_old_normal[df_old_normal['composite_key'].isin(keys_to_keep)]
-        df_merged_normal = pd.concat([df_old_filtered, df_normal], ignore_index=True)
+    shop_lookup = load_shop_account_map_strict()
+    shop_matcher = load_shop_name_matcher(shop_lookup)
+    if len(input_csv_paths) == 1:
+        frames = [load_and_clean_new_csv(input_csv_paths[0], shop_lookup, shop_matcher)]
     else:
-        print("無現有主檔，直接使用新資料（一般平台）")
-        df_merged_normal = df_normal
-
-    df_merged_normal = df_merged_normal.reindex(columns=FINAL_COLUMN_ORDER, fill_value='')
-    if 'composite_key' in df_merged_normal.columns:
-        df_merged_normal.drop(columns=['composite_key'], inplace=True)
-
-    # 特殊平台合併
-    output_special_path = OUTPUT_CSV_PATH.replace('.csv', '_B2B_special.csv')
-    if os.path.exists(output_special_path):
-        df_old_special = pd.read_csv(output_special_path, dtype=str)
-        df_old_special['composite_key'] = (
-            df_old_special['order_sn'].fillna('') + '|||' +
-            df_old_special['buyer_username'].fillna('') + '|||' +
-            df_old_special['order_creation_timestamp'].fillna('')
-        )
-        df_special['composite_key'] = (
-            df_special['order_sn'].fillna('') + '|||' +
-            df_special['buyer_username'].fillna('') + '|||' +
-            df_special['order_creation_timestamp'].astype(str).fillna('')
-        )
-        keys_to_keep_special = set(df_old_special['composite_key']) - set(df_special['composite_key'])
-        df_old_filtered_special = df_old_special[df_old_special['composite_key'].isin(keys_to_keep_special)]
-        df_merged_special = pd.concat([df_old_filtered_special, df_special], ignore_index=True)
-    else:
-        print("無現有特殊平台主檔，直接使用新資料（特殊平台）")
-        df_merged_special = df_special
-
-    df_merged_special = df_merged_special.reindex(columns=FINAL_COLUMN_ORDER, fill_value='')
-    if 'composite_key' in df_merged_special.columns:
-        df_merged_special.drop(columns=['composite_key'], inplace=True)
+        print(f"平行解析 {len(input_csv_paths)} 個檔案（workers={args.workers or os.cpu_count()}）")
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            frames = list(executor.map(load_and_clean_new_csv, input_csv_paths, repeat(shop_lookup), repeat(shop_matcher)))
+    # 一般 / 特殊平台分區各自合併多個檔案與舊資料，寫入時依平台分流，每個分區只寫一次
+    master_paths = platform_partition_paths(OUTPUT_CSV_PATH, b2b_suffix='_B2B_special')
+    routed = [route_by_platform(frame) for frame in frames]
+    merged = [
+        merge_into_master(combine_new_files([parts[platform] for parts in routed]), master_paths[platform], label, platform)
+        for platform, label in [(PLATFORM_NORMAL, '一般平台'), (PLATFORM_B2B, '特殊平台')]
+    ]
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    df_merged_normal.to_csv(OUTPUT_CSV_PATH, index=False, encoding='utf-8-sig')
-    df_merged_special.to_csv(output_special_path, index=False, encoding='utf-8-sig')
+    counts = write_platform_partitions(pd.concat(merged, ignore_index=True), master_paths, index=False, encoding='utf-8-sig')
 
-    print(f"ETL 完成，輸出一般平台檔案: {OUTPUT_CSV_PATH}")
-    print(f"ETL 完成，輸出特殊平台檔案: {output_special_path}")
+    print(f"ETL 完成（{len(input_csv_paths)} 個檔案），輸出一般平台檔案: {master_paths[PLATFORM_NORMAL]}（{counts[PLATFORM_NORMAL]} 筆）")
+    print(f"ETL 完成，輸出特殊平台檔案: {master_paths[PLATFORM_B2B]}（{counts[PLATFORM_B2B]} 筆）")
 
 if __name__ == "__main__":
     main()
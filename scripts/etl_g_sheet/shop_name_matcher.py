@@ -0,0 +1,87 @@
+# shop_name_matcher.py
+# shop_name 模糊比對：以 Aho-Corasick 自動機一次比對所有店名 / 關鍵字別名
+#   手打的店名常多了前後綴（例如「八里小舖-蝦皮」、「MOMO購物中心 退貨」），與對照檔不完全相同時找出字串中包含的別名：
+#   - 被更長的別名完全涵蓋的比對結果不列入（「店1」不會干擾「店10」）
+#   - 剩下的別名都指向同一家店 → 採用該店的 shop_account / 店名
+#   - 指向兩家以上的店 → 比對結果不明確，回報後維持空白
+# 自動機只建一次，每個不重複的 shop_name 掃描一次，耗時與文字總長度成正比，與別名數量無關。
+
+
+class ShopNameMatcher:
+    def __init__(self, shop_lookup, min_alias_length=2):
+        """shop_lookup: load_shop_account_map_strict() 的查詢表（index 為別名，欄位 shop_account、real_name）"""
+        self.shops = {}  # 別名 -> (shop_account, real_name)
+        self.goto = [{}]
+        self.fail = [0]
+        self.alias_at = [None]  # 在此狀態結束的別名
+        self.dict_link = [0]  # 沿 fail 鏈最近一個有別名結束的狀態（0 表示沒有）
+
+        for alias, account, real_name in zip(shop_lookup.index, shop_lookup['shop_account'], shop_lookup['real_name']):
+            if not isinstance(alias, str) or len(alias) < min_alias_length:
+                continue
+            self.shops[alias] = (account if isinstance(account, str) else '', real_name)
+            self.add_alias(alias)
+        self.build_links()
+
+    def add_alias(self, alias):
+        state = 0
+        for char in alias:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.alias_at.append(None)
+                self.dict_link.append(0)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.alias_at[state] = alias
+
+    def build_links(self):
+        """BFS 建立 fail 與 dictionary suffix link"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.dict_link[next_state] = target if self.alias_at[target] is not None else self.dict_link[target]
+                queue.append(next_state)
+
+    def find_all(self, text):
+        """回傳 text 中出現的所有別名 [(起點, 終點, 別名)]"""
+        matches = []
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            hit = state if self.alias_at[state] is not None else self.dict_link[state]
+            while hit:
+                alias = self.alias_at[hit]
+                matches.append((end - len(alias), end, alias))
+                hit = self.dict_link[hit]
+        return matches
+
+    def candidates(self, text):
+        """去掉被更長別名涵蓋的比對後，回傳符合的店 {(shop_account, real_name)}"""
+        matches = self.find_all(text)
+        kept = [
+            (start, end, alias) for start, end, alias in matches
+            if not any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in matches)
+        ]
+        return {self.shops[alias] for _, _, alias in kept}
+
+    def resolve(self, names):
+        """逐一比對不重複的店名，回傳 ({店名: (shop_account, real_name)}, {店名: 符合的店名清單})"""
+        resolved = {}
+        ambiguous = {}
+        for name in names:
+            shops = self.candidates(name)
+            if len(shops) == 1:
+                resolved[name] = shops.pop()
+            elif len(shops) > 1:
+                ambiguous[name] = sorted(str(real_name) for _, real_name in shops)
+        return resolved, ambiguous
@@ -0,0 +1,271 @@
+# local_bq_sink.py
+# 本機模擬的 BigQuery（upload_to_bq.py --dry-run 使用）
+#   實作 BigQueryBatchUploader 用到的 bigquery.Client 介面：資料集、載入作業、get_table / delete_table / copy_table 與分區取代的 MERGE，
+#   每張表存成 <LOCAL_SINK_DIR>/<project>/<dataset>/<table>.parquet（可直接以 pandas / DuckDB 讀取比對）。
+#   - 指定 schema 的載入作業依 schema 嚴格轉型，無法轉換時作業失敗（與 BigQuery 相同）
+#   - autodetect 載入（dataframe 模式）照推論型別寫入，但與 BQ_SCHEMA 型別不符的欄位會記錄警告
+#   - 以 upload_mbps 模擬傳輸時間（同步）、job_latency_seconds 模擬作業排隊與執行時間（非同步）
+# 不需要網路與憑證，可用來比較不同上傳格式 / 並行數的序列化成本與吞吐量。
+import io
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from google.api_core.exceptions import BadRequest, Conflict, NotFound
+from google.cloud import bigquery
+
+from bq_schema import arrow_schema, schema_for_columns
+
+logger = logging.getLogger(__name__)
+
+CSV_TIMESTAMP_PARSERS = [pa_csv.ISO8601, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M']
+MERGE_PATTERN = re.compile(r'MERGE `[^`]+\.(?P<target>[^.`]+)`\s+AS target\s+USING `[^`]+\.(?P<staging>[^.`]+)`')
+
+
+def naive_timestamps(schema):
+    """CSV 解析用的 schema：pyarrow 無法把不含時區的文字直接解析成帶時區的 timestamp，
+    先以不帶時區解析，載入時再轉成 UTC（與 BigQuery 把不含時區的 CSV 時間視為 UTC 相同）"""
+    return pa.schema([
+        field.with_type(pa.timestamp(field.type.unit)) if pa.types.is_timestamp(field.type) else field
+        for field in schema
+    ])
+
+
+def check_parquet_timestamps(actual, expected):
+    """Parquet 不帶時區的 timestamp 在 BigQuery 是 DATETIME，載入到 TIMESTAMP 欄位會失敗（本機轉型不會自動發現）"""
+    mismatched = [
+        field.name for field in expected
+        if pa.types.is_timestamp(field.type) and field.type.tz is not None
+        and pa.types.is_timestamp(actual.field(field.name).type) and actual.field(field.name).type.tz is None
+    ]
+    if mismatched:
+        raise BadRequest(f"Parquet 欄位為 DATETIME（不帶時區），schema 為 TIMESTAMP: {', '.join(mismatched)}")
+
+
+class LocalTable:
+    """get_table() 的回傳值，提供 uploader 讀取的欄位"""
+
+    def __init__(self, path, meta):
+        self.num_rows = meta["num_rows"]
+        self.num_bytes = os.path.getsize(path)
+        field = meta.get("time_partitioning_field")
+        self.time_partitioning = bigquery.TimePartitioning(field=field) if field else None
+        self.schema = [bigquery.SchemaField(name, field_type) for name, field_type in meta["schema"]]
+
+
+class LocalJob:
+    """模擬非同步作業：建立時已完成解析與型別檢查，經過 latency 秒後 done()；result() 時才寫入資料"""
+
+    def __init__(self, latency, apply=None, error=None, output_rows=None, input_file_bytes=None):
+        self.job_id = f"local_{uuid.uuid4().hex[:12]}"
+        self.finish_at = time.monotonic() + latency
+        self.apply = apply
+        self.error = error
+        self.output_rows = output_rows
+        self.input_file_bytes = input_file_bytes
+
+    def done(self):
+        return time.monotonic() >= self.finish_at
+
+    def result(self):
+        remaining = self.finish_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        if self.error is not None:
+            raise self.error
+        if self.apply is not None:
+            self.apply()
+            self.apply = None
+        return self
+
+
+class LocalBigQueryClient:
+    """以本機 Parquet 檔模擬的 BigQuery 客戶端"""
+
+    def __init__(self, project, root_dir, job_latency_seconds=2.0, upload_mbps=50.0):
+        self.project = project
+        self.root_dir = root_dir
+        self.job_latency_seconds = job_latency_seconds
+        self.upload_mbps = upload_mbps
+
+    # ==== 資料集 / 表格 ====
+
+    def dataset(self, dataset_id):
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def dataset_dir(self, dataset_ref):
+        return os.path.join(self.root_dir, dataset_ref.project, dataset_ref.dataset_id)
+
+    def get_dataset(self, dataset_ref):
+        if not os.path.isdir(self.dataset_dir(dataset_ref)):
+            raise NotFound(f"Dataset {dataset_ref.dataset_id} not found")
+        return bigquery.Dataset(dataset_ref)
+
+    def create_dataset(self, dataset):
+        path = self.dataset_dir(dataset.reference)
+        if os.path.isdir(path):
+            raise Conflict(f"Dataset {dataset.dataset_id} already exists")
+        os.makedirs(path)
+        return dataset
+
+    def table_path(self, table_ref):
+        return os.path.join(self.root_dir, table_ref.project, table_ref.dataset_id, f"{table_ref.table_id}.parquet")
+
+    def read_meta(self, table_ref):
+        with open(f"{self.table_path(table_ref)}.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_table(self, table_ref):
+        path = self.table_path(table_ref)
+        if not os.path.exists(path):
+            raise NotFound(f"Table {table_ref.table_id} not found")
+        return LocalTable(path, self.read_meta(table_ref))
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        path = self.table_path(table_ref)
+        if not os.path.exists(path):
+            if not_found_ok:
+                return
+            raise NotFound(f"Table {table_ref.table_id} not found")
+        os.remove(path)
+        os.remove(f"{path}.json")
+
+    def read_table(self, table_ref):
+        return pq.read_table(self.table_path(table_ref))
+
+    def write_table(self, table_ref, table, time_partitioning_field=None):
+        path = self.table_path(table_ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path)
+        meta = {
+            "num_rows": table.num_rows,
+            "schema": [[field.name, str(field.type)] for field in table.schema],
+            "time_partitioning_field": time_partitioning_field,
+        }
+        with open(f"{path}.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    # ==== 載入作業 ====
+
+    def simulate_transfer(self, num_bytes):
+        if self.upload_mbps:
+            time.sleep(num_bytes * 8 / (self.upload_mbps * 1_000_000))
+
+    def write_job(self, table_ref, table, job_config, num_bytes):
+        """依 write_disposition 建立寫入作業"""
+        disposition = job_config.write_disposition or "WRITE_APPEND"
+        partitioning = job_config.time_partitioning
+        partition_field = partitioning.field if partitioning is not None else None
+
+        def apply():
+            exists = os.path.exists(self.table_path(table_ref))
+            if exists and disposition == "WRITE_EMPTY":
+                raise Conflict(f"Table {table_ref.table_id} is not empty")
+            if exists and disposition == "WRITE_APPEND":
+                existing = self.read_table(table_ref)
+                combined = pa.concat_tables([existing, table.cast(existing.schema)])
+                self.write_table(table_ref, combined, self.read_meta(table_ref)["time_partitioning_field"])
+            else:
+                field = partition_field or (self.read_meta(table_ref)["time_partitioning_field"] if exists else None)
+                self.write_table(table_ref, table, field)
+
+        return LocalJob(self.job_latency_seconds, apply=apply, output_rows=table.num_rows, input_file_bytes=num_bytes)
+
+    def parse_file(self, payload, job_config):
+        source_format = job_config.source_format
+        schema = job_config.schema
+        if source_format == bigquery.SourceFormat.PARQUET:
+            return pq.read_table(io.BytesIO(payload))
+        if source_format == bigquery.SourceFormat.CSV:
+            if not schema:
+                return pa_csv.read_csv(io.BytesIO(payload))
+            names = [field.name for field in schema]
+            return pa_csv.read_csv(
+                io.BytesIO(payload),
+                read_options=pa_csv.ReadOptions(column_names=names, skip_rows=job_config.skip_leading_rows or 0),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=bool(job_config.allow_quoted_newlines)),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=naive_timestamps(arrow_schema(schema)), null_values=[''], strings_can_be_null=True,
+                    timestamp_parsers=CSV_TIMESTAMP_PARSERS,
+                ),
+            )
+        raise BadRequest(f"本機模擬不支援的來源格式: {source_format}")
+
+    def load_table_from_file(self, file_obj, destination, job_config=None, size=None, num_retries=None, **kwargs):
+        payload = file_obj.read()
+        self.simulate_transfer(len(payload))
+        job_config = job_config or bigquery.LoadJobConfig()
+        try:
+            table = self.parse_file(payload, job_config)
+            if job_config.schema:
+                expected = arrow_schema(job_config.schema)
+                table = table.select(expected.names)
+                if job_config.source_format == bigquery.SourceFormat.PARQUET:
+                    check_parquet_timestamps(table.schema, expected)
+                table = table.cast(expected)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, KeyError, BadRequest) as e:
+            return LocalJob(self.job_latency_seconds, error=BadRequest(f"載入 {destination.table_id} 失敗: {e}"))
+        return self.write_job(destination, table, job_config, len(payload))
+
+    def load_table_from_dataframe(self, dataframe, destination, job_config=None, **kwargs):
+        """與 bigquery.Client 相同，先序列化成 Parquet 再上傳；autodetect 的型別與 BQ_SCHEMA 不符時記錄警告"""
+        job_config = job_config or bigquery.LoadJobConfig()
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        buffer = pa.BufferOutputStream()
+        pq.write_table(table, buffer)
+        num_bytes = buffer.getvalue().size
+        self.simulate_transfer(num_bytes)
+
+        expected = arrow_schema(schema_for_columns(dataframe.columns))
+        drifted = [
+            f"{field.name}: {field.type} (BQ_SCHEMA {expected.field(field.name).type})"
+            for field in table.schema if not field.type.equals(expected.field(field.name).type)
+        ]
+        if drifted:
+            logger.warning(f"{destination.table_id} autodetect 型別與 BQ_SCHEMA 不符: {', '.join(drifted)}")
+        return self.write_job(destination, table, job_config, num_bytes)
+
+    def copy_table(self, sources, destination, job_config=None, **kwargs):
+        """複製作業：目標表沿用來源表的資料與分區設定（預設 WRITE_EMPTY，目標已存在時失敗）"""
+        source = sources[0] if isinstance(sources, (list, tuple)) else sources
+        disposition = (job_config.write_disposition if job_config is not None else None) or "WRITE_EMPTY"
+        if not os.path.exists(self.table_path(source)):
+            return LocalJob(self.job_latency_seconds, error=NotFound(f"Table {source.table_id} not found"))
+
+        def apply():
+            if os.path.exists(self.table_path(destination)) and disposition == "WRITE_EMPTY":
+                raise Conflict(f"Table {destination.table_id} already exists")
+            self.write_table(destination, self.read_table(source), self.read_meta(source)["time_partitioning_field"])
+
+        return LocalJob(self.job_latency_seconds, apply=apply)
+
+    # ==== 查詢（只支援 upload_to_bq.PARTITION_MERGE_SQL） ====
+
+    def query(self, sql, job_config=None):
+        match = MERGE_PATTERN.search(sql)
+        if match is None:
+            return LocalJob(self.job_latency_seconds, error=BadRequest("本機模擬只支援分區取代的 MERGE"))
+        dataset_ref = self.dataset(re.search(r'MERGE `[^.`]+\.([^.`]+)\.', sql).group(1))
+        target_ref = dataset_ref.table(match.group('target'))
+        staging_ref = dataset_ref.table(match.group('staging'))
+        params = {param.name: param for param in job_config.query_parameters}
+        dates = set(params["dates"].values)
+        include_null = params["include_null"].value
+
+        def apply():
+            target = self.read_table(target_ref)
+            staging = self.read_table(staging_ref)
+            order_date = pd.Series(target.column('order_date').to_pylist(), dtype=object)
+            drop = order_date.isin(dates) | (order_date.isna() if include_null else False)
+            kept = target.filter(pa.array(~drop.to_numpy(dtype=bool)))
+            merged = pa.concat_tables([kept, staging.select(target.schema.names).cast(target.schema)])
+            self.write_table(target_ref, merged, self.read_meta(target_ref)["time_partitioning_field"])
+
+        return LocalJob(self.job_latency_seconds, apply=apply)
@@ -0,0 +1,50 @@
+# merge_delta.py
+# 記錄單次主檔合併（update_logic_with_order_level_replacement）實際異動的訂單，
+# 供合併後的各輸出階段只重算受影響的訂單 / 日期，而不必重掃整份主檔。
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from clean_for_bigquery import master_to_text
+from platform_routing import route_by_platform
+
+
+@dataclass
+class MergeDelta:
+    """單次合併的異動內容。
+
+    new_records:      本次新增 / 覆蓋的訂單資料（新版本）
+    orphaned_records: 日期範圍內、新資料中已消失的舊訂單（仍保留於主檔，另存孤兒檔）
+    replaced_records: 被新資料覆蓋、已從主檔移除的舊版本紀錄
+    is_full_rebuild:  首次建立主檔（或無法讀取舊主檔）時為 True，下游應全量重建"""
+    new_records: pd.DataFrame
+    orphaned_records: pd.DataFrame = field(default_factory=pd.DataFrame)
+    replaced_records: pd.DataFrame = field(default_factory=pd.DataFrame)
+    is_full_rebuild: bool = False
+
+    def _text_column(self, column):
+        frames = [df[[column]] for df in self.changed_frames if column in df.columns]
+        if not frames:
+            return pd.Series(dtype=object)
+        return master_to_text(pd.concat(frames, ignore_index=True))[column]
+
+    def for_platform(self, platform):
+        """只保留指定平台分類（platform_routing.PLATFORM_CLASSES）的異動，供只處理該分區的下游使用"""
+        def keep(df):
+            return route_by_platform(df)[platform] if 'shop_name' in df.columns else df
+        return MergeDelta(new_records=keep(self.new_records), orphaned_records=keep(self.orphaned_records),
+                          replaced_records=keep(self.replaced_records), is_full_rebuild=self.is_full_rebuild)
+
+    @property
+    def changed_frames(self):
+        return (self.new_records, self.orphaned_records, self.replaced_records)
+
+    @property
+    def affected_order_sns(self):
+        """新增、被覆蓋與孤兒訂單的 order_sn（與 BigQuery 版主檔相同的文字格式）"""
+        return set(self._text_column('order_sn'))
+
+    @property
+    def touched_dates(self):
+        """受影響訂單的 order_date（'YYYY-MM-DD'，無法解析者為空字串）"""
+        return set(self._text_column('order_date'))
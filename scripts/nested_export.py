@@ -0,0 +1,123 @@
+# nested_export.py
+# 訂單層級巢狀輸出（BigQuery 用，newline-delimited JSON）
+#   每筆訂單一列，訂單表頭欄位只出現一次，商品明細放在 REPEATED 的 items 欄位：
+#     {"order_sn": "...", "shop_account": "...", ..., "items": [{"product_name": "...", "quantity": 1, ...}, ...]}
+#   取代 B01（商品以 ; 串接成字串）與 B02（每個明細重複整份表頭）之間的 self-join。
+#   Schema 由 config.BQ_SCHEMA 衍生（nested_order_schema），並另存為 JSON 供 bq load --schema 使用；
+#   值依 schema 型別轉換（見 bq_schema.typed_columns）。
+#
+# 單獨執行：讀取 BigQuery 版主檔輸出；加上 --upload 時以此 schema 載入 BigQuery
+import argparse
+import json
+import os
+
+import pandas as pd
+from google.cloud.bigquery import LoadJobConfig, SchemaField, SourceFormat, WriteDisposition
+
+from config import BIGQUERY_CSV_PATH, BQ_SCHEMA, NESTED_EXPORT_PATH, NESTED_SCHEMA_PATH, NESTED_TABLE_ID
+from bq_schema import typed_columns
+
+# 每個商品明細各自不同的欄位；其餘欄位視為訂單表頭（每個 order_sn 取第一筆，與 B01 相同）
+ITEM_FIELDS = [
+    'product_name', 'product_variation', 'product_sku_main', 'product_sku_variation',
+    'product_original_price', 'product_campaign_price', 'quantity', 'return_quantity',
+    'promo_bundle_indicator', 'promo_bundle_discount_label',
+]
+ITEMS_FIELD = 'items'
+
+
+def split_schema():
+    """BQ_SCHEMA → (訂單表頭欄位, 商品明細欄位)，維持 BQ_SCHEMA 的欄位順序"""
+    order_fields = [field for field in BQ_SCHEMA if field.name not in ITEM_FIELDS]
+    item_fields = [field for field in BQ_SCHEMA if field.name in ITEM_FIELDS]
+    return order_fields, item_fields
+
+
+def nested_order_schema():
+    """訂單層級巢狀 schema：訂單表頭欄位 + REPEATED RECORD items"""
+    order_fields, item_fields = split_schema()
+    items = SchemaField(ITEMS_FIELD, "RECORD", mode="REPEATED", fields=item_fields, description="訂單商品明細")
+    return order_fields + [items]
+
+
+def build_nested_orders(text_df):
+    """全字串主檔 → 每筆訂單一列的 DataFrame，items 欄位為商品明細 dict 的 list（依主檔原始順序）"""
+    order_fields, item_fields = split_schema()
+    codes, order_sns = pd.factorize(text_df['order_sn'])
+    first_rows = pd.Series(range(len(text_df))).groupby(codes, sort=True).first().to_numpy()
+
+    orders = typed_columns(text_df.iloc[first_rows], order_fields).reset_index(drop=True)
+
+    item_records = typed_columns(text_df, item_fields).astype(object)
+    item_records = item_records.where(item_records.notna(), None).to_dict('records')
+    items = [[] for _ in range(len(order_sns))]
+    for code, record in zip(codes, item_records):
+        items[code].append(record)
+    orders[ITEMS_FIELD] = items
+    return orders
+
+
+def write_nested_schema(path=NESTED_SCHEMA_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([field.to_api_repr() for field in nested_order_schema()], f, ensure_ascii=False, indent=2)
+
+
+def write_nested_orders(orders, path=NESTED_EXPORT_PATH):
+    """輸出 newline-delimited JSON（先寫暫存檔再取代），並同時更新 schema 檔"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    orders.to_json(tmp_path, orient='records', lines=True, force_ascii=False)
+    os.replace(tmp_path, path)
+    write_nested_schema()
+
+
+def export_nested_orders(text_df, path=NESTED_EXPORT_PATH):
+    """ETL 主流程呼叫（NESTED_EXPORT_ENABLED 時）：由全字串主檔產生並寫出巢狀訂單檔，回傳訂單數"""
+    orders = build_nested_orders(text_df)
+    write_nested_orders(orders, path)
+    return len(orders)
+
+
+def nested_load_job_config():
+    """載入巢狀訂單檔用的 LoadJobConfig：明確指定 schema，不使用 autodetect"""
+    return LoadJobConfig(
+        source_format=SourceFormat.NEWLINE_DELIMITED_JSON,
+        schema=nested_order_schema(),
+        write_disposition=WriteDisposition.WRITE_TRUNCATE,
+    )
+
+
+def upload_nested_orders(path=NESTED_EXPORT_PATH, table_id=NESTED_TABLE_ID):
+    from upload_to_bq import BigQueryBatchUploader
+    from config import PROJECT_ID, DATASET_ID, BQ_KEY_PATH
+
+    uploader = BigQueryBatchUploader(credentials_path=BQ_KEY_PATH, project_id=PROJECT_ID, dataset_id=DATASET_ID)
+    if not uploader.initialize_client() or not uploader.create_dataset_if_not_exists():
+        raise RuntimeError("BigQuery 連線失敗")
+    table_ref = uploader.client.dataset(DATASET_ID).table(table_id)
+    with open(path, 'rb') as f:
+        job = uploader.client.load_table_from_file(f, table_ref, job_config=nested_load_job_config())
+    job.result()
+    table = uploader.client.get_table(table_ref)
+    print(f'✅ 已上傳至 {PROJECT_ID}.{DATASET_ID}.{table_id}，共 {table.num_rows} 筆訂單')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="輸出訂單層級巢狀 JSON（items 為 REPEATED RECORD）")
+    parser.add_argument('--upload', action='store_true', help="輸出後以巢狀 schema 載入 BigQuery")
+    args = parser.parse_args()
+
+    # 讀取資料
+    df = pd.read_csv(BIGQUERY_CSV_PATH, dtype=str, keep_default_na=False)
+
+    orders = export_nested_orders(df)
+    print(f'完成：{NESTED_EXPORT_PATH} ({orders} 筆訂單，原始 {len(df)} 筆明細)')
+    print(f'Schema：{NESTED_SCHEMA_PATH}')
+
+    if args.upload:
+        upload_nested_orders()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import pandas as pd
+import io
 import os
 import glob
 import shutil
@@ -6,23 +7,34 @@ from datetime import datetime
 try:
     from config import (
         INPUT_DIR, OUTPUT_DIR, ARCHIVE_DIR, OUTPUT_CSV_PATH, ORPHAN_CSV_PATH,
-        COLUMN_MAPPING, FINAL_COLUMN_ORDER
+        COLUMN_MAPPING, FINAL_COLUMN_ORDER, ARCHIVE_TIMESTAMP_FORMAT
     )
 except ImportError:
     print("❌ 錯誤：無法從 config.py 導入設定。")
     exit()
 import logging
 import traceback
+from split_orders_to_b_tables import run_fanout_stage
+from merge_delta import MergeDelta
+from platform_routing import (
+    PLATFORM_B2B, PLATFORM_NORMAL, platform_partition_paths, read_platform_partitions, route_by_platform,
+    write_platform_partitions
+)
 
 # --- 日誌設定 ---
 log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'python_script_log.txt'))
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding='utf-8',
-    filemode='w'
-)
+
+
+def setup_logging():
+    """設定日誌輸出至專案根目錄的 python_script_log.txt。
+    不在模組載入時執行，避免 replay 的平行解析子行程覆寫主行程的日誌檔。"""
+    logging.basicConfig(
+        filename=log_file_path,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        encoding='utf-8',
+        filemode='w'
+    )
 
 # --- 核心處理函式 ---
 
@@ -73,11 +85,16 @@ def create_robust_composite_key(df):
     return df
 
 
-def update_logic_with_order_level_replacement(df_old, df_new):
-    """以訂單為單位進行覆蓋更新的邏輯"""
+def update_logic_with_order_level_replacement(df_old, df_new, return_replaced=False):
+    """以訂單為單位進行覆蓋更新的邏輯。
+
+    return_replaced=True 時另外回傳被新資料覆蓋的舊版本紀錄，
+    供下游以「撤回舊版本 + 加入新版本」的方式增量維護彙總表。"""
     
     if df_old.empty:
         print("📝 首次建立主檔")
+        if return_replaced:
+            return df_new, pd.DataFrame(), pd.DataFrame()
         return df_new, pd.DataFrame()
     
     print("🔄 進行以訂單為單位的資料比對與更新...")
@@ -142,6 +159,9 @@ def update_logic_with_order_level_replacement(df_old, df_new):
     # 篩選資料
     df_old_kept = df_old[df_old['composite_key'].isin(orders_to_keep)]
     orphaned_records = df_old[df_old['composite_key'].isin(orphaned_orders)]
+    replaced_records = df_old[
+        df_old['composite_key'].isin(orders_to_replace) & ~df_old['composite_key'].isin(orders_to_keep)
+    ]
     df_new_kept = df_new  # 新資料全部保留
     
     # 統計訂單層級的變化
@@ -179,6 +199,8 @@ def update_logic_with_order_level_replacement(df_old, df_new):
     # 合併
     final_master_df = pd.concat([df_old_aligned, df_new_aligned], ignore_index=True)
     
+    if return_replaced:
+        return final_master_df, orphaned_records, replaced_records
     return final_master_df, orphaned_records
 
 
@@ -238,6 +260,123 @@ def parse_order_date_from_sn(order_sn):
         return None
 
 
+def parse_order_file(filepath, processing_date=None):
+    """讀取單一蝦皮訂單 Excel 並完成欄位映射與型別轉換。
+
+    processing_date 預設為今天；replay 重建時傳入原始歸檔日期，
+    讓重建結果與當時的增量執行一致。解析失敗時直接拋出例外，由呼叫端處理。"""
+    filename = os.path.basename(filepath)
+    # 解析店鋪資訊
+    anchor_pattern = '_Order.all.'
+    first_underscore_pos = filename.find('_')
+    anchor_pos = filename.find(anchor_pattern)
+    if first_underscore_pos == -1 or anchor_pos == -1 or anchor_pos < first_underscore_pos:
+        raise ValueError(f"檔名格式不符，缺少店鋪資訊或 '{anchor_pattern}' 標記")
+
+    shop_name = filename[:first_underscore_pos]
+    shop_account = filename[first_underscore_pos + 1:anchor_pos]
+    if not shop_name or not shop_account:
+        raise ValueError("店鋪名稱或帳號為空")
+
+    # 讀取 Excel 檔案
+    print(f"   -> 📖 讀取檔案: {filename}")
+    df = pd.read_excel(filepath, dtype=str)
+
+    # 清理欄位名稱
+    df = clean_column_names(df)
+
+    # 顯示實際讀取到的欄位（用於除錯）
+    logging.info(f"檔案 {filename} 清理後的欄位: {list(df.columns)}")
+
+    # 重命名欄位前，檢查映射
+    unmapped_columns = [col for col in df.columns if col not in COLUMN_MAPPING]
+    if unmapped_columns:
+        logging.warning(f"檔案 {filename} 有未映射的欄位: {unmapped_columns}")
+        print(f"   -> ⚠️ 未映射欄位: {unmapped_columns}")
+
+    # 重命名欄位
+    df.rename(columns=COLUMN_MAPPING, inplace=True)
+
+    # 統計成功映射的欄位數量
+    mapped_count = len([col for col in df.columns if col in COLUMN_MAPPING.values()])
+    print(f"   -> 📋 成功映射 {len(COLUMN_MAPPING)} 個欄位，資料包含 {len(df.columns)} 個欄位")
+
+    # 檢查必要欄位是否存在
+    required_fields = ['order_sn', 'buyer_username']
+    missing_fields = [field for field in required_fields if field not in df.columns]
+    if missing_fields:
+        logging.warning(f"檔案 {filename} 缺少必要欄位: {missing_fields}")
+        print(f"   -> ⚠️ 缺少必要欄位: {missing_fields}")
+    else:
+        print(f"   -> ✅ 所有必要欄位都存在")
+
+    # 清理文字欄位中的換行符
+    for col in df.select_dtypes(include=['object']).columns:
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.replace('\n', ' ', regex=False).str.replace('\r', '', regex=False)
+
+    # 新增店鋪資訊和處理日期
+    df['shop_name'] = shop_name
+    df['shop_account'] = shop_account
+    df['processing_date'] = processing_date or datetime.now().date()
+
+    # 轉換數值欄位
+    float_columns = [
+        'product_total_price', 'buyer_paid_shipping_fee', 'shopee_shipping_subsidy',
+        'return_shipping_fee', 'total_amount_paid_by_buyer', 'shopee_subsidy_amount',
+        'shopee_coin_offset', 'credit_card_promotion_discount', 'transaction_fee',
+        'other_service_fee', 'payment_processing_fee', 'product_original_price',
+        'product_campaign_price'
+    ]
+    for col in float_columns:
+        if col in df.columns:
+            # 移除可能的貨幣符號和逗號
+            df[col] = df[col].astype(str).str.replace(r'[^\d.-]', '', regex=True)
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # 處理費率欄位（百分比轉小數）
+    if 'payment_processing_fee_rate' in df.columns:
+        df['payment_processing_fee_rate'] = (
+            pd.to_numeric(
+                df['payment_processing_fee_rate'].astype(str)
+                .str.replace('%', '', regex=False)
+                .str.replace(r'[^\d.-]', '', regex=True),
+                errors='coerce'
+            ).fillna(0) / 100
+        )
+
+    # 解析訂單日期
+    if 'order_sn' in df.columns:
+        print(f"   -> 📅 解析訂單日期...")
+        df['order_date'] = df['order_sn'].apply(parse_order_date_from_sn)
+        # 統計解析成功的數量
+        valid_dates = df['order_date'].notna().sum()
+        print(f"      成功解析 {valid_dates}/{len(df)} 筆訂單日期")
+        logging.info(f"訂單日期解析: {valid_dates}/{len(df)} 成功")
+
+    # 處理日期欄位
+    if 'ship_by_date' in df.columns:
+        df['ship_by_date'] = pd.to_datetime(df['ship_by_date'], errors='coerce').dt.date
+
+    # 處理時間戳欄位
+    timestamp_cols = [
+        'order_creation_timestamp', 'buyer_payment_timestamp',
+        'actual_shipping_timestamp', 'order_completion_timestamp'
+    ]
+    for col in timestamp_cols:
+        if col in df.columns:
+            # 處理空值和 '-' 符號
+            df[col] = df[col].replace(['-', '', 'nan', 'NaN'], pd.NaT)
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+
+    # 處理整數欄位
+    int_columns = ['quantity', 'return_quantity', 'installment_plan_periods', 'days_to_ship']
+    for col in int_columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+    return df
+
+
 def load_and_clean_new_data():
     """從 Excel 檔案讀取、解析、清理並轉換所有新訂單資料。"""
     logging.info("Starting to load and clean new data from Excel files.")
@@ -256,115 +395,7 @@ def load_and_clean_new_data():
         try:
             os.makedirs(OUTPUT_DIR, exist_ok=True)
             os.makedirs(ARCHIVE_DIR, exist_ok=True)
-            
-            # 解析店鋪資訊
-            anchor_pattern = '_Order.all.'
-            first_underscore_pos = filename.find('_')
-            anchor_pos = filename.find(anchor_pattern)
-            if first_underscore_pos == -1 or anchor_pos == -1 or anchor_pos < first_underscore_pos:
-                raise ValueError(f"檔名格式不符，缺少店鋪資訊或 '{anchor_pattern}' 標記")
-            
-            shop_name = filename[:first_underscore_pos]
-            shop_account = filename[first_underscore_pos + 1:anchor_pos]
-            if not shop_name or not shop_account:
-                raise ValueError("店鋪名稱或帳號為空")
-
-            # 讀取 Excel 檔案
-            print(f"   -> 📖 讀取檔案: {filename}")
-            df = pd.read_excel(filepath, dtype=str)
-            
-            # 清理欄位名稱
-            df = clean_column_names(df)
-            
-            # 顯示實際讀取到的欄位（用於除錯）
-            logging.info(f"檔案 {filename} 清理後的欄位: {list(df.columns)}")
-            
-            # 重命名欄位前，檢查映射
-            unmapped_columns = [col for col in df.columns if col not in COLUMN_MAPPING]
-            if unmapped_columns:
-                logging.warning(f"檔案 {filename} 有未映射的欄位: {unmapped_columns}")
-                print(f"   -> ⚠️ 未映射欄位: {unmapped_columns}")
-            
-            # 重命名欄位
-            df.rename(columns=COLUMN_MAPPING, inplace=True)
-            
-            # 統計成功映射的欄位數量
-            mapped_count = len([col for col in df.columns if col in COLUMN_MAPPING.values()])
-            print(f"   -> 📋 成功映射 {len(COLUMN_MAPPING)} 個欄位，資料包含 {len(df.columns)} 個欄位")
-            
-            # 檢查必要欄位是否存在
-            required_fields = ['order_sn', 'buyer_username']
-            missing_fields = [field for field in required_fields if field not in df.columns]
-            if missing_fields:
-                logging.warning(f"檔案 {filename} 缺少必要欄位: {missing_fields}")
-                print(f"   -> ⚠️ 缺少必要欄位: {missing_fields}")
-            else:
-                print(f"   -> ✅ 所有必要欄位都存在")
-            
-            # 清理文字欄位中的換行符
-            for col in df.select_dtypes(include=['object']).columns:
-                if col in df.columns:
-                    df[col] = df[col].astype(str).str.replace('\n', ' ', regex=False).str.replace('\r', '', regex=False)
-
-            # 新增店鋪資訊和處理日期
-            df['shop_name'] = shop_name
-            df['shop_account'] = shop_account
-            df['processing_date'] = datetime.now().date()
-
-            # 轉換數值欄位
-            float_columns = [
-                'product_total_price', 'buyer_paid_shipping_fee', 'shopee_shipping_subsidy',
-                'return_shipping_fee', 'total_amount_paid_by_buyer', 'shopee_subsidy_amount',
-                'shopee_coin_offset', 'credit_card_promotion_discount', 'transaction_fee',
-                'other_service_fee', 'payment_processing_fee', 'product_original_price',
-                'product_campaign_price'
-            ]
-            for col in float_columns:
-                if col in df.columns:
-                    # 移除可能的貨幣符號和逗號
-                    df[col] = df[col].astype(str).str.replace(r'[^\d.-]', '', regex=True)
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-
-            # 處理費率欄位（百分比轉小數）
-            if 'payment_processing_fee_rate' in df.columns:
-                df['payment_processing_fee_rate'] = (
-                    pd.to_numeric(
-                        df['payment_processing_fee_rate'].astype(str)
-                        .str.replace('%', '', regex=False)
-                        .str.replace(r'[^\d.-]', '', regex=True),
-                        errors='coerce'
-                    ).fillna(0) / 100
-                )
-
-            # 解析訂單日期
-            if 'order_sn' in df.columns:
-                print(f"   -> 📅 解析訂單日期...")
-                df['order_date'] = df['order_sn'].apply(parse_order_date_from_sn)
-                # 統計解析成功的數量
-                valid_dates = df['order_date'].notna().sum()
-                print(f"      成功解析 {valid_dates}/{len(df)} 筆訂單日期")
-                logging.info(f"訂單日期解析: {valid_dates}/{len(df)} 成功")
-
-            # 處理日期欄位
-            if 'ship_by_date' in df.columns:
-                df['ship_by_date'] = pd.to_datetime(df['ship_by_date'], errors='coerce').dt.date
-
-            # 處理時間戳欄位
-            timestamp_cols = [
-                'order_creation_timestamp', 'buyer_payment_timestamp',
-                'actual_shipping_timestamp', 'order_completion_timestamp'
-            ]
-            for col in timestamp_cols:
-                if col in df.columns:
-                    # 處理空值和 '-' 符號
-                    df[col] = df[col].replace(['-', '', 'nan', 'NaN'], pd.NaT)
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-
-            # 處理整數欄位
-            int_columns = ['quantity', 'return_quantity', 'installment_plan_periods', 'days_to_ship']
-            for col in int_columns:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+            df = parse_order_file(filepath)
 
             all_dataframes.append(df)
             processed_files_paths.append(filepath)
@@ -385,6 +416,71 @@ def load_and_clean_new_data():
     return final_df, processed_files_paths
 
 
+# 主檔讀回時的選項：全字串讀取（空字串與 'nan' / 'None' 等 NA 字樣都會讀成 NaN）
+MASTER_READ_CSV_KWARGS = {'dtype': str}
+
+
+def load_master_partitions(master_paths):
+    """讀取主檔所有平台分區並還原型別（分區都不存在時回傳空表）"""
+    df_old = read_platform_partitions(master_paths, **MASTER_READ_CSV_KWARGS)
+    return convert_master_dtypes(df_old if df_old is not None else pd.DataFrame())
+
+
+def reload_master_as_csv(df_master, appended_rows=None):
+    """記憶體中的主檔改成「寫出後再讀回」的樣子：轉成 CSV 文字再以相同選項讀回，並依平台分區排列。
+
+    replay 逐批合併時不寫檔，用這個函式讓每批的舊資料與 run_update_logic 讀到的主檔完全相同
+    （NA 字樣、數值格式與分區順序都一致），重建結果才會與逐次增量執行相同。
+    appended_rows 指定時只轉換最後這幾列（上一批合併進來的新資料），其餘列已是讀回後的型態，
+    不必每批都把整份主檔重新轉換一次。"""
+    if df_master.empty:
+        return df_master
+    appended_rows = len(df_master) if appended_rows is None else appended_rows
+    kept = df_master.iloc[:len(df_master) - appended_rows]
+    appended = df_master.iloc[len(df_master) - appended_rows:]
+    if not appended.empty:
+        buffer = io.StringIO()
+        appended.to_csv(buffer, index=False)
+        buffer.seek(0)
+        appended = convert_master_dtypes(pd.read_csv(buffer, **MASTER_READ_CSV_KWARGS))
+    frames = [frame for frame in (kept, appended) if not frame.empty]
+    df_master = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+    # 與讀回平台分區相同：一般平台在前、B2B 在後（各自保留原本的列順序）
+    return pd.concat(route_by_platform(df_master).values(), ignore_index=True)
+
+
+def convert_master_dtypes(df_old):
+    """將以字串讀入的主檔還原為日期 / 時間戳型別，供訂單層級比對使用。"""
+    if df_old.empty:
+        return df_old
+
+    date_cols = ['processing_date', 'order_date', 'ship_by_date']
+    for col in date_cols:
+        if col in df_old.columns:
+            df_old[col] = pd.to_datetime(df_old[col], errors='coerce').dt.date
+
+    timestamp_cols = [
+        'order_creation_timestamp', 'buyer_payment_timestamp',
+        'actual_shipping_timestamp', 'order_completion_timestamp'
+    ]
+    for col in timestamp_cols:
+        if col in df_old.columns:
+            df_old[col] = pd.to_datetime(df_old[col], errors='coerce')
+    return df_old
+
+
+def finalize_merge_result(final_master_df, orphaned_records):
+    """移除比對用的臨時欄位，並依 FINAL_COLUMN_ORDER 排列主檔欄位。"""
+    # 移除臨時欄位
+    final_master_df = final_master_df.drop(columns=['composite_key', 'order_date_parsed'], errors='ignore')
+    orphaned_records = orphaned_records.drop(columns=['composite_key', 'order_date_parsed'], errors='ignore')
+
+    # 確保欄位順序正確
+    available_columns = [col for col in FINAL_COLUMN_ORDER if col in final_master_df.columns]
+    final_master_df = final_master_df.reindex(columns=available_columns)
+    return final_master_df, orphaned_records
+
+
 def run_update_logic():
     """主流程：執行讀取、比對、更新、歸檔的完整邏輯"""
     logging.info("Starting main update logic.")
@@ -394,11 +490,13 @@ def run_update_logic():
         logging.info("No new data to process. Exiting.")
         return
 
-    if os.path.exists(OUTPUT_CSV_PATH):
+    # 主檔依平台分區存放，合併時讀取所有分區（訂單層級比對需要完整的舊資料）
+    master_paths = platform_partition_paths(OUTPUT_CSV_PATH)
+    if any(os.path.exists(path) for path in master_paths.values()):
         logging.info(f"Loading existing master file from {OUTPUT_CSV_PATH}")
-        print(f"\n📑 正在讀取現有主檔: {os.path.basename(OUTPUT_CSV_PATH)}")
+        print(f"\n📑 正在讀取現有主檔: {os.path.basename(OUTPUT_CSV_PATH)}（含 {os.path.basename(master_paths[PLATFORM_B2B])}）")
         try:
-            df_old = pd.read_csv(OUTPUT_CSV_PATH, dtype=str)
+            df_old = load_master_partitions(master_paths)
             print(f"   -> 載入 {len(df_old)} 筆現有資料")
         except Exception as e:
             logging.error(f"讀取現有主檔失敗: {e}")
@@ -409,38 +507,20 @@ def run_update_logic():
         print("\n📑 未發現現有主檔，將直接建立新檔案。")
         df_old = pd.DataFrame()
 
-    # 轉換舊資料的資料類型
-    if not df_old.empty:
-        date_cols = ['processing_date', 'order_date', 'ship_by_date']
-        for col in date_cols:
-            if col in df_old.columns:
-                df_old[col] = pd.to_datetime(df_old[col], errors='coerce').dt.date
-
-        timestamp_cols = [
-            'order_creation_timestamp', 'buyer_payment_timestamp',
-            'actual_shipping_timestamp', 'order_completion_timestamp'
-        ]
-        for col in timestamp_cols:
-            if col in df_old.columns:
-                df_old[col] = pd.to_datetime(df_old[col], errors='coerce')
+    is_full_rebuild = df_old.empty
 
     # ===== 使用新的訂單層級覆蓋邏輯 =====
-    final_master_df, orphaned_records = update_logic_with_order_level_replacement(df_old, df_new)
-    
-    # 移除臨時欄位
-    final_master_df = final_master_df.drop(columns=['composite_key', 'order_date_parsed'], errors='ignore')
-    orphaned_records = orphaned_records.drop(columns=['composite_key', 'order_date_parsed'], errors='ignore')
-    
-    # 確保欄位順序正確
-    available_columns = [col for col in FINAL_COLUMN_ORDER if col in final_master_df.columns]
-    final_master_df = final_master_df.reindex(columns=available_columns)
+    final_master_df, orphaned_records, replaced_records = update_logic_with_order_level_replacement(
+        df_old, df_new, return_replaced=True
+    )
+    final_master_df, orphaned_records = finalize_merge_result(final_master_df, orphaned_records)
 
     # 儲存與歸檔流程
     logging.info(f"Saving final master dataframe with {len(final_master_df)} rows to CSV.")
     print("\n💾 正在儲存更新後的主檔...")
-    os.makedirs(os.path.dirname(OUTPUT_CSV_PATH), exist_ok=True)
-    final_master_df.to_csv(OUTPUT_CSV_PATH, index=False, encoding='utf-8-sig')
-    print(f"   -> ✅ 主檔已成功更新並儲存至: {os.path.basename(OUTPUT_CSV_PATH)} ({len(final_master_df)} 筆紀錄)")
+    counts = write_platform_partitions(final_master_df, master_paths, index=False, encoding='utf-8-sig')
+    print(f"   -> ✅ 主檔已成功更新並儲存至: {os.path.basename(OUTPUT_CSV_PATH)} ({counts[PLATFORM_NORMAL]} 筆紀錄)")
+    print(f"   -> ✅ B2B 平台訂單: {os.path.basename(master_paths[PLATFORM_B2B])} ({counts[PLATFORM_B2B]} 筆紀錄)")
 
     if not orphaned_records.empty:
         logging.info(f"Found {len(orphaned_records)} orphaned records. Saving to orphan file.")
@@ -454,11 +534,27 @@ def run_update_logic():
         logging.info("No orphaned records found this run.")
         print("\n🟢 本次更新範圍內無任何已消失的訂單。")
 
+    # ===== 主檔合併後的輸出階段：BigQuery 版主檔與 B01–B04 =====
+    # 只由一般平台分區產生（B2B 平台訂單另由 _B2B 分區處理），差量也只取一般平台的異動
+    try:
+        delta = MergeDelta(new_records=df_new, orphaned_records=orphaned_records,
+                           replaced_records=replaced_records, is_full_rebuild=is_full_rebuild)
+        run_fanout_stage(route_by_platform(final_master_df)[PLATFORM_NORMAL], delta.for_platform(PLATFORM_NORMAL))
+    except Exception as e:
+        logging.error(f"產生 BigQuery 版主檔與 B 表失敗: {e}\n{traceback.format_exc()}")
+        print(f"   -> ❌ 產生 B 表失敗: {e}（主檔已更新，可手動執行 split_orders_to_b_tables.py）")
+
+    archive_processed_files(processed_files)
+
+
+def archive_processed_files(processed_files):
+    """將已處理的原始檔案加上時間戳後移至 archive/。
+    同一次執行的檔案共用同一個時間戳，replay 依此還原當時的批次與順序。"""
     logging.info("Archiving processed source files.")
     print("\n🗄️  正在歸檔已處理的原始檔案...")
     os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime(ARCHIVE_TIMESTAMP_FORMAT)
     for filepath in processed_files:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         base_filename = os.path.basename(filepath)
         archive_filename = f"{os.path.splitext(base_filename)[0]}_{timestamp}{os.path.splitext(base_filename)[1]}"
         archive_path = os.path.join(ARCHIVE_DIR, archive_filename)
@@ -470,6 +566,7 @@ def run_update_logic():
 
 if __name__ == "__main__":
     try:
+        setup_logging()
         logging.info("================ SCRIPT START ================")
         print("🚀 開始執行蝦皮訂單 ETL 處理流程...")
         run_update_logic()
@@ -0,0 +1,65 @@
+# platform_routing.py
+# 依平台分類分區存放主檔：B2B 平台（MOMO、PChome、Yahoo、東森）的訂單與一般平台分開寫入
+#   一般平台 → 原主檔路徑（例如 A01_master_orders_cleaned.csv）
+#   B2B 平台 → 主檔檔名加上後綴（例如 A01_master_orders_cleaned_B2B.csv）
+# 合併時讀取所有分區、寫入時依 shop_name 分流，一般 / B2B 的下游只讀自己的分區，不需另外拆檔。
+# 寫入時同時更新主檔旁的統計目錄（stats_catalog.py），報表不必再讀整份主檔。
+# 平台清單只在這裡設定；不匯入 config，Google Sheet ETL（有自己的 config 模組）也共用本模組。
+import os
+
+import pandas as pd
+
+from stats_catalog import stats_catalog_path, update_stats_catalog
+
+B2B_PLATFORMS = ['MOMO購物中心', 'PC購物中心', 'Yahoo購物中心', '東森購物']
+
+PLATFORM_NORMAL = 'normal'
+PLATFORM_B2B = 'b2b'
+PLATFORM_CLASSES = [PLATFORM_NORMAL, PLATFORM_B2B]
+
+
+def platform_partition_paths(master_path, b2b_suffix='_B2B'):
+    """主檔路徑 → 各平台分區的路徑"""
+    base, ext = os.path.splitext(master_path)
+    return {PLATFORM_NORMAL: master_path, PLATFORM_B2B: f'{base}{b2b_suffix}{ext}'}
+
+
+def is_b2b_platform(shop_names):
+    return pd.Series(shop_names).isin(B2B_PLATFORMS)
+
+
+def route_by_platform(df):
+    """依 shop_name 分流，回傳 {平台分類: 資料}（保留原本的列順序）"""
+    is_b2b = is_b2b_platform(df['shop_name']).to_numpy()
+    return {PLATFORM_NORMAL: df[~is_b2b], PLATFORM_B2B: df[is_b2b]}
+
+
+def read_platform_partitions(paths, platforms=None, **read_csv_kwargs):
+    """讀取指定平台分類（預設全部）的分區並合併；分區都不存在時回傳 None"""
+    frames = [
+        pd.read_csv(paths[platform], **read_csv_kwargs)
+        for platform in (platforms or PLATFORM_CLASSES)
+        if os.path.exists(paths[platform])
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def write_platform_partitions(df, paths, **to_csv_kwargs):
+    """寫入時依平台分流，每個分區都會覆寫（沒有資料的分區只留表頭），並更新統計目錄。回傳 {平台分類: 筆數}"""
+    routed = route_by_platform(df)
+    for platform, part in routed.items():
+        path = paths[platform]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part.to_csv(path, **to_csv_kwargs)
+    update_stats_catalog(stats_catalog_path(paths[PLATFORM_NORMAL]),
+                         {platform: (paths[platform], part) for platform, part in routed.items()})
+    return {platform: len(part) for platform, part in routed.items()}
+
+
+def rebuild_stats_catalog(paths):
+    """由現有分區重建統計目錄（升級前寫入的主檔沒有統計目錄時使用）"""
+    partitions = {
+        platform: (paths[platform], pd.read_csv(paths[platform], dtype=str, keep_default_na=False))
+        for platform in PLATFORM_CLASSES if os.path.exists(paths[platform])
+    }
+    return update_stats_catalog(stats_catalog_path(paths[PLATFORM_NORMAL]), partitions)
@@ -0,0 +1,228 @@
+# replay_from_archive.py
+# 從 archive/ 依原始匯入順序重建主檔
+# ========================================================================
+# 修改 config.py 的清洗規則（例如新增 COLUMN_MAPPING）後，用歸檔的原始 Excel
+# 重新產生一份主檔，不必再把檔案搬回 input/ 重跑。
+#   1. 依歸檔時間戳還原每次執行的批次與先後順序
+#   2. 以多行程平行解析所有 Excel（解析結果快取於 PARSE_CACHE_DIR）
+#   3. 依原始順序逐批套用 update_logic_with_order_level_replacement
+#
+# 用法：
+#   python replay_from_archive.py                 # 輸出至 REPLAY_OUTPUT_CSV_PATH
+#   python replay_from_archive.py --in-place      # 直接覆寫正式主檔與孤兒檔，並重建 B01–B04
+#   python replay_from_archive.py --workers 4 --no-cache
+#   python replay_from_archive.py --legacy-gap      # 舊版歸檔（每檔各取時間戳）：REPLAY_RUN_GAP_SECONDS 內的檔案視為同一批
+
+import argparse
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    from config import (
+        ARCHIVE_DIR, OUTPUT_CSV_PATH, ORPHAN_CSV_PATH, COLUMN_MAPPING,
+        ARCHIVE_TIMESTAMP_FORMAT, REPLAY_OUTPUT_CSV_PATH, REPLAY_ORPHAN_CSV_PATH,
+        PARSE_CACHE_DIR, REPLAY_RUN_GAP_SECONDS
+    )
+except ImportError:
+    print("❌ 錯誤：無法從 config.py 導入設定。")
+    exit()
+from order_processing_script import (
+    setup_logging, clean_column_names, parse_order_date_from_sn, parse_order_file,
+    reload_master_as_csv, update_logic_with_order_level_replacement, finalize_merge_result
+)
+from split_orders_to_b_tables import run_fanout_stage
+from platform_routing import PLATFORM_NORMAL, platform_partition_paths, route_by_platform, write_platform_partitions
+
+# 歸檔檔名：<原始檔名>_<YYYYmmdd_HHMMSS>.xlsx（見 archive_processed_files）
+ARCHIVE_NAME_PATTERN = re.compile(r'^(?P<stem>.+)_(?P<timestamp>\d{8}_\d{6})(?P<ext>\.xlsx)$', re.IGNORECASE)
+
+
+def list_archived_runs(archive_dir, legacy_gap_seconds=None):
+    """列出歸檔檔案並還原為依時間排序的執行批次。
+
+    同一次執行的檔案共用同一個時間戳，預設只有時間戳完全相同的檔案屬於同一批次。
+    舊版歸檔每檔各取時間戳：指定 legacy_gap_seconds 時，距離批次第一個檔案的時間戳
+    在此秒數內、且原始檔名未在批次中出現過的檔案也併入（不會一路串接到後續的執行）。"""
+    entries = []
+    for path in glob.glob(os.path.join(archive_dir, '*.xlsx')):
+        match = ARCHIVE_NAME_PATTERN.match(os.path.basename(path))
+        if not match:
+            logging.warning(f"歸檔檔名缺少時間戳，略過: {path}")
+            print(f"   -> ⚠️ 歸檔檔名缺少時間戳，略過: {os.path.basename(path)}")
+            continue
+        timestamp = datetime.strptime(match['timestamp'], ARCHIVE_TIMESTAMP_FORMAT)
+        entries.append((timestamp, match['stem'] + match['ext'], path))
+
+    runs = []
+    for timestamp, name, path in sorted(entries):
+        if runs:
+            run = runs[-1]
+            elapsed = (timestamp - run['timestamp']).total_seconds()
+            same_run = elapsed == 0 or (
+                legacy_gap_seconds is not None and elapsed <= legacy_gap_seconds and name not in run['names']
+            )
+            if same_run:
+                run['files'].append(path)
+                run['names'].add(name)
+                continue
+        runs.append({'timestamp': timestamp, 'files': [path], 'names': {name}})
+    return runs
+
+
+def parser_fingerprint():
+    """解析規則指紋：欄位映射或解析函式有任何修改，快取即失效。"""
+    digest = hashlib.sha1()
+    for func in (clean_column_names, parse_order_date_from_sn, parse_order_file):
+        digest.update(inspect.getsource(func).encode('utf-8'))
+    digest.update(repr(COLUMN_MAPPING).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def parse_cache_path(cache_dir, filepath, processing_date, fingerprint):
+    stat = os.stat(filepath)
+    key = f"{fingerprint}|{os.path.basename(filepath)}|{stat.st_size}|{stat.st_mtime_ns}|{processing_date}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+
+
+def parse_archived_file(task):
+    """子行程工作：解析單一歸檔檔案，優先讀取快取。回傳 (路徑, DataFrame, 是否命中快取, 錯誤訊息)。"""
+    filepath, processing_date, cache_dir, fingerprint = task
+    try:
+        cache_path = parse_cache_path(cache_dir, filepath, processing_date, fingerprint) if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            return filepath, pd.read_pickle(cache_path), True, None
+
+        df = parse_order_file(filepath, processing_date=processing_date)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, cache_path)
+        return filepath, df, False, None
+    except Exception as e:
+        # 與 load_and_clean_new_data 相同：單一檔案解析失敗時略過該檔，不中斷整個重建
+        return filepath, None, False, f"{e}\n{traceback.format_exc()}"
+
+
+def replay(archive_dir, output_csv_path, orphan_csv_path, max_workers=None, use_cache=True, legacy_gap_seconds=None):
+    """依原始匯入順序重建主檔與孤兒檔，回傳重建後的主檔 DataFrame。"""
+    runs = list_archived_runs(archive_dir, legacy_gap_seconds)
+    if not runs:
+        print(f"🟡 在 {archive_dir} 中沒有找到任何歸檔檔案。")
+        return None
+
+    file_count = sum(len(run['files']) for run in runs)
+    print(f"🔍 發現 {len(runs)} 次執行、共 {file_count} 個歸檔檔案")
+    logging.info(f"Replay: {len(runs)} runs, {file_count} archived files")
+
+    # ===== 1. 平行解析 =====
+    cache_dir = PARSE_CACHE_DIR if use_cache else None
+    fingerprint = parser_fingerprint()
+    tasks = [
+        (filepath, run['timestamp'].date(), cache_dir, fingerprint)
+        for run in runs for filepath in run['files']
+    ]
+    parsed = {}
+    cache_hits = 0
+    print(f"\n📖 平行解析歸檔檔案（workers={max_workers or os.cpu_count()}）...")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for filepath, df, from_cache, error in executor.map(parse_archived_file, tasks):
+            filename = os.path.basename(filepath)
+            if error is not None:
+                logging.error(f"Failed to parse {filename}: {error}")
+                print(f"   -> ❌ 解析失敗，略過: {filename}，錯誤: {error.splitlines()[0]}")
+                continue
+            parsed[filepath] = df
+            cache_hits += from_cache
+            print(f"   -> ✅ {'快取' if from_cache else '已解析'}: {filename} ({len(df)} 筆資料)")
+    print(f"   -> 解析完成，快取命中 {cache_hits}/{file_count}，失敗 {file_count - len(parsed)}")
+
+    # ===== 2. 依原始順序逐批合併 =====
+    df_master = pd.DataFrame()
+    appended_rows = 0
+    orphan_frames = []
+    for index, run in enumerate(runs, start=1):
+        print(f"\n▶️  [{index}/{len(runs)}] 重播 {run['timestamp'].strftime('%Y-%m-%d %H:%M:%S')} 的批次（{len(run['files'])} 個檔案）")
+        frames = [parsed[filepath] for filepath in run['files'] if filepath in parsed]
+        if not frames:
+            # 增量執行時整批都解析失敗則不會合併
+            print("   -> 🟡 此批次沒有可用的檔案，略過")
+            continue
+        df_new = pd.concat(frames, ignore_index=True)
+        # 與增量執行相同：上一批的主檔以寫出再讀回的型態參與比對（只需轉換上一批新增的列）
+        df_master = reload_master_as_csv(df_master, appended_rows)
+        merged_df, orphaned_records = update_logic_with_order_level_replacement(df_master, df_new)
+        df_master, orphaned_records = finalize_merge_result(merged_df, orphaned_records)
+        # update_logic_with_order_level_replacement 把新資料接在保留的舊資料之後
+        appended_rows = len(df_new)
+        if not orphaned_records.empty:
+            orphaned_records['orphaned_timestamp'] = run['timestamp']
+            orphan_frames.append(orphaned_records)
+
+    # ===== 3. 輸出 =====
+    print("\n💾 正在儲存重建後的主檔...")
+    master_paths = platform_partition_paths(output_csv_path)
+    counts = write_platform_partitions(df_master, master_paths, index=False, encoding='utf-8-sig')
+    for platform, path in master_paths.items():
+        print(f"   -> ✅ 主檔: {path} ({counts[platform]} 筆紀錄)")
+
+    if orphan_frames:
+        orphans_df = pd.concat(orphan_frames, ignore_index=True)
+        os.makedirs(os.path.dirname(orphan_csv_path), exist_ok=True)
+        orphans_df.to_csv(orphan_csv_path, index=False, encoding='utf-8-sig')
+        print(f"   -> ✅ 孤兒檔: {orphan_csv_path} ({len(orphans_df)} 筆紀錄)")
+    else:
+        print("   -> 🟢 重建過程中無任何已消失的訂單")
+
+    logging.info(f"Replay finished: {len(df_master)} master rows")
+    return df_master
+
+
+def main():
+    parser = argparse.ArgumentParser(description="從 archive/ 依原始匯入順序重建主檔")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help="歸檔資料夾（預設 config.ARCHIVE_DIR）")
+    parser.add_argument('--workers', type=int, default=None, help="平行解析的行程數（預設為 CPU 核心數）")
+    parser.add_argument('--no-cache', action='store_true', help="不讀寫解析快取")
+    parser.add_argument('--in-place', action='store_true', help="直接覆寫正式主檔與孤兒檔")
+    parser.add_argument('--legacy-gap', type=float, nargs='?', const=REPLAY_RUN_GAP_SECONDS, default=None,
+                        metavar='SECONDS',
+                        help="舊版歸檔（每檔各取時間戳）：與批次第一個檔案相差此秒數內的檔案視為同一次執行"
+                             f"（未指定秒數時為 {REPLAY_RUN_GAP_SECONDS}）")
+    args = parser.parse_args()
+
+    if args.in_place:
+        output_csv_path, orphan_csv_path = OUTPUT_CSV_PATH, ORPHAN_CSV_PATH
+    else:
+        output_csv_path, orphan_csv_path = REPLAY_OUTPUT_CSV_PATH, REPLAY_ORPHAN_CSV_PATH
+
+    setup_logging()
+    logging.info("================ REPLAY START ================")
+    print("🚀 開始從歸檔重建主檔...")
+    try:
+        df_master = replay(args.archive_dir, output_csv_path, orphan_csv_path,
+                           max_workers=args.workers, use_cache=not args.no_cache,
+                           legacy_gap_seconds=args.legacy_gap)
+        # 覆寫正式主檔時一併由一般平台分區重建 BigQuery 版主檔與 B01–B04
+        if args.in_place and df_master is not None:
+            run_fanout_stage(route_by_platform(df_master)[PLATFORM_NORMAL])
+    except Exception as e:
+        logging.error(f"Replay failed:\n{traceback.format_exc()}")
+        print(f"\n❌ 重建失敗：{e}")
+        print("詳細錯誤資訊請檢查 'python_script_log.txt' 檔案。")
+        sys.exit(1)
+    logging.info("================ REPLAY SUCCESS ================")
+    print("\n🎉 重建完成！")
+
+
+if __name__ == "__main__":
+    main()
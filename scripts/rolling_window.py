@@ -0,0 +1,202 @@
+# rolling_window.py
+# 近 30 天滾動視窗輸出（last30days_*，供 PostgreSQL / BigQuery 排程使用），依 order_date 日分區增量維護
+#   <ROLLING_WINDOW_OUTPUT_DIR>/partitions/<表名>/order_date=YYYY-MM-DD.csv
+#   <ROLLING_WINDOW_OUTPUT_DIR>/last30days_<檔名>.csv        由日分區以位元組串接（不重新解析）
+#   <ROLLING_WINDOW_OUTPUT_DIR>/rolling_window_state.json   {"tables": {"B01": "2025-07-01", ...}}（各表視窗已更新到哪一天）
+# ETL 主流程（run_fanout_stage）每次執行：
+#   - 刪除滑出視窗的日分區
+#   - 本次異動且在視窗內的日期：BigQuery 版主檔整天改寫；B 表刪除受影響訂單的舊列、附加重算後的新列
+#   - 上次更新後新進入視窗的日期（通常只有今天）由來源補齊
+# 首次執行（沒有日分區或狀態）時由完整資料建立；filter_recent_30days_orders.py 可單獨全量重建。
+# 輸出為不含 BOM 的純文字 CSV，與原本 filter_recent_30days_orders.py 的格式相同。
+import glob
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import (
+    BIGQUERY_CSV_PATH, B_TABLE_OUTPUT_DIR, B_TABLE_FILES, ROLLING_WINDOW_DAYS, ROLLING_WINDOW_OUTPUT_DIR
+)
+from b_table_store import has_partitions
+from analytics_reader import read_orders, read_table
+
+# 視窗輸出的來源：BigQuery 版主檔以 'A01' 代表，其餘為 B01–B04
+ROLLING_WINDOW_FILES = {'A01': os.path.basename(BIGQUERY_CSV_PATH), **B_TABLE_FILES}
+STATE_PATH = os.path.join(ROLLING_WINDOW_OUTPUT_DIR, 'rolling_window_state.json')
+
+
+def window_days(today=None, days=ROLLING_WINDOW_DAYS):
+    """視窗內的日期（含今天），'YYYY-MM-DD' 由舊到新"""
+    today = today or datetime.today().date()
+    return [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days - 1, -1, -1)]
+
+
+def flat_file_path(table_code):
+    return os.path.join(ROLLING_WINDOW_OUTPUT_DIR, f'last30days_{ROLLING_WINDOW_FILES[table_code]}')
+
+
+def day_dir(table_code):
+    return os.path.join(ROLLING_WINDOW_OUTPUT_DIR, 'partitions', os.path.splitext(ROLLING_WINDOW_FILES[table_code])[0])
+
+
+def day_path(table_code, day):
+    return os.path.join(day_dir(table_code), f'order_date={day}.csv')
+
+
+def list_days(table_code):
+    """{日期: 分區路徑}"""
+    paths = glob.glob(os.path.join(day_dir(table_code), 'order_date=*.csv'))
+    return {os.path.splitext(os.path.basename(path))[0].split('=', 1)[1]: path for path in paths}
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {"tables": {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def reset_rolling_window():
+    """刪除所有日分區與狀態，下次執行時改為全量建立（增量更新中途失敗時使用）"""
+    shutil.rmtree(os.path.join(ROLLING_WINDOW_OUTPUT_DIR, 'partitions'), ignore_errors=True)
+    if os.path.exists(STATE_PATH):
+        os.remove(STATE_PATH)
+
+
+def write_day(table_code, day, part):
+    """沒有資料的日期不留分區檔"""
+    path = day_path(table_code, day)
+    if part.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    part.to_csv(path, index=False)
+
+
+def write_days(table_code, frame, days):
+    """以完整資料改寫指定日期的分區（frame 需包含這些日期的所有列）"""
+    days = set(days)
+    in_days = frame[frame['order_date'].isin(days)]
+    for day, part in in_days.groupby('order_date', sort=True):
+        write_day(table_code, day, part)
+    for day in days - set(in_days['order_date']):
+        write_day(table_code, day, frame.iloc[0:0])
+
+
+def patch_days(table_code, recomputed, affected_order_sns, days, sort_by=None):
+    """增量改寫：每個日期先刪除受影響訂單的舊列，再附加重算後的新列（與 b_table_store.patch_partitions 相同）"""
+    existing_days = list_days(table_code)
+    for day in days:
+        new_rows = recomputed[recomputed['order_date'] == day]
+        if day in existing_days:
+            existing = pd.read_csv(existing_days[day], dtype=str, keep_default_na=False)
+            existing = existing[~existing['order_sn'].isin(affected_order_sns)]
+            frames = [frame for frame in (existing, new_rows) if not frame.empty]
+            part = pd.concat(frames, ignore_index=True) if frames else existing
+        else:
+            part = new_rows
+        if sort_by:
+            part = part.sort_values(sort_by, kind='stable')
+        write_day(table_code, day, part)
+
+
+def assemble_window_file(table_code, columns):
+    """依日期串接日分區成 last30days_* 單一 CSV（略過後續分區的表頭）"""
+    days = list_days(table_code)
+    output_path = flat_file_path(table_code)
+    tmp_path = f'{output_path}.tmp'
+    if not days:
+        pd.DataFrame(columns=columns).to_csv(tmp_path, index=False)
+    else:
+        with open(tmp_path, 'wb') as out:
+            for index, day in enumerate(sorted(days)):
+                with open(days[day], 'rb') as part:
+                    if index > 0:
+                        part.readline()
+                    shutil.copyfileobj(part, out)
+    os.replace(tmp_path, output_path)
+
+
+def load_source_days(table_code, days):
+    """由已寫出的 BigQuery 版主檔 / B 表讀取指定日期的完整資料（B 表有月份分區時只讀涵蓋的月份）"""
+    start_date, end_date = min(days), max(days)
+    frame = None
+    if table_code in B_TABLE_FILES and has_partitions(table_code):
+        frame = read_table(table_code, start_date=start_date, end_date=end_date, keep_default_na=False)
+    if frame is None:
+        # 沒有月份分區（或區間內沒有分區）時讀取單一 CSV，至少取得欄位
+        path = BIGQUERY_CSV_PATH if table_code == 'A01' else os.path.join(B_TABLE_OUTPUT_DIR, B_TABLE_FILES[table_code])
+        frame = read_orders(path, start_date=start_date, end_date=end_date, b2b_suffix=None, keep_default_na=False)
+    return frame[frame['order_date'].isin(days)]
+
+
+def update_rolling_window(text_df, tables, delta=None, today=None):
+    """ETL 主流程呼叫：text_df 為 BigQuery 版主檔（全字串），tables 為本次產生的 B01–B04
+    （delta 為增量時只含重算的訂單）。回傳 {表代號: (改寫日數, 刪除日數)}"""
+    days = window_days(today)
+    window = set(days)
+    incremental = delta is not None and not delta.is_full_rebuild
+    touched = window & delta.touched_dates if incremental else set()
+    state = load_state()
+
+    changes = {}
+    for code in ROLLING_WINDOW_FILES:
+        frame = text_df if code == 'A01' else tables[code]
+        # 日分區被手動刪除時視同沒有狀態，重新建立
+        updated_through = state["tables"].get(code) if os.path.isdir(day_dir(code)) else None
+        os.makedirs(day_dir(code), exist_ok=True)
+        existing = list_days(code)
+        expired = [day for day in existing if day not in window]
+        for day in expired:
+            os.remove(existing[day])
+
+        if not incremental or updated_through is None:
+            # 全量：text_df 與 tables 都是完整資料；沒有狀態時 B 表由已寫出的檔案補齊
+            rewrite = window
+            if incremental and code != 'A01':
+                frame = load_source_days(code, days)
+            write_days(code, frame, rewrite)
+        else:
+            entering = {day for day in days if day > updated_through}
+            rewrite = touched | entering
+            if code == 'A01':
+                write_days(code, frame, rewrite)
+            else:
+                patch_days(code, frame, delta.affected_order_sns, sorted(touched - entering),
+                           sort_by=['order_sn'] if code == 'B01' else None)
+                if entering:
+                    write_days(code, load_source_days(code, sorted(entering)), entering)
+
+        assemble_window_file(code, list(frame.columns))
+        state["tables"][code] = days[-1]
+        changes[code] = (len(rewrite), len(expired))
+    save_state(state)
+    return changes
+
+
+def rebuild_rolling_window(today=None):
+    """由已寫出的 BigQuery 版主檔與 B01–B04 全量重建視窗。回傳 {表代號: 筆數}"""
+    days = window_days(today)
+    reset_rolling_window()
+    state = {"tables": {}}
+    counts = {}
+    for code in ROLLING_WINDOW_FILES:
+        frame = load_source_days(code, days)
+        os.makedirs(day_dir(code), exist_ok=True)
+        write_days(code, frame, days)
+        assemble_window_file(code, list(frame.columns))
+        state["tables"][code] = days[-1]
+        counts[code] = len(frame)
+    save_state(state)
+    return counts
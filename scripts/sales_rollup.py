@@ -0,0 +1,113 @@
+# sales_rollup.py
+# C 開頭衍生表的註冊處（ROLLUP_TABLES），以及 C01 每日 商店 × SKU 銷售彙總表（daily_shop_sku_sales）
+#   讓 Looker 直接查詢彙總結果，不必每次刷新都掃描整張 B02 明細表。
+#   - ETL 主流程：split_orders_to_b_tables.run_fanout_stage() 只重算本次合併觸及的日期，並改寫對應月份分區
+#   - 單獨執行：讀取 BigQuery 版主檔後全量重建
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import BIGQUERY_CSV_PATH, B_TABLE_OUTPUT_DIR, ROLLUP_TABLE_FILES, CANCELLED_ORDER_STATUS
+from b_table_store import write_all_partitions
+from voucher_cube import build_voucher_cube, VOUCHER_CUBE_GRAIN
+from sla_metrics import build_order_sla, build_daily_shipping_sla, DAILY_SLA_GRAIN
+
+# 彙總粒度
+DAILY_SHOP_SKU_GRAIN = ['order_date', 'shop_account', 'product_sku_main', 'product_sku_variation']
+
+# 訂單層級的費用欄位（每個商品列重複出現），依商品列銷售額比例分攤
+ORDER_FEE_COLS = ['transaction_fee', 'other_service_fee', 'payment_processing_fee']
+
+
+def to_number(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0)
+
+
+def build_daily_shop_sku_sales(df):
+    """由全字串主檔（商品明細層級）產生每日 商店 × SKU 銷售彙總。
+
+    - units / return_units：quantity / return_quantity 加總
+    - gross_sales：商品活動價（無活動價時用原價）× quantity
+    - net_sales：商品活動價 × (quantity - return_quantity)
+    - fees：成交手續費 + 其他服務費 + 金流處理費，依商品列 gross_sales 佔訂單比例分攤
+    - order_count：不重複訂單數
+    不成立的訂單不計入銷售與費用，只計入 cancelled_order_count。"""
+    price = to_number(df['product_campaign_price'].where(df['product_campaign_price'] != '', df['product_original_price']))
+    units = to_number(df['quantity'])
+    return_units = to_number(df['return_quantity'])
+    is_cancelled = (df['order_status'] == CANCELLED_ORDER_STATUS).to_numpy()
+    active = np.where(is_cancelled, 0, 1)
+
+    gross = price * units
+    order_gross = gross.groupby(df['order_sn']).transform('sum')
+    # 訂單內全部商品列金額為 0 時平均分攤
+    lines_per_order = df.groupby('order_sn')['order_sn'].transform('size')
+    share = np.where(order_gross > 0, gross / order_gross.where(order_gross > 0, 1), 1 / lines_per_order)
+    # 同一訂單的費用欄位在每個商品列重複，取該訂單第一列的值
+    order_fees = sum(to_number(df[col]).groupby(df['order_sn']).transform('first') for col in ORDER_FEE_COLS)
+
+    lines = df[DAILY_SHOP_SKU_GRAIN + ['order_sn']].copy()
+    lines['units'] = units * active
+    lines['return_units'] = return_units * active
+    lines['gross_sales'] = gross * active
+    lines['net_sales'] = price * (units - return_units) * active
+    lines['fees'] = order_fees * share * active
+    lines['active_order_sn'] = df['order_sn'].where(~is_cancelled)
+    lines['cancelled_order_sn'] = df['order_sn'].where(is_cancelled)
+
+    rollup = lines.groupby(DAILY_SHOP_SKU_GRAIN, sort=True).agg(
+        order_count=('active_order_sn', 'nunique'),
+        cancelled_order_count=('cancelled_order_sn', 'nunique'),
+        units=('units', 'sum'),
+        return_units=('return_units', 'sum'),
+        gross_sales=('gross_sales', 'sum'),
+        net_sales=('net_sales', 'sum'),
+        fees=('fees', 'sum'),
+    ).reset_index()
+
+    for col in ['units', 'return_units']:
+        rollup[col] = rollup[col].round().astype('int64')
+    for col in ['gross_sales', 'net_sales', 'fees']:
+        rollup[col] = rollup[col].round(2)
+    return rollup
+
+
+# C 開頭衍生表：表代號 → 產生函式、排序（粒度）欄位、增量重算單位
+#   key='order_date'：重算本次合併觸及日期的所有訂單（彙總表）
+#   key='order_sn'：只重算受影響的訂單（每筆訂單一列的表）
+ROLLUP_TABLES = {
+    'C01': {'build': build_daily_shop_sku_sales, 'grain': DAILY_SHOP_SKU_GRAIN, 'key': 'order_date'},
+    'C02': {'build': build_voucher_cube, 'grain': VOUCHER_CUBE_GRAIN, 'key': 'order_date'},
+    'C04': {'build': build_order_sla, 'grain': ['order_sn'], 'key': 'order_sn'},
+    'C05': {'build': build_daily_shipping_sla, 'grain': DAILY_SLA_GRAIN, 'key': 'order_date'},
+}
+
+
+def rollup_path(table_code):
+    return os.path.join(B_TABLE_OUTPUT_DIR, ROLLUP_TABLE_FILES[table_code])
+
+
+def build_rollups(df, order_df=None):
+    """產生所有衍生表，回傳 {表代號: DataFrame}。
+
+    增量執行時 df 為觸及日期的主檔列、order_df 為受影響訂單的主檔列；全量時兩者相同。"""
+    order_df = df if order_df is None else order_df
+    return {
+        code: spec['build'](order_df if spec['key'] == 'order_sn' else df)
+        for code, spec in ROLLUP_TABLES.items()
+    }
+
+
+def main():
+    # 讀取資料
+    df = pd.read_csv(BIGQUERY_CSV_PATH, dtype=str, keep_default_na=False)
+
+    for code, rollup in build_rollups(df).items():
+        rollup.to_csv(rollup_path(code), index=False, encoding='utf-8-sig')
+        write_all_partitions(code, rollup)
+        print(f'完成：{rollup_path(code)} ({len(rollup)} 筆)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# sla_metrics.py
+# 出貨 SLA 指標
+#   C04 每筆訂單的出貨時效（order_shipping_sla）：
+#       handling_hours = actual_shipping_timestamp - buyer_payment_timestamp
+#       hours_late     = actual_shipping_timestamp - ship_by_date 當日結束（正值代表逾期）
+#   C05 每日 商店 × 物流商 SLA 彙總（daily_shipping_sla）：準時率、備貨時數 p50 / p95
+# 全部以欄位向量運算，不逐筆處理；由 sales_rollup.ROLLUP_TABLES 註冊，
+# run_fanout_stage() 只重算本次合併受影響的訂單（C04）與日期（C05）。
+import numpy as np
+import pandas as pd
+
+from config import CANCELLED_ORDER_STATUS
+
+ORDER_SLA_COLUMNS = [
+    'order_sn', 'order_date', 'shop_account', 'shipping_provider', 'order_status',
+    'buyer_payment_timestamp', 'ship_by_date', 'actual_shipping_timestamp',
+    'handling_hours', 'hours_late', 'is_shipped', 'is_late', 'sla_status'
+]
+DAILY_SLA_GRAIN = ['order_date', 'shop_account', 'shipping_provider']
+
+HOUR = pd.Timedelta(hours=1)
+
+
+def parse_timestamp(series):
+    return pd.to_datetime(series, format='ISO8601', errors='coerce')
+
+
+def build_order_sla(df):
+    """由全字串主檔產生每筆訂單的出貨時效（每個 order_sn 取第一筆，與 B04 相同）。
+
+    sla_status：cancelled（不成立）、pending（尚未出貨）、on_time、late。
+    ship_by_date 只有日期，視為當日 24:00 前出貨即準時。"""
+    orders = df[~df['order_sn'].duplicated(keep='first')]
+    sla = orders[ORDER_SLA_COLUMNS[:8]].copy()
+
+    paid_at = parse_timestamp(sla['buyer_payment_timestamp'])
+    shipped_at = parse_timestamp(sla['actual_shipping_timestamp'])
+    deadline = parse_timestamp(sla['ship_by_date']).dt.normalize() + pd.Timedelta(days=1)
+
+    sla['handling_hours'] = ((shipped_at - paid_at) / HOUR).round(2)
+    sla['hours_late'] = ((shipped_at - deadline) / HOUR).round(2)
+
+    is_cancelled = (sla['order_status'] == CANCELLED_ORDER_STATUS).to_numpy()
+    is_shipped = shipped_at.notna().to_numpy() & ~is_cancelled
+    is_late = is_shipped & (shipped_at > deadline).to_numpy()
+    sla['is_shipped'] = is_shipped.astype('int64')
+    sla['is_late'] = is_late.astype('int64')
+    sla['sla_status'] = np.select(
+        [is_cancelled, ~is_shipped, is_late], ['cancelled', 'pending', 'late'], default='on_time'
+    )
+    return sla.sort_values('order_sn', kind='stable').reset_index(drop=True)
+
+
+def build_daily_shipping_sla(df):
+    """每日 商店 × 物流商 SLA 彙總。on_time_rate 以已出貨訂單為分母；百分位數只計已出貨訂單。"""
+    sla = build_order_sla(df)
+    sla['is_cancelled'] = (sla['sla_status'] == 'cancelled').astype('int64')
+
+    daily = sla.groupby(DAILY_SLA_GRAIN, sort=True).agg(
+        order_count=('order_sn', 'size'),
+        cancelled_orders=('is_cancelled', 'sum'),
+        shipped_orders=('is_shipped', 'sum'),
+        late_orders=('is_late', 'sum'),
+    )
+    daily['on_time_orders'] = daily['shipped_orders'] - daily['late_orders']
+    daily['on_time_rate'] = (daily['on_time_orders'] / daily['shipped_orders'].where(daily['shipped_orders'] > 0)).round(4)
+
+    shipped = sla[sla['is_shipped'] == 1]
+    handling = shipped.groupby(DAILY_SLA_GRAIN)['handling_hours']
+    daily['handling_hours_p50'] = handling.quantile(0.5).round(2)
+    daily['handling_hours_p95'] = handling.quantile(0.95).round(2)
+    daily['avg_hours_late'] = shipped[shipped['is_late'] == 1].groupby(DAILY_SLA_GRAIN)['hours_late'].mean().round(2)
+    return daily.reset_index()
@@ -1,80 +1,73 @@
-import pandas as pd
+# split_orders_to_b_tables.py
+# 由 BigQuery 版主檔產生 B01–B04 表
+#   - 單獨執行：讀取 A01_master_orders_cleaned_for_bigquery.csv 後輸出四張表
+#   - ETL 主流程：order_processing_script.py 合併主檔後呼叫 run_fanout_stage()，
+#     直接以記憶體中的主檔一次產生 BigQuery 版主檔與 B01–B04，並同時寫出
+#   - B01–B04 另以月份分區存於 B_TABLE_PARTITION_DIR（見 b_table_store.py），
+#     日常執行只重算受影響的訂單並改寫對應分區
+#   - STAR_SCHEMA_ENABLED 時一併更新維度表並輸出星狀結構事實表（見 star_schema.py）
+#   - 同時產生 C 開頭的衍生表（見 sales_rollup.py），增量執行時只重算受影響的日期 / 訂單
+#   - 買家彙總表 C03 以合併差量（撤回 + 加入）增量維護（見 buyer_aggregates.py）
+#   - NESTED_EXPORT_ENABLED 時另輸出訂單層級巢狀 JSON（見 nested_export.py）
+#   - ROLLING_WINDOW_ENABLED 時以日分區增量維護近 30 天輸出 last30days_*（見 rolling_window.py）
+#   - 最後記錄本次異動的 order_date，供增量上傳只取代受影響的日分區（見 upload_partitions.py）
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-# ==== 1. 設定檔案路徑與表單名稱 ====
-input_path = r'C:\Users\user\Documents\shopee_orders_etl\output\A01_master_orders_cleaned_for_bigquery.csv'
-output_folder = r'C:\Users\user\Documents\shopee_orders_etl\output'
-b01_name = 'B01_orders_concat.csv'
-b02_name = 'B02_order_details.csv'
-b03_name = 'B03_order_simple_details.csv'
-b04_name = 'B04_order_shipping_info.csv'
+import numpy as np
+import pandas as pd
 
-# ==== 2. 讀取資料 ====
-df = pd.read_csv(input_path, dtype=str).fillna('')
+from config import (
+    BIGQUERY_CSV_PATH, B_TABLE_OUTPUT_DIR, B_TABLE_FILES, B_TABLE_WRITE_FLAT_FILES,
+    STAR_SCHEMA_ENABLED, STAR_SCHEMA_FACT_FILES, ROLLUP_TABLE_FILES, NESTED_EXPORT_ENABLED, NESTED_EXPORT_PATH,
+    ROLLING_WINDOW_ENABLED
+)
+from clean_for_bigquery import master_to_text
+from b_table_store import (
+    partition_keys, has_partitions, reset_partitions, write_all_partitions, patch_partitions,
+    assemble_flat_file
+)
+from star_schema import build_star_schema, fact_path, has_dimensions, print_star_schema_summary
+from sales_rollup import ROLLUP_TABLES, build_rollups, rollup_path
+from buyer_aggregates import update_buyer_aggregates, reset_buyer_aggregates
+from nested_export import export_nested_orders
+from rolling_window import update_rolling_window, reset_rolling_window
+from upload_partitions import record_etl_run
 
-# ==== 3. B01 聚合表（訂單主體聚合） ====
-b01_cols = [
-    'order_sn','shop_name','shop_account','processing_date','order_date','order_status','cancellation_reason',
+# ==== 1. 各表欄位設定 ====
+# B01 聚合表（訂單主體聚合）
+# 按 order_sn 分組後取第一個值的欄位（total_amount_paid_by_buyer 取第一個值以避免重複計算）
+b01_first_cols = [
+    'shop_name','shop_account','processing_date','order_date','order_status','cancellation_reason',
     'return_refund_status','buyer_username','order_creation_timestamp','total_amount_paid_by_buyer','voucher',
-    'product_name','product_sku_main','quantity','return_quantity','buyer_note','seller_note'
+    'buyer_note','seller_note'
 ]
-b01 = df[b01_cols].copy()
-
-# 修正：按 order_sn 分組聚合，其他欄位取第一個值
-b01_grouped = b01.groupby('order_sn', as_index=False).agg({
-    'shop_name': 'first',
-    'shop_account': 'first', 
-    'processing_date': 'first',
-    'order_date': 'first',
-    'order_status': 'first',
-    'cancellation_reason': 'first',
-    'return_refund_status': 'first',
-    'buyer_username': 'first',
-    'order_creation_timestamp': 'first',
-    'total_amount_paid_by_buyer': 'first',  # 避免重複計算，取第一個值即可
-    'voucher': 'first',
-    'buyer_note': 'first',
-    'seller_note': 'first',
-    'product_name': lambda x: ';'.join([i for i in x if i]),
-    'product_sku_main': lambda x: ';'.join([i for i in x if i]),
-    'quantity': lambda x: str(sum(pd.to_numeric(x, errors='coerce').fillna(0))),
-    'return_quantity': lambda x: str(sum(pd.to_numeric(x, errors='coerce').fillna(0))),
-})
-
-b01_grouped = b01_grouped.rename(columns={
-    'product_name': 'product_name_list',
-    'product_sku_main': 'product_sku_main_list',
-    'quantity': 'total_quantity',
-    'return_quantity': 'total_return_quantity'
-})
-b01_grouped.to_csv(f'{output_folder}\\{b01_name}', index=False, encoding='utf-8-sig')
-print(f'B01 聚合表完成：{output_folder}\\{b01_name} ({len(b01_grouped)} 筆訂單)')
-
-# ==== 4. B02 明細表（含 SKU 規格）- 保持原樣，不去重 ====
+# 以 ';' 串接非空值的欄位 → 輸出欄位名稱
+b01_list_cols = {'product_name': 'product_name_list', 'product_sku_main': 'product_sku_main_list'}
+# 加總的欄位 → 輸出欄位名稱
+b01_sum_cols = {'quantity': 'total_quantity', 'return_quantity': 'total_return_quantity'}
+
+# B02 明細表（含 SKU 規格）- 保持原樣，不去重
 b02_cols = [
     'order_sn','shop_name','shop_account','processing_date','order_date','order_status','cancellation_reason','return_refund_status',
     'buyer_username','order_creation_timestamp','product_total_price','total_amount_paid_by_buyer','product_name','product_variation',
     'product_original_price','product_campaign_price','product_sku_main','product_sku_variation','quantity','return_quantity',
     'promo_bundle_indicator','promo_bundle_discount_label','buyer_note','seller_note'
 ]
-b02 = df[b02_cols].copy()
-b02.to_csv(f'{output_folder}\\{b02_name}', index=False, encoding='utf-8-sig')
-print(f'B02 明細表完成：{output_folder}\\{b02_name} ({len(b02)} 筆明細)')
 
-# ==== 5. B03 簡化明細表（按 order_sn 去重） ====
+# B03 簡化明細表（按 order_sn 去重）
 b03_cols = [
     'order_sn','shop_name','shop_account','processing_date','order_date','order_status','cancellation_reason','return_refund_status',
     'buyer_username','order_creation_timestamp','product_total_price','total_amount_paid_by_buyer','product_name','product_variation',
     'product_original_price','product_campaign_price','product_sku_main','quantity','return_quantity','promo_bundle_indicator',
     'promo_bundle_discount_label','buyer_note','seller_note'
 ]
-b03 = df[b03_cols].copy()
 
-# 修正：按 order_sn 去重，取第一筆記錄
-b03_dedup = b03.drop_duplicates(subset=['order_sn'], keep='first')
-b03_dedup.to_csv(f'{output_folder}\\{b03_name}', index=False, encoding='utf-8-sig')
-print(f'B03 簡化明細表完成：{output_folder}\\{b03_name} ({len(b03_dedup)} 筆訂單，原始 {len(b03)} 筆)')
-
-# ==== 6. B04 收件/物流資訊表（按 order_sn 去重） ====
+# B04 收件/物流資訊表（按 order_sn 去重）
 b04_cols = [
     'order_sn','shop_name','shop_account','processing_date','order_date','order_status','cancellation_reason','return_refund_status',
     'buyer_username','order_creation_timestamp','recipient_address','recipient_phone','shopee_hotline_and_tracking_code','pickup_store_id',
@@ -82,10 +75,9 @@ b04_cols = [
     'payment_method','ship_by_date','tracking_number','buyer_payment_timestamp','actual_shipping_timestamp','order_completion_timestamp',
     'buyer_note','seller_note'
 ]
-b04 = df[b04_cols].copy()
 
 # 台灣全縣市對應 Looker 指標
-city_mapping = {
+CITY_MAPPING = {
     '臺北市': 'Taipei City', '台北市': 'Taipei City',
     '新北市': 'New Taipei City',
     '桃園市': 'Taoyuan City',
@@ -110,21 +102,277 @@ city_mapping = {
     '連江縣': 'Lienchiang County',
 }
 
-# 直接將 recipient_city 欄位內容轉換成 Looker 格式
-b04['recipient_city'] = b04['recipient_city'].map(city_mapping).fillna(b04['recipient_city'])
 
-# 修正：按 order_sn 去重，取第一筆記錄
-b04_dedup = b04.drop_duplicates(subset=['order_sn'], keep='first')
-b04_dedup.to_csv(f'{output_folder}\\{b04_name}', index=False, encoding='utf-8-sig')
-print(f'B04 收件/物流表完成：{output_folder}\\{b04_name} ({len(b04_dedup)} 筆訂單，原始 {len(b04)} 筆)')
+# ==== 2. 各表產生邏輯 ====
+
+# 可直接視為 int64 的數量字串（與 pd.to_numeric 判定為整數的格式一致，位數上限避免溢位）
+INT_TOKEN_PATTERN = r'\s*[+-]?[0-9]{1,18}\s*'
+
+
+def join_non_empty_by_group(values, codes, n_groups):
+    """依群組以 ';' 串接非空字串，保留群組內原始順序（排序後分段 + reduceat，不逐組呼叫 Python 函式）。"""
+    keep = values != ''
+    values, codes = values[keep], codes[keep]
+    order = np.argsort(codes, kind='stable')
+    values, codes = values[order], codes[order]
+
+    joined = np.full(n_groups, '', dtype=object)
+    if len(values):
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        segments = np.add.reduceat(values + ';', starts)
+        joined[codes[starts]] = pd.Series(segments, dtype=object).str[:-1].to_numpy()
+    return joined
+
+
+def sum_by_group_as_text(values, codes, n_groups):
+    """依群組加總數量並轉成文字，結果與逐組 str(sum(pd.to_numeric(x, errors='coerce').fillna(0))) 相同。
+
+    全為整數的群組以 int64 加總（輸出 '3'）；含空值或小數的群組沿用原本的浮點結果（輸出 '3.0'）。"""
+    series = pd.Series(values, dtype=object)
+    is_int = series.str.fullmatch(INT_TOKEN_PATTERN).fillna(False).to_numpy(dtype=bool)
+    ints = pd.to_numeric(series.where(is_int, '0')).astype('int64')
+    floats = pd.to_numeric(series, errors='coerce').fillna(0).astype('float64')
+
+    group_index = range(n_groups)
+    int_sums = ints.groupby(codes).sum().reindex(group_index, fill_value=0).to_numpy()
+    float_sums = floats.groupby(codes).sum().reindex(group_index, fill_value=0).to_numpy()
+    is_float_group = np.bincount(codes, weights=~is_int, minlength=n_groups) > 0
+
+    # 含非整數值（例如 1.5、inf）的群組，浮點加總順序會影響結果，改用原本的逐項加總
+    float_values = floats.to_numpy()
+    non_integral = ~np.isfinite(float_values) | (float_values != np.floor(float_values))
+    for group in np.flatnonzero(np.bincount(codes, weights=non_integral, minlength=n_groups) > 0):
+        float_sums[group] = sum(floats[codes == group])
+
+    return np.array([
+        str(float_sum) if is_float else str(int_sum)
+        for is_float, float_sum, int_sum in zip(is_float_group.tolist(), float_sums.tolist(), int_sums.tolist())
+    ], dtype=object)
+
+
+def build_b01(df):
+    """產生 B01 訂單聚合表（每個 order_sn 一列，依 order_sn 排序）。df 需為全字串且已 fillna('')。"""
+    grouped = df.groupby('order_sn', sort=True)
+    b01 = grouped[b01_first_cols].first().reset_index()
+    codes = grouped.ngroup().to_numpy()
+    n_groups = len(b01)
+
+    for col, out_col in b01_list_cols.items():
+        b01[out_col] = join_non_empty_by_group(df[col].to_numpy(dtype=object), codes, n_groups)
+    for col, out_col in b01_sum_cols.items():
+        b01[out_col] = sum_by_group_as_text(df[col].to_numpy(dtype=object), codes, n_groups)
+    return b01
+
+
+def normalize_city(city):
+    """將 recipient_city 轉換成 Looker 格式，查無對應時保留原值"""
+    return city.map(CITY_MAPPING).fillna(city)
+
+
+def build_b_tables(df):
+    """由全字串主檔一次產生 B01–B04，回傳 {表代號: DataFrame}。
+
+    B03、B04 與 B01 的表頭欄位共用同一份「每個 order_sn 第一筆」的篩選結果，只掃描主檔一次。"""
+    first_rows = df[~df['order_sn'].duplicated(keep='first')]
+
+    b04 = first_rows[b04_cols].copy()
+    b04['recipient_city'] = normalize_city(b04['recipient_city'])
+
+    return {
+        'B01': build_b01(df),
+        'B02': df[b02_cols],
+        'B03': first_rows[b03_cols],
+        'B04': b04,
+    }
+
+
+def run_concurrently(tasks):
+    """以執行緒同時執行多個寫檔工作（to_csv 的檔案 I/O 會釋放 GIL），回傳各工作結果"""
+    with ThreadPoolExecutor(max_workers=len(tasks) or 1) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def write_csv(path, frame):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.to_csv(path, index=False, encoding='utf-8-sig')
+    return path, len(frame)
+
+
+def b_table_path(table_code):
+    if table_code in STAR_SCHEMA_FACT_FILES:
+        return fact_path(table_code)
+    if table_code in ROLLUP_TABLE_FILES:
+        return rollup_path(table_code)
+    return os.path.join(B_TABLE_OUTPUT_DIR, B_TABLE_FILES[table_code])
+
+
+def print_b_table_summary(tables, source_rows):
+    print(f'   -> B01 聚合表：{len(tables["B01"])} 筆訂單')
+    print(f'   -> B02 明細表：{len(tables["B02"])} 筆明細')
+    print(f'   -> B03 簡化表：{len(tables["B03"])} 筆訂單，原始 {source_rows} 筆')
+    print(f'   -> B04 物流表：{len(tables["B04"])} 筆訂單，原始 {source_rows} 筆')
+    for code in ROLLUP_TABLES:
+        print(f'   -> {code} 衍生表：{len(tables[code])} 筆')
+
+
+def build_output_tables(text_df, delta=None):
+    """產生所有輸出表：B01–B04、星狀結構事實表（STAR_SCHEMA_ENABLED 時）與 C 開頭衍生表。
+
+    傳入 delta 時只重算受影響的部分：B 表、事實表與每筆訂單一列的衍生表以 order_sn 為單位，
+    彙總表以 order_date 為單位。"""
+    b_source = rollup_source = text_df
+    if delta is not None:
+        b_source = text_df[text_df['order_sn'].isin(delta.affected_order_sns)]
+        rollup_source = text_df[text_df['order_date'].isin(delta.touched_dates)]
+
+    tables = build_b_tables(b_source)
+    if STAR_SCHEMA_ENABLED:
+        tables.update(build_star_schema(tables))
+    tables.update(build_rollups(rollup_source, b_source))
+    return tables
+
+
+def write_b_tables_full(tables, extra_files=None):
+    """全量輸出：同時寫出各表的單一 CSV 與月份分區"""
+    files = dict(extra_files or {})
+    files.update({b_table_path(code): table for code, table in tables.items()})
+    tasks = [partial(write_csv, path, frame) for path, frame in files.items()]
+    tasks += [partial(write_all_partitions, code, table) for code, table in tables.items()]
+    return run_concurrently(tasks)[:len(files)]
+
+
+def patch_b_tables(tables, delta):
+    """增量輸出：以重算出的各表改寫受影響的月份分區"""
+    touched_keys = set(partition_keys(list(delta.touched_dates)))
+
+    tasks = []
+    for code, table in tables.items():
+        if code in ROLLUP_TABLES and ROLLUP_TABLES[code]['key'] == 'order_date':
+            task = partial(patch_partitions, code, table, delta.touched_dates, touched_keys,
+                           key_column='order_date', sort_by=ROLLUP_TABLES[code]['grain'])
+        elif code in ROLLUP_TABLES:
+            task = partial(patch_partitions, code, table, delta.affected_order_sns, touched_keys,
+                           sort_by=ROLLUP_TABLES[code]['grain'])
+        else:
+            task = partial(patch_partitions, code, table, delta.affected_order_sns, touched_keys,
+                           sort_by=['order_sn'] if code == 'B01' else None)
+        tasks.append(task)
+    patched = run_concurrently(tasks)
+    if B_TABLE_WRITE_FLAT_FILES:
+        run_concurrently([
+            partial(assemble_flat_file, code, b_table_path(code), list(table.columns))
+            for code, table in tables.items()
+        ])
+    return dict(zip(tables, patched))
+
+
+def can_patch_incrementally(delta):
+    codes = list(B_TABLE_FILES) + list(ROLLUP_TABLE_FILES)
+    if STAR_SCHEMA_ENABLED:
+        if not has_dimensions():
+            return False
+        codes += list(STAR_SCHEMA_FACT_FILES)
+    return (
+        delta is not None
+        and not delta.is_full_rebuild
+        and all(has_partitions(code) for code in codes)
+    )
+
+
+def run_fanout_stage(master_df, delta=None):
+    """ETL 主檔合併後的輸出階段：空值正規化一次，產生 BigQuery 版主檔與 B01–B04 並同時寫出。
+
+    取代原本 clean_for_bigquery.py → split_orders_to_b_tables.py 兩次完整的 CSV 讀寫。
+    傳入本次合併的 delta 且分區已存在時，B01–B04 只重算受影響的訂單並改寫對應分區；
+    首次執行或沒有分區時則全量重建。"""
+    print("\n🧮 正在產生 BigQuery 版主檔與 B01–B04...")
+    started = time.perf_counter()
+    try:
+        tables, incremental = write_fanout_outputs(master_df, delta)
+    except Exception:
+        # 主檔已寫入，但本次差量可能只套用了一部分（或完全未套用）：下次執行只會處理下次的差量，
+        # 因此刪除所有增量維護的輸出（B / C 表分區、近 30 天日分區、C03），下次執行全量重建；
+        # 仍記錄本次執行並標記為全量，下次上傳整表重新載入
+        reset_partitions()
+        reset_rolling_window()
+        reset_buyer_aggregates()
+        record_etl_run()
+        raise
+
+    # 分區不存在而改為全量重建時（例如上次執行失敗後），上傳也要整表重新載入
+    run_id = record_etl_run(delta if incremental else None)
+    touched = f'{len(delta.touched_dates)} 個' if incremental else '全部'
+    print(f"   -> 📝 待上傳分區：第 {run_id} 次執行，異動日期 {touched}")
+
+    print(f"   -> ⏱️ 共 {time.perf_counter() - started:.1f} 秒")
+    return tables
+
+
+def write_fanout_outputs(master_df, delta=None):
+    """run_fanout_stage 的各項輸出（不含待上傳分區紀錄）。回傳 (產生的各表, 是否增量更新)"""
+    text_df = master_to_text(master_df)
+    incremental = can_patch_incrementally(delta)
+
+    if incremental:
+        write_bigquery_csv = partial(write_csv, BIGQUERY_CSV_PATH, text_df)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            bigquery_future = executor.submit(write_bigquery_csv)
+            tables = build_output_tables(text_df, delta)
+            patched = patch_b_tables(tables, delta)
+            bigquery_future.result()
+        print(f"   -> ✅ {os.path.basename(BIGQUERY_CSV_PATH)} ({len(text_df)} 筆紀錄)")
+        print(f"   -> 🔁 增量更新 {len(delta.affected_order_sns)} 筆受影響訂單")
+        for code, table in tables.items():
+            print(f"      {code}: 重算 {len(table)} 筆，改寫 {patched[code]} 個分區")
+    else:
+        tables = build_output_tables(text_df)
+        write_b_tables_full(tables, {BIGQUERY_CSV_PATH: text_df})
+        print(f"   -> ✅ {os.path.basename(BIGQUERY_CSV_PATH)} ({len(text_df)} 筆紀錄)")
+        print_b_table_summary(tables, len(text_df))
+        if STAR_SCHEMA_ENABLED:
+            print_star_schema_summary({name: tables[name] for name in STAR_SCHEMA_FACT_FILES})
+
+    if ROLLING_WINDOW_ENABLED:
+        # 衍生輸出：失敗時重設視窗（下次執行全量建立）並繼續，不中斷後續需保存狀態的階段
+        try:
+            # 全量重建時 tables 為完整資料，不傳 delta
+            changes = update_rolling_window(text_df, tables, delta if incremental else None)
+            rewritten = sum(rewrite for rewrite, _ in changes.values())
+            expired = sum(removed for _, removed in changes.values())
+            print(f"   -> ✅ 近 30 天輸出：改寫 {rewritten} 個日分區，移除 {expired} 個過期日分區")
+        except Exception as e:
+            logging.error(f"更新近 30 天輸出失敗，下次執行時全量建立: {e}\n{traceback.format_exc()}")
+            print(f"   -> ⚠️ 近 30 天輸出更新失敗：{e}（下次執行時全量建立，或手動執行 filter_recent_30days_orders.py）")
+            reset_rolling_window()
+
+    buyers, buyers_incremental = update_buyer_aggregates(text_df, delta)
+    print(f"   -> ✅ C03 買家彙總表：{len(buyers)} 位買家（{'增量套用' if buyers_incremental else '全量重建'}）")
+
+    if NESTED_EXPORT_ENABLED:
+        orders = export_nested_orders(text_df)
+        print(f"   -> ✅ {os.path.basename(NESTED_EXPORT_PATH)} ({orders} 筆訂單)")
+    return tables, incremental
+
+
+def main():
+    # 讀取資料
+    df = pd.read_csv(BIGQUERY_CSV_PATH, dtype=str).fillna('')
+
+    tables = build_output_tables(df)
+    written = write_b_tables_full(tables)
+    for path, rows in written:
+        print(f'完成：{path} ({rows} 筆)')
+
+    print('\n所有表格處理完成！')
+    print_b_table_summary(tables, len(df))
+    record_etl_run()  # 單獨重建：下次上傳全量載入
+
+    # 驗證金額是否正確（避免重複計算）
+    print(f'\n金額驗證：')
+    print(f'- 原始資料總金額（可能重複）: {df["total_amount_paid_by_buyer"].replace("", np.nan).astype(float).sum():,.0f}')
+    print(f'- B01聚合後正確總金額: {tables["B01"]["total_amount_paid_by_buyer"].replace("", np.nan).astype(float).sum():,.0f}')
 
-print('\n所有表格處理完成！')
-print(f'- B01 聚合表：{len(b01_grouped)} 筆')
-print(f'- B02 明細表：{len(b02)} 筆') 
-print(f'- B03 簡化表：{len(b03_dedup)} 筆')
-print(f'- B04 物流表：{len(b04_dedup)} 筆')
 
-# 驗證金額是否正確（避免重複計算）
-print(f'\n金額驗證：')
-print(f'- 原始資料總金額（可能重複）: {df["total_amount_paid_by_buyer"].astype(float).sum():,.0f}')
-print(f'- B01聚合後正確總金額: {b01_grouped["total_amount_paid_by_buyer"].astype(float).sum():,.0f}')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
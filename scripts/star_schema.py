@@ -0,0 +1,165 @@
+# star_schema.py
+# 由 B02 / B04 產生星狀結構：維度表 + 以 int32 代理鍵關聯的精簡事實表
+#   - dim_shop:     shop_name, shop_account
+#   - dim_product:  product_sku_main, product_sku_variation, product_name, product_variation
+#                   （同一貨號的不同品名 / 規格為不同成員，事實表可完整還原 B02）
+#   - dim_location: recipient_city（已依 CITY_MAPPING 正規化）, recipient_district, recipient_postal_code
+#   - fact_order_items:    B02 去除商店 / 商品文字欄位，改存 shop_key, product_key
+#   - fact_order_shipping: B04 去除商店 / 縣市區域文字欄位，改存 shop_key, location_key
+# 維度表只增不減：既有成員沿用原本的代理鍵，新成員依自然鍵排序後接續編號，
+# 因此每次執行（不論全量或增量）同一成員的代理鍵都不會改變。
+#
+# 單獨執行：讀取 B02 / B04 單一 CSV 後全量輸出事實表與分區
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    B_TABLE_OUTPUT_DIR, B_TABLE_FILES, STAR_SCHEMA_OUTPUT_DIR,
+    STAR_SCHEMA_DIMENSION_FILES, STAR_SCHEMA_FACT_FILES
+)
+from b_table_store import write_all_partitions
+
+# 維度定義：代理鍵欄位、自然鍵欄位、隨最新資料更新的屬性欄位
+DIMENSIONS = {
+    'dim_shop': {
+        'key': 'shop_key',
+        'natural_key': ['shop_name', 'shop_account'],
+        'attributes': [],
+    },
+    'dim_product': {
+        'key': 'product_key',
+        'natural_key': ['product_sku_main', 'product_sku_variation', 'product_name', 'product_variation'],
+        'attributes': [],
+    },
+    'dim_location': {
+        'key': 'location_key',
+        'natural_key': ['recipient_city', 'recipient_district', 'recipient_postal_code'],
+        'attributes': [],
+    },
+}
+
+# 事實表定義：來源 B 表與其關聯的維度
+FACTS = {
+    'fact_order_items': {'source': 'B02', 'dimensions': ['dim_shop', 'dim_product']},
+    'fact_order_shipping': {'source': 'B04', 'dimensions': ['dim_shop', 'dim_location']},
+}
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def dimension_path(dim_name):
+    return os.path.join(STAR_SCHEMA_OUTPUT_DIR, STAR_SCHEMA_DIMENSION_FILES[dim_name])
+
+
+def fact_path(fact_name):
+    return os.path.join(STAR_SCHEMA_OUTPUT_DIR, STAR_SCHEMA_FACT_FILES[fact_name])
+
+
+def has_dimensions():
+    return all(os.path.exists(dimension_path(dim_name)) for dim_name in DIMENSIONS)
+
+
+def load_dimension(dim_name):
+    """讀取既有維度表；不存在時回傳空表（代理鍵由 1 開始）"""
+    spec = DIMENSIONS[dim_name]
+    columns = [spec['key']] + spec['natural_key'] + spec['attributes']
+    path = dimension_path(dim_name)
+    if not os.path.exists(path):
+        dim = pd.DataFrame(columns=columns, dtype=object)
+    else:
+        dim = pd.read_csv(path, dtype=str, keep_default_na=False)[columns]
+    dim[spec['key']] = dim[spec['key']].astype(np.int32)
+    return dim
+
+
+def save_dimension(dim_name, dim):
+    """先寫暫存檔再取代，避免寫到一半中斷造成代理鍵遺失"""
+    path = dimension_path(dim_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    dim.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+    os.replace(tmp_path, path)
+
+
+def natural_key_index(df, natural_key):
+    return pd.MultiIndex.from_frame(df[natural_key].astype(str))
+
+
+def update_dimension(dim, source, spec):
+    """把 source 中出現的成員併入維度表，回傳 (更新後的維度表, source 每列對應的代理鍵)。
+
+    既有成員保留原代理鍵並以最新值更新屬性欄位；新成員依自然鍵排序後接續編號。"""
+    key, natural_key, attributes = spec['key'], spec['natural_key'], spec['attributes']
+    # source 依主檔順序排列，同一成員取最後一次出現的屬性（即最新匯入的資料）
+    observed = source[natural_key + attributes].drop_duplicates(subset=natural_key, keep='last')
+
+    is_new = ~natural_key_index(observed, natural_key).isin(natural_key_index(dim, natural_key))
+    new_members = observed[is_new].sort_values(natural_key, kind='stable')
+    next_key = int(dim[key].max()) + 1 if len(dim) else 1
+    if next_key + len(new_members) - 1 > INT32_MAX:
+        raise OverflowError(f"{key} 超出 int32 範圍")
+    new_members.insert(0, key, np.arange(next_key, next_key + len(new_members), dtype=np.int32))
+
+    dim = pd.concat([dim, new_members], ignore_index=True)
+    if attributes and len(observed):
+        latest = observed.set_index(natural_key_index(observed, natural_key))[attributes]
+        dim = dim.set_index(natural_key_index(dim, natural_key))
+        dim.update(latest)
+        dim = dim.reset_index(drop=True)
+    dim[key] = dim[key].astype(np.int32)
+
+    positions = natural_key_index(dim, natural_key).get_indexer(natural_key_index(source, natural_key))
+    return dim, dim[key].to_numpy()[positions]
+
+
+def build_star_schema(tables):
+    """由 B 表（全量或增量重算的部分）更新維度表並產生事實表，回傳 {事實表名稱: DataFrame}。
+
+    維度表在此直接寫回 STAR_SCHEMA_OUTPUT_DIR；事實表交由呼叫端寫出或改寫分區。"""
+    dims = {dim_name: load_dimension(dim_name) for dim_name in DIMENSIONS}
+    facts = {}
+    for fact_name, fact_spec in FACTS.items():
+        source = tables[fact_spec['source']]
+        fact = source.copy()
+        dropped = []
+        for position, dim_name in enumerate(fact_spec['dimensions'], start=1):
+            spec = DIMENSIONS[dim_name]
+            dims[dim_name], keys = update_dimension(dims[dim_name], source, spec)
+            # 代理鍵緊接在 order_sn 之後
+            fact.insert(position, spec['key'], keys)
+            dropped += spec['natural_key'] + spec['attributes']
+        facts[fact_name] = fact.drop(columns=[col for col in dropped if col in fact.columns])
+
+    for dim_name, dim in dims.items():
+        save_dimension(dim_name, dim.sort_values(DIMENSIONS[dim_name]['key']))
+    return facts
+
+
+def print_star_schema_summary(facts):
+    for dim_name in DIMENSIONS:
+        print(f'   -> {dim_name}：{len(load_dimension(dim_name))} 個成員')
+    for fact_name, fact in facts.items():
+        print(f'   -> {fact_name}：{len(fact)} 筆')
+
+
+def main():
+    # 讀取 B02 / B04
+    tables = {
+        code: pd.read_csv(os.path.join(B_TABLE_OUTPUT_DIR, B_TABLE_FILES[code]), dtype=str, keep_default_na=False)
+        for code in {fact_spec['source'] for fact_spec in FACTS.values()}
+    }
+
+    facts = build_star_schema(tables)
+    for fact_name, fact in facts.items():
+        fact.to_csv(fact_path(fact_name), index=False, encoding='utf-8-sig')
+        write_all_partitions(fact_name, fact)
+        print(f'完成：{fact_path(fact_name)} ({len(fact)} 筆)')
+
+    print('\n星狀結構輸出完成！')
+    print_star_schema_summary(facts)
+
+
+if __name__ == "__main__":
+    main()
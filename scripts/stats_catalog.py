@@ -0,0 +1,137 @@
+# stats_catalog.py
+# 主檔統計目錄：寫入主檔時一併記錄各平台分區 × 店家的統計，報表只讀這個小檔，不必載入整份主檔
+#   <主檔檔名>_stats.json
+#   {"updated_at": "2025-07-01 10:00:00",
+#    "partitions": {"normal": {"file": "A01_master_orders_cleaned.csv", "rows": 1234, "written_at": "...",
+#                              "shops": [{"shop_name": "有才寵物商店", "rows": 100, "distinct_orders": 60,
+#                                         "min_order_date": "2025-06-01", "max_order_date": "2025-06-30",
+#                                         "min_order_creation_timestamp": "...", "max_order_creation_timestamp": "...",
+#                                         "null_counts": {"shop_account": 100, ...}}, ...]},
+#                   "b2b": {...}}}
+#   null_counts 只列出有空值（NaN、空字串或 'nan' / 'None' 等讀回時會變成 NaN 的字樣）的欄位。
+# 與 platform_routing 相同不匯入 config（Google Sheet ETL 也會寫入主檔）。
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+
+from csv_na_tokens import CSV_NA_TOKENS
+
+STORE_COLUMN = 'shop_name'
+DATE_FORMATS = {'order_date': '%Y-%m-%d', 'order_creation_timestamp': '%Y-%m-%d %H:%M:%S'}
+# 文字欄位視為空值的內容（None 寫出後也是空字串；NaN 另以 NaN != NaN 判斷）
+NULL_VALUES = [*CSV_NA_TOKENS, None]
+
+
+def stats_catalog_path(master_path):
+    return f'{os.path.splitext(master_path)[0]}_stats.json'
+
+
+def load_stats_catalog(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_stats_catalog(catalog, path):
+    """先寫暫存檔再取代"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def null_mask(df):
+    """NaN、空字串或 CSV_NA_TOKENS（寫出後以 read_csv 讀回會變成 NaN 的字樣）。
+
+    文字欄位以雜湊比對（isin）加 NaN != NaN 判斷，比 isna 加逐格比對字串快"""
+    nulls = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            try:
+                nulls[col] = df[col].isin(NULL_VALUES).to_numpy() | (values != values)
+            except TypeError:
+                # 含 pd.NA 的欄位無法以 != 判斷
+                nulls[col] = df[col].isna().to_numpy() | df[col].isin(NULL_VALUES).to_numpy()
+        else:
+            nulls[col] = pd.isna(values)
+    return pd.DataFrame(nulls, index=df.index)
+
+
+def shop_statistics(df):
+    """依店家彙總一個分區：筆數、不重複訂單數、order_date / order_creation_timestamp 範圍與各欄空值數"""
+    if df.empty or STORE_COLUMN not in df.columns:
+        return []
+    shops = df[STORE_COLUMN].fillna('')
+    grouped = df.groupby(shops, sort=True)
+    stats = pd.DataFrame({'rows': grouped.size()})
+    if 'order_sn' in df.columns:
+        stats['distinct_orders'] = grouped['order_sn'].nunique()
+    for col, fmt in DATE_FORMATS.items():
+        if col not in df.columns:
+            continue
+        parsed = pd.to_datetime(df[col], errors='coerce').groupby(shops)
+        stats[f'min_{col}'] = parsed.min().dt.strftime(fmt)
+        stats[f'max_{col}'] = parsed.max().dt.strftime(fmt)
+    null_counts = null_mask(df).groupby(shops).sum()
+
+    records = []
+    for shop, row in stats.astype(object).where(stats.notna(), None).iterrows():
+        counts = null_counts.loc[shop]
+        records.append({
+            STORE_COLUMN: shop,
+            **row.to_dict(),
+            'null_counts': {col: int(n) for col, n in counts[counts > 0].items()},
+        })
+    return records
+
+
+def update_stats_catalog(path, partitions):
+    """partitions: {平台分類: (分區檔路徑, 資料)}；只取代這次寫入的分區，其餘分區的統計保留"""
+    catalog = load_stats_catalog(path) or {"partitions": {}}
+    written_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for platform, (partition_path, df) in partitions.items():
+        catalog["partitions"][platform] = {
+            "file": os.path.basename(partition_path),
+            "rows": len(df),
+            "written_at": written_at,
+            "shops": shop_statistics(df),
+        }
+    catalog["updated_at"] = written_at
+    save_stats_catalog(catalog, path)
+    return catalog
+
+
+def shop_summary(catalog):
+    """合併各分區的店家統計：每個店家一列（rows、distinct_orders 加總，日期取最小 / 最大）"""
+    records = [
+        {**{key: value for key, value in shop.items() if key != 'null_counts'}, 'partition': platform}
+        for platform, partition in catalog["partitions"].items()
+        for shop in partition["shops"]
+    ]
+    if not records:
+        return pd.DataFrame(columns=[STORE_COLUMN]).set_index(STORE_COLUMN)
+    df = pd.DataFrame(records)
+    aggregations = {'rows': 'sum', 'partition': lambda values: ','.join(sorted(set(values)))}
+    if 'distinct_orders' in df.columns:
+        aggregations['distinct_orders'] = 'sum'
+    for col in DATE_FORMATS:
+        if f'min_{col}' in df.columns:
+            df[f'min_{col}'] = pd.to_datetime(df[f'min_{col}'])
+            df[f'max_{col}'] = pd.to_datetime(df[f'max_{col}'])
+            aggregations[f'min_{col}'] = 'min'
+            aggregations[f'max_{col}'] = 'max'
+    return df.groupby(STORE_COLUMN).agg(aggregations)
+
+
+def column_null_counts(catalog, columns):
+    """各欄位的空值數（所有分區、店家加總），依 columns 順序"""
+    totals = Counter()
+    for partition in catalog["partitions"].values():
+        for shop in partition["shops"]:
+            totals.update(shop["null_counts"])
+    return pd.Series([totals[col] for col in columns], index=columns, dtype='int64')
@@ -9,7 +9,7 @@
     - 產生帶時間戳記的 Excel 報表，利於定期追蹤與稽核歸檔。
 
 主要功能：
-    1. 讀取主檔 CSV（預設路徑：master/orders_analyze_A_master_featured.csv），自動判斷店家名稱及訂單成立日期欄位。
+    1. 讀取主檔的統計目錄（A01_master_orders_cleaned_stats.json，ETL 寫入主檔時產生），取得各店家最新訂單成立時間，不需載入整份主檔。
     2. 根據內建店家簡稱清單（可自行維護），檢查哪些店家有資料、哪些為缺漏或名稱異常。
     3. 檢核每家店最新訂單是否已更新至門檻日期（如未達標自動標註）。
     4. 支援模糊比對，協助發現名稱接近但拼寫略異之店家，降低人為疏漏。
@@ -44,6 +44,8 @@ import os
 import pandas as pd
 from datetime import datetime # 確保 datetime 被正確引入
 from difflib import get_close_matches
+from platform_routing import platform_partition_paths, rebuild_stats_catalog
+from stats_catalog import load_stats_catalog, shop_summary, stats_catalog_path
 
 def main():
     # 1. 基本路徑與檔案設定
@@ -71,17 +73,18 @@ def main():
     # 3. 設定資料更新門檻日期
     threshold_date = datetime.strptime("2025/06/13", "%Y/%m/%d")
 
-    # 4. 讀取CSV，抓取欄位名稱
-    df = pd.read_csv(file_path, low_memory=False)
-    store_col = df.columns[0]    # 店家名稱欄（第一欄）
-    order_date_col = df.columns[9]  # 訂單成立日期欄（第四欄）
+    # 4. 讀取統計目錄（ETL 寫入主檔時產生，含一般與 B2B 分區），不需載入整份主檔
+    catalog = load_stats_catalog(stats_catalog_path(file_path))
+    if catalog is None:
+        print("尚未建立統計目錄，由主檔建立一次（之後 ETL 寫入主檔時會自動更新）...")
+        catalog = rebuild_stats_catalog(platform_partition_paths(file_path))
 
-    # 5. 將訂單成立日期轉成 datetime 格式
-    df[order_date_col] = pd.to_datetime(df[order_date_col], errors='coerce')
-    df_clean = df.dropna(subset=[store_col, order_date_col])
+    # 5. 合併各分區的店家統計
+    shop_stats = shop_summary(catalog)
 
-    # 6. 分組計算每家店最新訂單日期
-    latest_dates = df_clean.groupby(store_col)[order_date_col].max()
+    # 6. 每家店最新訂單日期（order_creation_timestamp 最大值）
+    latest_dates = shop_stats['max_order_creation_timestamp'].dropna()
+    latest_dates = latest_dates[latest_dates.index != '']
     present_stores = set(latest_dates.index)
 
     # 7. 找出完全不在資料中的店家（初步判斷）
@@ -0,0 +1,73 @@
+# upload_manifest.py
+# 上傳內容清單：記錄每張 BigQuery 表最後一次成功上傳的檔案內容，
+# 讓 upload_to_bq.py 跳過與上次上傳位元組完全相同的檔案（summary 中列為「未變更」）
+#   {"shopee-etl-reporting.shopee_data.b01_orders_concat": {
+#       "csv_file": "B01_orders_concat.csv", "file_sha256": "...", "rows": 1234,
+#       "schema_fingerprint": "...", "job_id": "...", "uploaded_at": "2025-07-01 10:00:00"}, ...}
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from config import UPLOAD_CONTENT_MANIFEST_PATH
+from bq_schema import schema_for_columns
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def load_upload_manifest(path=UPLOAD_CONTENT_MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_upload_manifest(manifest, path=UPLOAD_CONTENT_MANIFEST_PATH):
+    """先寫暫存檔再取代"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_fingerprint(csv_path, upload_format):
+    """讀一次檔案計算 sha256 與資料列數（以換行計，不含表頭），並由表頭欄位計算 schema 指紋。
+
+    schema 指紋包含上傳格式：改用 parquet（明確 schema）後即使內容相同也會重新上傳一次。"""
+    digest = hashlib.sha256()
+    lines = 0
+    header = b''
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            if not header:
+                header = chunk.split(b'\n', 1)[0]
+            digest.update(chunk)
+            lines += chunk.count(b'\n')
+
+    columns = header.decode('utf-8-sig').strip().split(',')
+    schema = [f'{field.name}:{field.field_type}' for field in schema_for_columns(columns)]
+    schema_digest = hashlib.sha256('|'.join([upload_format] + schema).encode('utf-8')).hexdigest()
+    return {
+        "file_sha256": digest.hexdigest(),
+        "rows": max(lines - 1, 0),
+        "schema_fingerprint": schema_digest,
+    }
+
+
+def is_unchanged(manifest, table_key, fingerprint):
+    entry = manifest.get(table_key)
+    return (
+        entry is not None
+        and entry["file_sha256"] == fingerprint["file_sha256"]
+        and entry["schema_fingerprint"] == fingerprint["schema_fingerprint"]
+    )
+
+
+def record_upload(manifest, table_key, csv_file, fingerprint, job_id):
+    manifest[table_key] = {
+        "csv_file": csv_file,
+        **fingerprint,
+        "job_id": job_id,
+        "uploaded_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
@@ -0,0 +1,64 @@
+# upload_partitions.py
+# 待上傳分區清單：記錄每次 ETL 合併異動的 order_date，
+# 讓 upload_to_bq.py 的增量模式只取代 BigQuery 中受影響的日分區，而不是 WRITE_TRUNCATE 整張表
+#   {"runs":   [{"run_id": 3, "full_rebuild": false, "dates": ["2025-06-01", ...]}, ...],
+#    "tables": {"b01_orders_concat": 3, ...}}
+#   runs   每次 ETL 一筆；dates 中的空字串代表 order_date 無法解析的訂單
+#   tables 各 BigQuery 表已上傳到哪一次 ETL；沒有紀錄的表（首次上傳）一律全量載入
+import json
+import os
+
+from config import UPLOAD_PARTITION_MANIFEST_PATH
+
+
+def load_manifest(path=UPLOAD_PARTITION_MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {"runs": [], "tables": {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=UPLOAD_PARTITION_MANIFEST_PATH):
+    """先寫暫存檔再取代，並移除所有表都已上傳過的 ETL 紀錄"""
+    if manifest["tables"]:
+        uploaded_through = min(manifest["tables"].values())
+        manifest["runs"] = [run for run in manifest["runs"] if run["run_id"] > uploaded_through]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def last_run_id(manifest):
+    run_ids = [run["run_id"] for run in manifest["runs"]] + list(manifest["tables"].values())
+    return max(run_ids, default=0)
+
+
+def record_etl_run(delta=None, path=UPLOAD_PARTITION_MANIFEST_PATH):
+    """ETL 主流程呼叫：記錄本次合併異動的日期（沒有 delta 或首次建立主檔時標記為全量）。回傳 run_id。"""
+    manifest = load_manifest(path)
+    run_id = last_run_id(manifest) + 1
+    full_rebuild = delta is None or delta.is_full_rebuild
+    manifest["runs"].append({
+        "run_id": run_id,
+        "full_rebuild": full_rebuild,
+        "dates": [] if full_rebuild else sorted(delta.touched_dates),
+    })
+    save_manifest(manifest, path)
+    return run_id
+
+
+def pending_partitions(manifest, table_id):
+    """回傳 (是否需全量載入, 待取代的日期, 上傳後可標記到的 run_id)"""
+    through = last_run_id(manifest)
+    if table_id not in manifest["tables"]:
+        return True, set(), through
+    pending = [run for run in manifest["runs"] if run["run_id"] > manifest["tables"][table_id]]
+    full = any(run["full_rebuild"] for run in pending)
+    dates = set().union(*(run["dates"] for run in pending)) if pending else set()
+    return full, dates, through
+
+
+def mark_uploaded(manifest, table_id, run_id):
+    manifest["tables"][table_id] = max(run_id, manifest["tables"].get(table_id, 0))
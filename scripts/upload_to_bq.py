@@ -7,17 +7,31 @@ BigQuery批量CSV檔案上傳腳本
 檔案位置: C:/Users/user/Documents/shopee_orders_etl/scripts/batch_upload_to_bq.py
 """
 
+import argparse
+import csv
 import os
 import sys
 import pandas as pd
+import requests
+from google.api_core import exceptions as api_exceptions
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound, Conflict
 from google.oauth2 import service_account
 import logging
+import time
 from datetime import datetime
+from functools import partial
 from typing import Optional, Dict, List
 from pathlib import Path
 
+from config import LOCAL_SINK_DIR
+from bq_schema import write_parquet, schema_for_columns
+from local_bq_sink import LocalBigQueryClient
+from upload_partitions import load_manifest, save_manifest, pending_partitions, mark_uploaded, last_run_id
+from upload_manifest import (
+    load_upload_manifest, save_upload_manifest, file_fingerprint, is_unchanged, record_upload
+)
+
 # 設定日誌記錄
 logging.basicConfig(
     level=logging.INFO,
@@ -29,13 +43,151 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 不需上傳的表（內容與上次成功上傳相同，或沒有異動的日分區）在摘要中列為「未變更」
+STATUS_UNCHANGED = "未變更"
+NO_PENDING_PARTITIONS = "沒有異動的分區"
+
+# 送出上傳時可重試的暫時性錯誤（配額 / 伺服器端 / 連線中斷）
+RETRYABLE_UPLOAD_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+# 增量上傳：目標表依 order_date 做日分區，只取代本次 ETL 異動的日期
+PARTITION_FIELD = "order_date"
+STAGING_SUFFIX = "__staging"
+# 暫存表只含異動日期的資料；ON FALSE 讓目標表中這些日期的舊列全部刪除、暫存表的列全部插入（單一交易）
+PARTITION_MERGE_SQL = """
+MERGE `{target}` AS target
+USING `{staging}` AS source
+ON FALSE
+WHEN NOT MATCHED BY SOURCE
+    AND (target.order_date IN UNNEST(@dates) OR (@include_null AND target.order_date IS NULL)) THEN DELETE
+WHEN NOT MATCHED THEN INSERT ROW
+"""
+
+
+class PartitionReplaceJob:
+    """暫存表載入完成後接著送出 MERGE；提供與載入作業相同的 done() / result() 介面，可直接放進並行輪詢"""
+    
+    def __init__(self, client, load_job, merge_sql: str, query_parameters: List, staging_ref):
+        self.client = client
+        self.load_job = load_job
+        self.merge_sql = merge_sql
+        self.query_parameters = query_parameters
+        self.staging_ref = staging_ref
+        self.merge_job = None
+        self.error = None
+    
+    @property
+    def job_id(self):
+        return self.merge_job.job_id if self.merge_job is not None else self.load_job.job_id
+    
+    @property
+    def input_file_bytes(self):
+        return getattr(self.load_job, "input_file_bytes", None)
+    
+    def _start_merge(self):
+        if self.merge_job is None:
+            self.load_job.result()
+            job_config = bigquery.QueryJobConfig(query_parameters=self.query_parameters)
+            self.merge_job = self.client.query(self.merge_sql, job_config=job_config)
+    
+    def done(self) -> bool:
+        if self.error is not None:
+            return True
+        if self.merge_job is None:
+            if not self.load_job.done():
+                return False
+            try:
+                self._start_merge()
+            except Exception as e:
+                self.error = e
+                return True
+        return self.merge_job.done()
+    
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        self._start_merge()
+        self.merge_job.result()
+        self.client.delete_table(self.staging_ref, not_found_ok=True)
+
+
+class RepartitionJob:
+    """既有的未分區表改為日分區：分區暫存表載入成功後才刪除舊表，再把暫存表複製成目標表。
+
+    載入（或 Parquet 轉換）失敗時舊表保持不變；提供與載入作業相同的 done() / result() 介面"""
+    
+    def __init__(self, client, load_job, staging_ref, table_ref):
+        self.client = client
+        self.load_job = load_job
+        self.staging_ref = staging_ref
+        self.table_ref = table_ref
+        self.copy_job = None
+        self.error = None
+    
+    @property
+    def job_id(self):
+        return self.copy_job.job_id if self.copy_job is not None else self.load_job.job_id
+    
+    @property
+    def input_file_bytes(self):
+        return getattr(self.load_job, "input_file_bytes", None)
+    
+    @property
+    def output_rows(self):
+        return getattr(self.load_job, "output_rows", None)
+    
+    def _start_copy(self):
+        if self.copy_job is None:
+            self.load_job.result()
+            self.client.delete_table(self.table_ref, not_found_ok=True)
+            self.copy_job = self.client.copy_table(self.staging_ref, self.table_ref)
+    
+    def done(self) -> bool:
+        if self.error is not None:
+            return True
+        if self.copy_job is None:
+            if not self.load_job.done():
+                return False
+            try:
+                self._start_copy()
+            except Exception as e:
+                self.error = e
+                return True
+        return self.copy_job.done()
+    
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        self._start_copy()
+        self.copy_job.result()
+        self.client.delete_table(self.staging_ref, not_found_ok=True)
+
+
 class BigQueryBatchUploader:
     """BigQuery批量CSV上傳工具類"""
     
     def __init__(self, 
                  credentials_path: str,
                  project_id: str,
-                 dataset_id: str = "shopee_data"):
+                 dataset_id: str = "shopee_data",
+                 client=None,
+                 max_concurrent_jobs: int = 1,
+                 poll_interval: float = 1.0,
+                 upload_format: str = "dataframe",
+                 incremental: bool = False,
+                 skip_unchanged: bool = True,
+                 max_retries: int = 5,
+                 retry_base_delay: float = 2.0,
+                 sink: str = "bigquery",
+                 local_sink_dir: str = LOCAL_SINK_DIR):
         """
         初始化BigQuery批量上傳器
         
@@ -43,15 +195,52 @@ class BigQueryBatchUploader:
             credentials_path: 服務帳戶憑證JSON檔案路徑
             project_id: Google Cloud專案ID
             dataset_id: BigQuery資料集ID
+            client: 已建立的BigQuery客戶端（可注入離線的假客戶端測試；None 時由 initialize_client 建立）
+            max_concurrent_jobs: 同時執行的載入作業上限（1 為逐一上傳）
+            poll_interval: 並行模式輪詢作業狀態的間隔秒數
+            upload_format: "dataframe"（pandas 推論型別 + autodetect）、
+                           "parquet"（依 BQ_SCHEMA 衍生的 schema 轉成壓縮 Parquet 後以明確 schema 載入）或
+                           "csv"（不經 pandas，直接串流磁碟上的 CSV 並以明確 schema 載入，記憶體用量與檔案大小無關）
+            incremental: 只取代 ETL 異動的 order_date 日分區（需搭配 parquet；首次上傳或全量重建時改為全量載入）
+            skip_unchanged: 跳過內容（sha256 與 schema 指紋）與上次成功上傳相同的檔案
+            max_retries: 上傳遇到暫時性錯誤時的重試次數
+            retry_base_delay: 第一次重試前等待的秒數，之後每次加倍（指數退避）
+            sink: "bigquery"（實際上傳）或 "local"（dry-run：寫入本機模擬的 BigQuery，見 local_bq_sink.py，
+                  不需憑證與網路，也不更新上傳清單）
+            local_sink_dir: sink="local" 時的本機資料集目錄
         """
         self.credentials_path = credentials_path
         self.project_id = project_id
         self.dataset_id = dataset_id
-        self.client = None
+        self.client = client
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.poll_interval = poll_interval
+        self.upload_format = upload_format
+        self.incremental = incremental and upload_format == "parquet"
+        if incremental and not self.incremental:
+            logger.warning("增量上傳需搭配 parquet 格式，改為全量上傳")
+        self.partition_manifest = None
+        self.pending_runs = {}  # table_id → 上傳成功後可標記到的 ETL run_id
+        self.skip_unchanged = skip_unchanged
+        self.content_manifest = {}
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.sink = sink
+        self.local_sink_dir = local_sink_dir
+        self.upload_metrics = {}  # table_id → 序列化 / 送出耗時與位元組數
         self.upload_results = []
         
     def initialize_client(self) -> bool:
-        """初始化BigQuery客戶端"""
+        """初始化BigQuery客戶端（已注入客戶端時直接使用）"""
+        if self.client is not None:
+            logger.info("使用已注入的BigQuery客戶端")
+            return True
+        
+        if self.sink == "local":
+            self.client = LocalBigQueryClient(self.project_id, self.local_sink_dir)
+            logger.info(f"🧪 dry-run：使用本機模擬的BigQuery（{self.local_sink_dir}）")
+            return True
+        
         try:
             # 檢查憑證檔案是否存在
             if not os.path.exists(self.credentials_path):
@@ -117,6 +306,245 @@ class BigQueryBatchUploader:
             logger.error(f"讀取CSV檔案失敗 {csv_path}: {str(e)}")
             return None
     
+    def start_load_job(self, df: pd.DataFrame, table_id: str, csv_filename: str,
+                       write_disposition: str = "WRITE_TRUNCATE"):
+        """送出載入作業後立即返回（不等待完成），回傳 (表格參考, 作業)"""
+        # 設定表格參考
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        
+        # 設定上傳設定
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = bigquery.SourceFormat.CSV
+        job_config.autodetect = True  # 自動偵測schema
+        job_config.write_disposition = write_disposition
+        
+        logger.info(f"開始上傳 {csv_filename} ({len(df)} 筆資料) 到 {self.project_id}.{self.dataset_id}.{table_id}")
+        
+        job = self.client.load_table_from_dataframe(
+            df, 
+            table_ref, 
+            job_config=job_config
+        )
+        return table_ref, job
+    
+    def table_key(self, table_id: str) -> str:
+        return f"{self.project_id}.{self.dataset_id}.{table_id}"
+    
+    def record_success(self, csv_filename: str, table_id: str, table_ref, rows_uploaded: int, job=None) -> Dict:
+        """作業完成後讀取表格資訊並記錄上傳結果（載入作業有 output_rows 時以 BigQuery 實際寫入的筆數為準）"""
+        rows_uploaded = getattr(job, "output_rows", None) or rows_uploaded
+        table = self.client.get_table(table_ref)
+        logger.info(f"✅ {csv_filename} 上傳完成！表格 {table_id} 現在有 {table.num_rows} 筆資料")
+        metrics = self.upload_metrics.get(table_id, {})
+        elapsed = time.perf_counter() - metrics["started"] if "started" in metrics else None
+        return {
+            "csv_file": csv_filename,
+            "table_id": table_id,
+            "status": "成功",
+            "rows_uploaded": rows_uploaded,
+            "final_rows": table.num_rows,
+            "table_size_bytes": table.num_bytes,
+            "job_id": getattr(job, "job_id", None),
+            "bytes_serialized": getattr(job, "input_file_bytes", None) or metrics.get("payload_bytes"),
+            "serialize_seconds": metrics.get("serialize_seconds"),
+            "submit_seconds": metrics.get("submit_seconds"),
+            "elapsed_seconds": elapsed,
+            "rows_per_second": rows_uploaded / elapsed if elapsed else None
+        }
+    
+    def record_failure(self, csv_filename: str, table_id: str, error: Exception) -> Dict:
+        logger.error(f"❌ 上傳 {csv_filename} 到 {table_id} 失敗: {str(error)}")
+        return {
+            "csv_file": csv_filename,
+            "table_id": table_id,
+            "status": "失敗",
+            "error": str(error),
+            "rows_uploaded": 0,
+            "final_rows": 0,
+            "table_size_bytes": 0
+        }
+    
+    def prepare_parquet_file(self, csv_path: str) -> Optional[tuple]:
+        """CSV → 具型別的壓縮 Parquet，回傳 (parquet 路徑, 筆數, schema)；檔案不存在時回傳 None"""
+        if not os.path.exists(csv_path):
+            logger.warning(f"CSV檔案不存在，跳過: {csv_path}")
+            return None
+        
+        parquet_path, rows, schema = write_parquet(csv_path)
+        size_mb = os.path.getsize(parquet_path) / (1024 * 1024)
+        logger.info(f"已轉換 {Path(csv_path).name} → {Path(parquet_path).name}，共 {rows} 筆資料，{size_mb:.1f} MB")
+        return parquet_path, rows, schema
+    
+    def start_parquet_load_job(self, parquet_path: str, schema: List, table_id: str, csv_filename: str,
+                               write_disposition: str = "WRITE_TRUNCATE", partitioned: bool = False):
+        """以明確 schema 載入 Parquet 檔（不使用 autodetect），送出後立即返回 (表格參考, 作業)"""
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        job_config.schema = schema
+        job_config.write_disposition = write_disposition
+        if partitioned:
+            job_config.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field=PARTITION_FIELD)
+        
+        logger.info(f"開始上傳 {Path(parquet_path).name} 到 {self.project_id}.{self.dataset_id}.{table_id}")
+        
+        job = self.load_file_with_retry(parquet_path, table_ref, job_config)
+        return table_ref, job
+    
+    def load_file_with_retry(self, path: str, table_ref, job_config):
+        """
+        以 load_table_from_file 直接串流磁碟上的檔案，不讀進記憶體。
+        超過 5 MB 的檔案由客戶端以分段 resumable upload 送出（單段失敗時重送該段，最多 max_retries 次）；
+        整個上傳遇到暫時性錯誤時以指數退避重新送出。
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with open(path, 'rb') as f:
+                    return self.client.load_table_from_file(
+                        f, table_ref, job_config=job_config,
+                        size=os.path.getsize(path), num_retries=self.max_retries
+                    )
+            except RETRYABLE_UPLOAD_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_base_delay * 2 ** attempt
+                logger.warning(f"上傳 {Path(path).name} 暫時失敗（{e}），{delay:.0f} 秒後重試（{attempt + 1}/{self.max_retries}）")
+                time.sleep(delay)
+    
+    def csv_schema(self, csv_path: str) -> List:
+        """只讀取表頭一行，依欄位名稱由 BQ_SCHEMA 衍生 schema"""
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            columns = next(csv.reader(f))
+        return schema_for_columns(columns)
+    
+    def start_csv_load_job(self, csv_path: str, schema: List, table_id: str, csv_filename: str,
+                           write_disposition: str = "WRITE_TRUNCATE"):
+        """直接串流 CSV 檔並以明確 schema 載入（不經 pandas），送出後立即返回 (表格參考, 作業)"""
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = bigquery.SourceFormat.CSV
+        job_config.schema = schema
+        job_config.skip_leading_rows = 1
+        job_config.allow_quoted_newlines = True  # 備註欄位可能含換行
+        job_config.encoding = "UTF-8"
+        job_config.write_disposition = write_disposition
+        
+        size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+        logger.info(f"開始串流上傳 {csv_filename}（{size_mb:.1f} MB）到 {self.project_id}.{self.dataset_id}.{table_id}")
+        
+        job = self.load_file_with_retry(csv_path, table_ref, job_config)
+        return table_ref, job
+    
+    def start_partition_replace_job(self, parquet_path: str, schema: List, table_id: str, csv_filename: str,
+                                    dates: set):
+        """異動日期的資料先載入暫存表，再以 MERGE 取代目標表中這些日期的分區"""
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        staging_ref = self.client.dataset(self.dataset_id).table(f"{table_id}{STAGING_SUFFIX}")
+        
+        job_config = bigquery.LoadJobConfig()
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        job_config.schema = schema
+        job_config.write_disposition = "WRITE_TRUNCATE"
+        
+        logger.info(f"開始取代 {table_id} 的 {len(dates)} 個日分區（{Path(parquet_path).name} → {table_id}{STAGING_SUFFIX}）")
+        
+        load_job = self.load_file_with_retry(parquet_path, staging_ref, job_config)
+        
+        merge_sql = PARTITION_MERGE_SQL.format(
+            target=f"{self.project_id}.{self.dataset_id}.{table_id}",
+            staging=f"{self.project_id}.{self.dataset_id}.{table_id}{STAGING_SUFFIX}",
+        )
+        query_parameters = [
+            bigquery.ArrayQueryParameter("dates", "DATE", sorted(datetime.strptime(d, "%Y-%m-%d").date() for d in dates if d)),
+            bigquery.ScalarQueryParameter("include_null", "BOOL", "" in dates),
+        ]
+        return table_ref, PartitionReplaceJob(self.client, load_job, merge_sql, query_parameters, staging_ref)
+    
+    def start_repartition_job(self, parquet_path: str, schema: List, table_id: str, csv_filename: str):
+        """全量資料先載入依 order_date 分區的暫存表，成功後才取代未分區的既有表（見 RepartitionJob）"""
+        table_ref = self.client.dataset(self.dataset_id).table(table_id)
+        logger.info(f"{table_id} 改為依 {PARTITION_FIELD} 分區：先載入 {table_id}{STAGING_SUFFIX}，成功後再取代舊表")
+        staging_ref, load_job = self.start_parquet_load_job(
+            parquet_path, schema, f"{table_id}{STAGING_SUFFIX}", csv_filename, partitioned=True)
+        return table_ref, RepartitionJob(self.client, load_job, staging_ref, table_ref)
+    
+    def is_day_partitioned(self, table_id: str) -> Optional[bool]:
+        """目標表是否已依 order_date 日分區；表不存在時回傳 None"""
+        try:
+            table = self.client.get_table(self.client.dataset(self.dataset_id).table(table_id))
+        except NotFound:
+            return None
+        partitioning = table.time_partitioning
+        return partitioning is not None and partitioning.field == PARTITION_FIELD
+    
+    def prepare_partition_upload(self, csv_path: str, csv_filename: str, table_id: str) -> tuple:
+        """增量模式：依待上傳分區清單決定全量載入或只取代異動的日分區。回傳 (上傳資料, 跳過原因)"""
+        if not os.path.exists(csv_path):
+            logger.warning(f"CSV檔案不存在，跳過: {csv_path}")
+            return None, "檔案不存在"
+        
+        full, dates, run_id = pending_partitions(self.partition_manifest, table_id)
+        self.pending_runs[table_id] = run_id
+        if not full and not dates:
+            logger.info(f"{csv_filename} 自上次上傳後沒有異動的分區")
+            return None, "沒有異動的分區"
+        
+        partitioned = PARTITION_FIELD in pd.read_csv(csv_path, nrows=0, encoding='utf-8-sig').columns
+        day_partitioned = self.is_day_partitioned(table_id) if partitioned else None
+        if partitioned and not day_partitioned:
+            full = True
+        
+        if full or not partitioned:
+            parquet_path, rows, schema = write_parquet(csv_path)
+            self.note_payload(table_id, parquet_path)
+            logger.info(f"{csv_filename} 全量載入 {rows} 筆資料")
+            if day_partitioned is False:
+                # 既有的未分區表無法以載入作業改成分區表；載入成功前不刪除舊表
+                logger.warning(f"{table_id} 尚未依 {PARTITION_FIELD} 分區，載入暫存表後重新建立")
+                start = partial(self.start_repartition_job, parquet_path, schema, table_id, csv_filename)
+            else:
+                start = partial(self.start_parquet_load_job, parquet_path, schema, table_id, csv_filename,
+                                partitioned=partitioned)
+            return (csv_filename, table_id, rows, start), None
+        
+        parquet_path, rows, schema = write_parquet(csv_path, order_dates=dates)
+        self.note_payload(table_id, parquet_path)
+        logger.info(f"{csv_filename} 只上傳 {len(dates)} 個異動日期，共 {rows} 筆資料")
+        start = partial(self.start_partition_replace_job, parquet_path, schema, table_id, csv_filename, dates)
+        return (csv_filename, table_id, rows, start), None
+    
+    def note_payload(self, table_id: str, path: str):
+        """記錄要送出的檔案大小（作業沒有回報 input_file_bytes 時使用）"""
+        self.upload_metrics.setdefault(table_id, {})["payload_bytes"] = os.path.getsize(path)
+    
+    def submit(self, table_id: str, start):
+        """送出作業並記錄耗時（檔案上傳為傳輸時間；dataframe 模式另含客戶端序列化時間）"""
+        submitted = time.perf_counter()
+        table_ref, job = start()
+        self.upload_metrics.setdefault(table_id, {})["submit_seconds"] = time.perf_counter() - submitted
+        return table_ref, job
+    
+    def run_load_job(self, csv_filename: str, table_id: str, rows: int, start) -> bool:
+        """逐一上傳：送出作業（start 回傳 (表格參考, 作業)）並等待完成，記錄結果"""
+        try:
+            table_ref, job = self.submit(table_id, start)
+            
+            # 等待作業完成
+            job.result()
+            
+            # 記錄上傳結果
+            self.upload_results.append(self.record_success(
+                csv_filename, table_id, table_ref, rows, job))
+            return True
+            
+        except Exception as e:
+            # 記錄失敗結果
+            self.upload_results.append(self.record_failure(csv_filename, table_id, e))
+            return False
+    
     def upload_dataframe_to_table(self, 
                                  df: pd.DataFrame, 
                                  table_id: str, 
@@ -131,59 +559,79 @@ class BigQueryBatchUploader:
             csv_filename: CSV檔案名稱（用於日誌）
             write_disposition: 寫入模式
         """
-        try:
-            # 設定表格參考
-            table_ref = self.client.dataset(self.dataset_id).table(table_id)
-            
-            # 設定上傳設定
-            job_config = bigquery.LoadJobConfig()
-            job_config.source_format = bigquery.SourceFormat.CSV
-            job_config.autodetect = True  # 自動偵測schema
-            job_config.write_disposition = write_disposition
-            
-            logger.info(f"開始上傳 {csv_filename} ({len(df)} 筆資料) 到 {self.project_id}.{self.dataset_id}.{table_id}")
-            
-            # 開始上傳
-            job = self.client.load_table_from_dataframe(
-                df, 
-                table_ref, 
-                job_config=job_config
-            )
-            
-            # 等待作業完成
-            job.result()
-            
-            # 檢查結果
-            table = self.client.get_table(table_ref)
-            logger.info(f"✅ {csv_filename} 上傳完成！表格 {table_id} 現在有 {table.num_rows} 筆資料")
-            
-            # 記錄上傳結果
-            self.upload_results.append({
-                "csv_file": csv_filename,
-                "table_id": table_id,
-                "status": "成功",
-                "rows_uploaded": len(df),
-                "final_rows": table.num_rows,
-                "table_size_bytes": table.num_bytes
-            })
-            
-            return True
+        start = partial(self.start_load_job, df, table_id, csv_filename, write_disposition)
+        return self.run_load_job(csv_filename, table_id, len(df), start)
+    
+    def upload_concurrently(self, uploads: List[tuple]) -> List[Dict]:
+        """
+        並行上傳：最多同時送出 max_concurrent_jobs 個載入作業，一起輪詢狀態，
+        有作業結束就補上下一個。
+        
+        Args:
+            uploads: (csv_filename, table_id, 筆數, start) 的清單；start() 送出作業並回傳 (表格參考, 作業)
             
-        except Exception as e:
-            logger.error(f"❌ 上傳 {csv_filename} 到 {table_id} 失敗: {str(e)}")
+        Returns:
+            依 uploads 順序排列的上傳結果
+        """
+        results = [None] * len(uploads)
+        pending = list(enumerate(uploads))
+        running = {}  # index -> (table_ref, job)
+        
+        while pending or running:
+            # 補滿可用的作業數
+            while pending and len(running) < max(self.max_concurrent_jobs, 1):
+                index, (csv_filename, table_id, rows, start) = pending.pop(0)
+                try:
+                    running[index] = self.submit(table_id, start)
+                except Exception as e:
+                    results[index] = self.record_failure(csv_filename, table_id, e)
             
-            # 記錄失敗結果
-            self.upload_results.append({
-                "csv_file": csv_filename,
-                "table_id": table_id,
-                "status": "失敗",
-                "error": str(e),
-                "rows_uploaded": 0,
-                "final_rows": 0,
-                "table_size_bytes": 0
-            })
+            # 輪詢所有執行中的作業
+            finished = [index for index, (_, job) in running.items() if job.done()]
+            for index in finished:
+                table_ref, job = running.pop(index)
+                csv_filename, table_id, rows, _ = uploads[index]
+                try:
+                    job.result()
+                    results[index] = self.record_success(
+                        csv_filename, table_id, table_ref, rows, job)
+                except Exception as e:
+                    results[index] = self.record_failure(csv_filename, table_id, e)
             
-            return False
+            if running and not finished:
+                time.sleep(self.poll_interval)
+        
+        return results
+    
+    def prepare_upload(self, csv_path: str, csv_filename: str, table_id: str,
+                       fingerprint: Optional[Dict] = None) -> tuple:
+        """依上傳模式準備上傳資料，回傳 ((csv_filename, table_id, 筆數, start), 跳過原因)；需跳過時上傳資料為 None"""
+        if self.incremental:
+            return self.prepare_partition_upload(csv_path, csv_filename, table_id)
+        
+        if self.upload_format == "csv":
+            if not os.path.exists(csv_path):
+                logger.warning(f"CSV檔案不存在，跳過: {csv_path}")
+                return None, "檔案不存在"
+            # 筆數取自計算 sha256 時的換行數（不解析整份 CSV）；上傳完成後以載入作業的 output_rows 為準
+            rows = (fingerprint or file_fingerprint(csv_path, self.upload_format))["rows"]
+            self.note_payload(table_id, csv_path)
+            return (csv_filename, table_id, rows, partial(
+                self.start_csv_load_job, csv_path, self.csv_schema(csv_path), table_id, csv_filename)), None
+        
+        if self.upload_format == "parquet":
+            prepared = self.prepare_parquet_file(csv_path)
+            if prepared is None:
+                return None, "檔案不存在"
+            parquet_path, rows, schema = prepared
+            self.note_payload(table_id, parquet_path)
+            return (csv_filename, table_id, rows, partial(
+                self.start_parquet_load_job, parquet_path, schema, table_id, csv_filename)), None
+        
+        df = self.read_csv_file(csv_path)
+        if df is None:
+            return None, "檔案不存在"
+        return (csv_filename, table_id, len(df), partial(self.start_load_job, df, table_id, csv_filename)), None
     
     def batch_upload(self, file_table_mapping: Dict[str, str], csv_directory: str) -> Dict:
         """
@@ -196,50 +644,135 @@ class BigQueryBatchUploader:
         Returns:
             上傳結果摘要
         """
-        logger.info(f"=== 開始批量上傳 {len(file_table_mapping)} 個檔案 ===")
+        concurrent = self.max_concurrent_jobs > 1
+        mode = f"並行（最多 {self.max_concurrent_jobs} 個作業）" if concurrent else "逐一"
+        logger.info(f"=== 開始批量上傳 {len(file_table_mapping)} 個檔案，{mode}上傳（{self.upload_format}）===")
         
         success_count = 0
         skip_count = 0
         fail_count = 0
+        unchanged_count = 0
+        uploads = []
+        first_result = len(self.upload_results)
+        self.content_manifest = load_upload_manifest()
+        fingerprints = {}
+        if self.incremental:
+            self.partition_manifest = load_manifest()
+            self.pending_runs = {}
         
         for csv_filename, table_id in file_table_mapping.items():
             csv_path = os.path.join(csv_directory, csv_filename)
             
             logger.info(f"\n--- 處理檔案: {csv_filename} → {table_id} ---")
             
-            # 讀取CSV檔案
-            df = self.read_csv_file(csv_path)
+            # 內容與上次成功上傳相同時不再上傳
+            if os.path.exists(csv_path):
+                fingerprint = file_fingerprint(csv_path, self.upload_format)
+                fingerprints[table_id] = fingerprint
+                if self.skip_unchanged and is_unchanged(self.content_manifest, self.table_key(table_id), fingerprint):
+                    unchanged_count += 1
+                    self.upload_results.append(self.record_unchanged(csv_filename, table_id))
+                    continue
             
-            if df is None:
-                skip_count += 1
+            # 讀取CSV檔案（parquet 模式改為轉換成 Parquet）
+            metrics = self.upload_metrics.setdefault(table_id, {})
+            metrics["started"] = time.perf_counter()
+            try:
+                upload, skip_reason = self.prepare_upload(csv_path, csv_filename, table_id, fingerprints.get(table_id))
+                metrics["serialize_seconds"] = time.perf_counter() - metrics["started"]
+            except Exception as e:
+                fail_count += 1
+                self.upload_results.append(self.record_failure(csv_filename, table_id, e))
+                continue
+            
+            if upload is None:
+                if skip_reason == NO_PENDING_PARTITIONS:
+                    unchanged_count += 1
+                else:
+                    skip_count += 1
                 self.upload_results.append({
                     "csv_file": csv_filename,
                     "table_id": table_id,
-                    "status": "跳過",
-                    "error": "檔案不存在",
+                    "status": STATUS_UNCHANGED if skip_reason == NO_PENDING_PARTITIONS else "跳過",
+                    "error": skip_reason,
                     "rows_uploaded": 0,
                     "final_rows": 0,
                     "table_size_bytes": 0
                 })
                 continue
             
+            if concurrent:
+                uploads.append(upload)
+                continue
+            
             # 上傳到BigQuery
-            if self.upload_dataframe_to_table(df, table_id, csv_filename):
+            if self.run_load_job(*upload):
                 success_count += 1
             else:
                 fail_count += 1
         
+        if uploads:
+            results = self.upload_concurrently(uploads)
+            self.upload_results.extend(results)
+            success_count += sum(result["status"] == "成功" for result in results)
+            fail_count += sum(result["status"] == "失敗" for result in results)
+            # 跳過的檔案先記錄，依原本的檔案順序重新排列本次結果
+            order = {csv_filename: index for index, csv_filename in enumerate(file_table_mapping)}
+            self.upload_results[first_result:] = sorted(
+                self.upload_results[first_result:], key=lambda result: order[result["csv_file"]])
+        
+        self.save_upload_manifest(self.upload_results[first_result:], fingerprints)
+        if self.incremental:
+            self.save_uploaded_partitions(self.upload_results[first_result:])
+        
         # 返回摘要
         summary = {
             "total_files": len(file_table_mapping),
             "success": success_count,
             "skipped": skip_count,
+            "unchanged": unchanged_count,
             "failed": fail_count,
             "details": self.upload_results
         }
         
         return summary
     
+    def record_unchanged(self, csv_filename: str, table_id: str) -> Dict:
+        entry = self.content_manifest[self.table_key(table_id)]
+        logger.info(f"⏸️ {csv_filename} 與上次上傳（{entry['uploaded_at']}）內容相同，不需上傳")
+        return {
+            "csv_file": csv_filename,
+            "table_id": table_id,
+            "status": STATUS_UNCHANGED,
+            "error": f"內容與上次上傳相同（job: {entry['job_id']}）",
+            "rows_uploaded": 0,
+            "final_rows": entry["rows"],
+            "table_size_bytes": 0
+        }
+    
+    def save_upload_manifest(self, results: List[Dict], fingerprints: Dict):
+        """上傳成功的表記錄本次檔案指紋與 job id；失敗的表移除紀錄，下次一定重新上傳（dry-run 不更新）"""
+        if self.sink == "local":
+            return
+        for result in results:
+            table_key = self.table_key(result["table_id"])
+            if result["status"] == "成功":
+                record_upload(self.content_manifest, table_key, result["csv_file"],
+                              fingerprints[result["table_id"]], result["job_id"])
+            elif result["status"] == "失敗":
+                self.content_manifest.pop(table_key, None)
+        save_upload_manifest(self.content_manifest)
+    
+    def save_uploaded_partitions(self, results: List[Dict]):
+        """上傳成功（或未變更）的表標記為已上傳到最新一次 ETL；失敗的表下次重送相同日期（dry-run 不更新）"""
+        if self.sink == "local":
+            return
+        for result in results:
+            if result["status"] in ("成功", STATUS_UNCHANGED):
+                run_id = self.pending_runs.get(result["table_id"], last_run_id(self.partition_manifest))
+                mark_uploaded(self.partition_manifest, result["table_id"], run_id)
+        save_manifest(self.partition_manifest)
+    
     def print_summary(self, summary: Dict):
         """列印上傳結果摘要"""
         logger.info("\n" + "="*60)
@@ -247,6 +780,7 @@ class BigQueryBatchUploader:
         logger.info("="*60)
         logger.info(f"總檔案數: {summary['total_files']}")
         logger.info(f"✅ 成功: {summary['success']}")
+        logger.info(f"⏸️  未變更: {summary['unchanged']}")
         logger.info(f"⏭️  跳過: {summary['skipped']}")
         logger.info(f"❌ 失敗: {summary['failed']}")
         
@@ -254,12 +788,17 @@ class BigQueryBatchUploader:
         logger.info("-" * 60)
         
         for result in summary['details']:
-            status_icon = {"成功": "✅", "跳過": "⏭️", "失敗": "❌"}.get(result['status'], "❓")
+            status_icon = {"成功": "✅", STATUS_UNCHANGED: "⏸️", "跳過": "⏭️", "失敗": "❌"}.get(result['status'], "❓")
             
             if result['status'] == "成功":
                 size_mb = result['table_size_bytes'] / (1024 * 1024)
                 logger.info(f"{status_icon} {result['csv_file']} → {result['table_id']}")
                 logger.info(f"    資料筆數: {result['final_rows']:,} | 大小: {size_mb:.1f} MB")
+                if result.get('elapsed_seconds'):
+                    serialized_mb = (result['bytes_serialized'] or 0) / (1024 * 1024)
+                    logger.info(f"    序列化: {serialized_mb:.1f} MB / {result['serialize_seconds']:.2f} 秒 | "
+                                f"送出: {result['submit_seconds']:.2f} 秒 | 總耗時: {result['elapsed_seconds']:.2f} 秒 | "
+                                f"{result['rows_per_second']:,.0f} 筆/秒")
             else:
                 logger.info(f"{status_icon} {result['csv_file']} → {result['table_id']}")
                 if 'error' in result:
@@ -273,7 +812,12 @@ def main():
         "B01_orders_concat.csv": "b01_orders_concat",
         "B02_order_details.csv": "b02_order_details", 
         "B03_order_simple_details.csv": "b03_order_simple_details",
-        "B04_order_shipping_info.csv": "b04_order_shipping_info"
+        "B04_order_shipping_info.csv": "b04_order_shipping_info",
+        "C01_daily_shop_sku_sales.csv": "c01_daily_shop_sku_sales",
+        "C02_voucher_cube.csv": "c02_voucher_cube",
+        "C03_buyer_aggregates.csv": "c03_buyer_aggregates",
+        "C04_order_shipping_sla.csv": "c04_order_shipping_sla",
+        "C05_daily_shipping_sla.csv": "c05_daily_shipping_sla"
     }
     
     # 設定路徑
@@ -283,17 +827,32 @@ def main():
     # BigQuery設定
     PROJECT_ID = "shopee-etl-reporting"
     DATASET_ID = "shopee_data"
+    MAX_CONCURRENT_JOBS = 4  # 同時執行的載入作業數（1 為逐一上傳）
+    UPLOAD_FORMAT = "parquet"  # "parquet"：明確 schema；"csv"：直接串流 CSV（不經 pandas）；"dataframe"：舊版 autodetect
+    INCREMENTAL_UPLOAD = True  # 只取代 ETL 異動的日分區（首次上傳自動全量載入）
+    
+    parser = argparse.ArgumentParser(description="BigQuery批量CSV上傳")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="寫入本機模擬的BigQuery（不需憑證與網路），比較各格式的序列化成本與吞吐量")
+    parser.add_argument('--format', choices=['parquet', 'csv', 'dataframe'], default=UPLOAD_FORMAT, help="上傳格式")
+    parser.add_argument('--max-concurrent-jobs', type=int, default=MAX_CONCURRENT_JOBS, help="同時執行的載入作業數")
+    args = parser.parse_args()
     
     logger.info("🚀 BigQuery批量CSV上傳開始")
     logger.info(f"⏰ 時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info(f"📁 來源目錄: {csv_directory}")
-    logger.info(f"🎯 目標專案: {PROJECT_ID}.{DATASET_ID}")
+    logger.info(f"🎯 目標專案: {PROJECT_ID}.{DATASET_ID}{'（dry-run）' if args.dry_run else ''}")
     
     # 建立批量上傳器
     uploader = BigQueryBatchUploader(
         credentials_path=credentials_path,
         project_id=PROJECT_ID,
-        dataset_id=DATASET_ID
+        dataset_id=DATASET_ID,
+        max_concurrent_jobs=args.max_concurrent_jobs,
+        upload_format=args.format,
+        incremental=INCREMENTAL_UPLOAD,
+        skip_unchanged=not args.dry_run,
+        sink="local" if args.dry_run else "bigquery"
     )
     
     # 初始化客戶端
@@ -316,7 +875,7 @@ def main():
     if summary['failed'] > 0:
         logger.warning("⚠️  部分檔案上傳失敗")
         sys.exit(1)
-    elif summary['success'] == 0:
+    elif summary['success'] == 0 and summary['unchanged'] == 0:
         logger.warning("⚠️  沒有任何檔案成功上傳")
         sys.exit(1)
     else:
@@ -0,0 +1,70 @@
+# voucher_cube.py
+# C02 優惠券使用彙總表（voucher cube）
+#   每日 × 商店 × 優惠券欄位（seller_voucher / voucher）的訂單數、使用 / 未使用 / 空值筆數、
+#   使用金額加總與最小 / 最大值，以及與 Voucher_usage_rate.py 相同分箱的金額分佈。
+#   任意日期區間的使用率只需加總區間內的列，不必重讀整份主檔。
+#   - ETL 主流程：由 sales_rollup.ROLLUP_TABLES 註冊，run_fanout_stage() 只重算觸及的日期
+#   - 查詢：Voucher_usage_rate.py
+import pandas as pd
+
+# 分析的優惠券欄位 → 中文名稱
+VOUCHER_COLUMNS = {
+    'seller_voucher': '賣家優惠券',
+    'voucher': '蝦皮優惠券',
+}
+
+# 金額分佈分箱（左閉右開，沿用 Voucher_usage_rate.py 原本的設定）
+VOUCHER_AMOUNT_BINS = [0, 10, 25, 50, 100, 200, 500, float('inf')]
+VOUCHER_AMOUNT_LABELS = ['1-10元', '11-25元', '26-50元', '51-100元', '101-200元', '201-500元', '500元以上']
+VOUCHER_BIN_COLUMNS = [
+    'amount_0_10', 'amount_10_25', 'amount_25_50', 'amount_50_100',
+    'amount_100_200', 'amount_200_500', 'amount_500_plus'
+]
+
+VOUCHER_CUBE_GRAIN = ['order_date', 'shop_account', 'voucher_type']
+# 由主檔建立彙總表只需要的欄位
+VOUCHER_SOURCE_COLUMNS = ['order_sn', 'order_date', 'shop_account', *VOUCHER_COLUMNS]
+
+# 各度量欄位在合併多列時的計算方式
+VOUCHER_CUBE_MEASURES = {
+    'order_count': 'sum',
+    'used_count': 'sum',
+    'zero_count': 'sum',
+    'null_count': 'sum',
+    'used_amount': 'sum',
+    'used_amount_min': 'min',
+    'used_amount_max': 'max',
+    **{col: 'sum' for col in VOUCHER_BIN_COLUMNS},
+}
+
+
+def build_voucher_cube(df):
+    """由全字串主檔產生優惠券彙總表；與原分析相同，先依 order_sn 去重（保留第一筆）。"""
+    orders = df.drop_duplicates(subset=['order_sn'], keep='first')
+    frames = []
+    for column in VOUCHER_COLUMNS:
+        amount = pd.to_numeric(orders[column], errors='coerce')
+        used = amount > 0
+        cells = orders[['order_date', 'shop_account']].copy()
+        cells['voucher_type'] = column
+        cells['order_count'] = 1
+        cells['used_count'] = used.astype('int64')
+        cells['zero_count'] = (amount == 0).astype('int64')
+        cells['null_count'] = amount.isna().astype('int64')
+        cells['used_amount'] = amount.where(used, 0)
+        cells['used_amount_min'] = amount.where(used)
+        cells['used_amount_max'] = amount.where(used)
+        ranges = pd.cut(amount.where(used), bins=VOUCHER_AMOUNT_BINS, labels=VOUCHER_BIN_COLUMNS, right=False)
+        cells = pd.concat([cells, pd.get_dummies(ranges).astype('int64')], axis=1)
+        frames.append(cells)
+
+    cube = pd.concat(frames, ignore_index=True)
+    cube = cube.groupby(VOUCHER_CUBE_GRAIN, sort=True).agg(VOUCHER_CUBE_MEASURES).reset_index()
+    cube['used_amount'] = cube['used_amount'].round(2)
+    return cube
+
+
+def summarize_voucher_cube(cube):
+    """把多列（多日 / 多商店）合併為每個優惠券欄位一列"""
+    measures = {col: how for col, how in VOUCHER_CUBE_MEASURES.items() if col in cube.columns}
+    return cube.groupby('voucher_type', sort=False).agg(measures)